@@ -0,0 +1,80 @@
+"""
+    Completions benchmark
+    ~~~~~~~~~~~~~~~~~~~~~
+
+Measures the latency of search-as-you-type lookups in the title index
+and the term dictionary, the in-memory work behind every request to
+``/search/complete/``, and how long a title change takes to apply.
+
+Run from the Riki directory::
+
+    python -m benchmarks.bench_completions --titles 100000 --terms 1000000
+"""
+import argparse
+import random
+import time
+
+from benchmarks.bench_term_dictionary import make_vocabulary
+from wiki.web.completions import TitleIndex
+from wiki.web.terms import TermDictionary
+
+
+def percentiles(times):
+    times = sorted(times)
+    return sum(times) / len(times), times[len(times) * 99 // 100], times[-1]
+
+
+def measure(lookup, prefixes):
+    times = []
+    for prefix in prefixes:
+        started = time.perf_counter()
+        lookup(prefix)
+        times.append((time.perf_counter() - started) * 1000)
+    return percentiles(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--titles", type=int, default=100000)
+    parser.add_argument("--terms", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    vocabulary = make_vocabulary(args.terms)
+    entries = [
+        {
+            "path": "/page{}.md".format(i),
+            "url": "page{}".format(i),
+            "title": " ".join(rng.choice(vocabulary).capitalize() for _ in range(rng.randint(1, 5))),
+        }
+        for i in range(args.titles)
+    ]
+
+    titles = TitleIndex()
+    started = time.perf_counter()
+    titles.load(entries)
+    print("Loaded %d titles in %.2fs" % (len(titles), time.perf_counter() - started))
+
+    terms = TermDictionary()
+    started = time.perf_counter()
+    terms.load((term, rng.randint(1, 100)) for term in vocabulary)
+    print("Loaded %d terms in %.2fs" % (len(terms), time.perf_counter() - started))
+
+    samples = rng.sample(vocabulary, args.queries)
+    print("%18s %10s %10s %10s" % ("lookup", "mean ms", "p99 ms", "max ms"))
+    for length in (1, 2, 3, 5):
+        prefixes = [term[:length] for term in samples]
+        print("%18s %10.3f %10.3f %10.3f" % (("titles, %d chars" % length,) + measure(titles.complete, prefixes)))
+        print("%18s %10.3f %10.3f %10.3f" % (("terms, %d chars" % length,) + measure(terms.prefixed, prefixes)))
+
+    times = []
+    for entry in rng.sample(entries, min(args.queries, len(entries))):
+        started = time.perf_counter()
+        titles._add(dict(entry, title=entry["title"] + " Edited"))
+        times.append((time.perf_counter() - started) * 1000)
+    print("%18s %10.3f %10.3f %10.3f" % (("title update",) + percentiles(times)))
+
+
+if __name__ == "__main__":
+    main()
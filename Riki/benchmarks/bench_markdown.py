@@ -0,0 +1,68 @@
+"""
+    Markdown engine benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compares the per-render cost of building a new ``markdown.Markdown``
+for every document against reusing the engine of the current thread.
+
+Run from the Riki directory::
+
+    python -m benchmarks.bench_markdown
+"""
+import argparse
+import timeit
+
+import markdown
+
+from wiki.core import MARKDOWN_EXTENSIONS
+from wiki.core import markdown_engine
+
+PARAGRAPH = (
+    "Some *emphasised* text with `inline code` and a "
+    "[link](http://example.com) that keeps going for a while.\n\n"
+)
+
+CODE = "```python\ndef f(x):\n    return x * 2\n```\n\n"
+
+TABLE = "| a | b |\n|---|---|\n| 1 | 2 |\n| 3 | 4 |\n\n"
+
+
+def make_page(sections):
+    """
+    Builds a page with metadata and the given number of sections.
+    """
+    body = "".join(
+        "## Section %d\n\n%s%s%s" % (i, PARAGRAPH * 3, CODE, TABLE)
+        for i in range(sections)
+    )
+    return "title: Benchmark\ntags: bench\n\n" + body
+
+
+def render_fresh(text):
+    return markdown.Markdown(extensions=MARKDOWN_EXTENSIONS).convert(text)
+
+
+def render_reused(text):
+    md = markdown_engine()
+    md.reset()
+    return md.convert(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    sizes = [("small", 1, 500), ("medium", 10, 100), ("large", 100, 10)]
+    print("%-8s %10s %14s %14s %8s" % ("page", "chars", "fresh (ms)", "reused (ms)", "speedup"))
+    for name, sections, number in sizes:
+        text = make_page(sections)
+        assert render_fresh(text) == render_reused(text)
+        fresh = min(timeit.repeat(lambda: render_fresh(text), number=number, repeat=args.repeat))
+        reused = min(timeit.repeat(lambda: render_reused(text), number=number, repeat=args.repeat))
+        fresh, reused = fresh / number * 1000, reused / number * 1000
+        print("%-8s %10d %14.3f %14.3f %7.1fx" % (name, len(text), fresh, reused, fresh / reused))
+
+
+if __name__ == "__main__":
+    main()
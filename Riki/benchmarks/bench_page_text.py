@@ -0,0 +1,95 @@
+"""
+    Page text benchmark
+    ~~~~~~~~~~~~~~~~~~~
+
+Compares extracting the indexable text of a page by parsing the
+rendered html again with BeautifulSoup, as before, with collecting it
+from the markdown element tree while rendering. Reports the time to render
+and extract one page and the peak memory it takes.
+
+Run from the Riki directory::
+
+    python -m benchmarks.bench_page_text
+"""
+import argparse
+import timeit
+import tracemalloc
+
+from bs4 import BeautifulSoup
+from flask import Flask
+
+from wiki.core import Processor
+from wiki.web.routes import bp
+
+SECTION = """
+## Section {i}
+
+Some *emphasized* text with a [[page/{i}|link]], `inline code` and **bold**
+words, followed by a list:
+
+* first item &amp; more
+* second item with <span>inline html</span>
+
+| column | value |
+|--------|-------|
+| a      | {i}   |
+
+```python
+def section_{i}(x):
+    return x < {i}
+```
+"""
+
+
+def make_page(sections):
+    return "title: Big page\n\n" + "".join(SECTION.format(i=i) for i in range(sections))
+
+
+def soup_text(content):
+    html, _, _ = Processor(content).process()
+    return BeautifulSoup(html, "html.parser").get_text()
+
+
+def tree_text(content):
+    processor = Processor(content)
+    processor.process()
+    return processor.text
+
+
+def peak_memory(func, content):
+    tracemalloc.start()
+    func(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    with app.test_request_context():
+        print(
+            "%8s %10s %14s %14s %12s %12s"
+            % ("sections", "size (kB)", "soup ms/page", "tree ms/page", "soup MiB", "tree MiB")
+        )
+        for sections in (10, 100, 1000):
+            content = make_page(sections)
+            assert soup_text(content).split() == tree_text(content).split()
+            number = max(1, 200 // sections)
+            times = [
+                min(timeit.repeat(lambda: func(content), number=number, repeat=args.repeat)) / number * 1000
+                for func in (soup_text, tree_text)
+            ]
+            memory = [peak_memory(func, content) for func in (soup_text, tree_text)]
+            print(
+                "%8d %10.0f %14.1f %14.1f %12.1f %12.1f"
+                % (sections, len(content) / 1024, times[0], times[1], memory[0], memory[1])
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+    Search index benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+Compares case-insensitive searches on a large page_index table filtered
+on ``LOWER(word)`` (a full table scan) with lookups of the indexed,
+normalized term column. The database is built with the old schema and
+then migrated, so the migration time is reported as well.
+
+Run from the Riki directory::
+
+    python -m benchmarks.bench_search_index --rows 2000000
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from wiki.web.db import migrate_db
+
+QUERY = """
+    SELECT doc_id, SUM(frequency) AS total_frequency
+    FROM page_index
+    WHERE {} IN ({})
+    GROUP BY doc_id
+    ORDER BY total_frequency DESC
+    LIMIT 20
+"""
+
+
+def build(db, rows, words, docs):
+    """
+    Fills a page_index table with the old schema with about ``rows`` random
+    postings drawn from a Zipf-like vocabulary.
+    """
+    db.execute(
+        """
+        CREATE TABLE page_index (
+            word TEXT NOT NULL,
+            doc_id TEXT NOT NULL,
+            frequency INTEGER NOT NULL,
+            PRIMARY KEY (word, doc_id)
+        )
+        """
+    )
+    rng = random.Random(42)
+    vocabulary = ["word%d" % i for i in range(words)]
+    vocabulary = [w.capitalize() if i % 3 == 0 else w for i, w in enumerate(vocabulary)]
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(words)))
+
+    postings = []
+    per_doc = rows // docs
+    for doc in range(docs):
+        words = set()
+        while len(words) < per_doc:
+            words.update(rng.choices(vocabulary, cum_weights=cum_weights, k=per_doc - len(words)))
+        postings.extend((word, "doc%d" % doc, rng.randint(1, 10)) for word in words)
+    # inserting in primary key order keeps building the table fast
+    postings.sort()
+
+    with db:
+        db.executemany("INSERT INTO page_index VALUES (?, ?, ?)", postings)
+    return db.execute("SELECT COUNT(*) FROM page_index").fetchone()[0]
+
+
+def timed(db, column, terms, repeat):
+    sql = QUERY.format(column, ", ".join("?" for _ in terms))
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        db.execute(sql, terms).fetchall()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--words", type=int, default=200000)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        db = sqlite3.connect(path)
+        started = time.perf_counter()
+        rows = build(db, args.rows, args.words, args.docs)
+        print("Built page_index with %d rows in %.1fs" % (rows, time.perf_counter() - started))
+
+        queries = {
+            "common": ["WORD1", "word2"],
+            "rare": ["Word99999"],
+            "mixed": ["word3", "WORD150", "Word7000"],
+        }
+        scans = {name: timed(db, "LOWER(word)", [t.lower() for t in terms], args.repeat)
+                 for name, terms in queries.items()}
+
+        started = time.perf_counter()
+        migrate_db(db)
+        db.execute("CREATE INDEX page_index_term ON page_index (term, doc_id, frequency)")
+        print("Migrated in %.1fs" % (time.perf_counter() - started))
+
+        print("%8s %16s %16s %8s" % ("query", "LOWER(word) ms", "term index ms", "speedup"))
+        for name, terms in queries.items():
+            lookup = timed(db, "term", [t.lower() for t in terms], args.repeat)
+            print("%8s %16.2f %16.2f %7.0fx" % (name, scans[name], lookup, scans[name] / lookup))
+        db.close()
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+    Startup benchmark
+    ~~~~~~~~~~~~~~~~~
+
+Measures how long a fresh interpreter takes to import the wiki and run
+``create_app``, compared to the previous behaviour of calling
+``nltk.download`` for the stopwords and punkt data (twice each) while
+``wiki.core`` was imported. Every run uses a new process so nothing is
+cached between runs.
+
+Run from the Riki directory::
+
+    python -m benchmarks.bench_startup
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+STARTUP = """
+import time
+started = time.perf_counter()
+{prelude}
+from wiki import create_app
+create_app({directory!r})
+print(time.perf_counter() - started)
+"""
+
+# what importing wiki.core used to do
+LEGACY_PRELUDE = """
+import nltk
+nltk.download("stopwords")
+nltk.download("punkt")
+nltk.download("stopwords")
+nltk.download("punkt")
+"""
+
+
+def startup_time(prelude, env):
+    code = STARTUP.format(prelude=prelude, directory=os.getcwd())
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ, SECRET_KEY=os.environ.get("SECRET_KEY", "benchmark"))
+    print("%10s %10s %10s" % ("startup", "best (s)", "worst (s)"))
+    for name, prelude in (("legacy", LEGACY_PRELUDE), ("lazy", "")):
+        times = [startup_time(prelude, env) for _ in range(args.repeat)]
+        print("%10s %10.3f %10.3f" % (name, min(times), max(times)))
+
+
+if __name__ == "__main__":
+    main()
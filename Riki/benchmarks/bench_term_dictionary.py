@@ -0,0 +1,68 @@
+"""
+    Term dictionary benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Measures how long the term dictionary takes to load a large vocabulary
+and to expand search terms with prefix matches and typo corrections,
+the work that is added to every case-insensitive search.
+
+Run from the Riki directory::
+
+    python -m benchmarks.bench_term_dictionary --terms 1000000
+"""
+import argparse
+import random
+import string
+import time
+
+from wiki.web.terms import TermDictionary
+
+
+def make_vocabulary(terms, seed=7):
+    rng = random.Random(seed)
+    vocabulary = set()
+    while len(vocabulary) < terms:
+        length = rng.randint(3, 12)
+        vocabulary.add("".join(rng.choice(string.ascii_lowercase) for _ in range(length)))
+    return sorted(vocabulary)
+
+
+def typo(term, rng):
+    index = rng.randrange(len(term))
+    return term[:index] + rng.choice(string.ascii_lowercase) + term[index + 1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--terms", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    vocabulary = make_vocabulary(args.terms)
+    rows = [(term, rng.randint(1, 100)) for term in vocabulary]
+
+    dictionary = TermDictionary()
+    started = time.perf_counter()
+    dictionary.load(rows)
+    print("Loaded %d terms in %.2fs" % (len(dictionary), time.perf_counter() - started))
+
+    samples = rng.sample(vocabulary, args.queries)
+    queries = {
+        "exact": samples,
+        "prefix": [term[:3] for term in samples],
+        "typo": [typo(term, rng) for term in samples],
+        "long typo": [typo(term, rng) + "s" for term in samples if len(term) > 8],
+    }
+    print("%10s %10s %10s" % ("query", "mean ms", "max ms"))
+    for name, terms in queries.items():
+        times = []
+        for term in terms:
+            started = time.perf_counter()
+            dictionary.expand([term])
+            times.append((time.perf_counter() - started) * 1000)
+        print("%10s %10.3f %10.3f" % (name, sum(times) / len(times), max(times)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+    Tokenizer benchmark
+    ~~~~~~~~~~~~~~~~~~~
+
+Compares the tokens per second of NLTK's word_tokenize with the regex
+tokenizer, and of the previous stopword filter, which read the corpus
+into a list on every call, with the frozenset filter. Rows that need
+NLTK data that is not installed are skipped.
+
+Run from the Riki directory::
+
+    python -m benchmarks.bench_tokenizer
+"""
+import argparse
+import random
+import timeit
+
+from wiki import nlp
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while we're indexing real-time "
+    "wiki pages , with numbers like 42 and 3.14 ; it isn't (always) easy ! "
+    "Markdown Flask SQLite search ranking tokens stopwords of and to in is"
+).split()
+
+
+def make_text(tokens, seed=1):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(tokens))
+
+
+def remove_stopwords_list(tokens):
+    """
+    The previous implementation: the corpus is read on every call and
+    every token is looked up in a list.
+    """
+    english_stopwords = nlp.stopwords("english")
+    return [t for t in tokens if t not in english_stopwords]
+
+
+def rate(func, arg, tokens, repeat):
+    number = 3
+    best = min(timeit.repeat(lambda: func(arg), number=number, repeat=repeat))
+    return tokens * number / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--tokens", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = make_text(args.tokens)
+    tokens = text.split()
+    print("%-28s %16s" % ("", "tokens/s"))
+
+    rows = (
+        ("word_tokenize (nltk)", nlp.word_tokenize, text),
+        ("regex_tokenize", nlp.regex_tokenize, text),
+        ("stopwords, list per call", remove_stopwords_list, tokens),
+        ("stopwords, frozenset", nlp.remove_stopwords, tokens),
+    )
+    for name, func, arg in rows:
+        try:
+            print("%-28s %16.0f" % (name, rate(func, arg, len(tokens), args.repeat)))
+        except nlp.NLPResourceError as e:
+            print("%-28s %16s  (%s)" % (name, "skipped", str(e).split(".")[0]))
+
+
+if __name__ == "__main__":
+    main()
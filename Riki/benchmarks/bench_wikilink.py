@@ -0,0 +1,71 @@
+"""
+    Wikilink benchmark
+    ~~~~~~~~~~~~~~~~~~
+
+Shows how the wikilink postprocessor scales with the number of links
+on a page, compared to the previous implementation that rescanned the
+whole document once per link.
+
+Run from the Riki directory::
+
+    python -m benchmarks.bench_wikilink
+"""
+import argparse
+import re
+import timeit
+
+from wiki.core import clean_url
+from wiki.core import wikilink
+
+
+def url_formatter(endpoint, url):
+    return "/" + url + "/"
+
+
+def wikilink_rescan(text, url_formatter):
+    """
+    The previous implementation: one full ``re.sub`` per link.
+    """
+    link_regex = re.compile(
+        r"((?<!\<code\>)\[\[([^<].+?) \s*([|] \s* (.+?) \s*)?]])", re.X | re.U
+    )
+    for i in link_regex.findall(text):
+        title = [i[-1] if i[-1] else i[1]][0]
+        url = clean_url(i[1])
+        html_url = "<a href='{0}'>{1}</a>".format(
+            url_formatter("wiki.display", url=url), title
+        )
+        text = re.sub(link_regex, html_url, text, count=1)
+    return text
+
+
+def make_html(links):
+    """
+    Builds an html document with the given number of wikilinks, half of
+    them pointing to a small set of popular targets.
+    """
+    items = []
+    for i in range(links):
+        target = "popular/page %d" % (i % 10) if i % 2 else "page %d" % i
+        items.append("<li>See [[%s|Page %d]] for details.</li>" % (target, i))
+    return "<ul>\n" + "\n".join(items) + "\n</ul>"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("%8s %14s %16s %8s" % ("links", "rescan (ms)", "single pass (ms)", "speedup"))
+    for links in (10, 100, 1000, 5000):
+        html = make_html(links)
+        assert wikilink_rescan(html, url_formatter) == wikilink(html, url_formatter)
+        number = max(1, 1000 // links)
+        old = min(timeit.repeat(lambda: wikilink_rescan(html, url_formatter), number=number, repeat=args.repeat))
+        new = min(timeit.repeat(lambda: wikilink(html, url_formatter), number=number, repeat=args.repeat))
+        old, new = old / number * 1000, new / number * 1000
+        print("%8d %14.3f %16.3f %7.1fx" % (links, old, new, old / new))
+
+
+if __name__ == "__main__":
+    main()
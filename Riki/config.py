@@ -5,8 +5,30 @@ SECRET_KEY = os.environ.get("SECRET_KEY")
 TITLE = os.environ.get("TITLE")
 HISTORY_SHOW_MAX = os.environ.get("HISTORY_SHOW_MAX")
 PIC_BASE = os.environ.get("PIC_BASE")
+# threads that encode the thumbnail, medium and full image sizes
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))
+# largest accepted request body, e.g. an image upload, in bytes
+MAX_CONTENT_LENGTH = int(os.environ.get("MAX_CONTENT_LENGTH", 16 * 1024 * 1024))
+# images per page of the /img/ gallery
+GALLERY_PAGE_SIZE = int(os.environ.get("GALLERY_PAGE_SIZE", 50))
+# results per page of the /search/ page
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", 20))
 CONTENT_DIR = os.environ.get("CONTENT_DIR")
 USER_DIR = os.environ.get("USER_DIR")
 NUMBER_OF_HISTORY = os.environ.get("NUMBER_OF_HISTORY")
 PRIVATE = os.environ.get("PRIVATE")
 # PRIVATE = False
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", 32 * 1024 * 1024))
+# seconds a looked up user is cached, 0 disables the cache
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 30))
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "page_index")
+# directories with preinstalled NLTK data, separated like PATH
+NLTK_DATA = os.environ.get("NLTK_DATA")
+# download missing NLTK data on first use instead of failing
+NLTK_DOWNLOAD = os.environ.get("NLTK_DOWNLOAD", "False")
+# "nltk" or "regex", changing it requires a full reindex
+TOKENIZER = os.environ.get("TOKENIZER", "nltk")
+# SQLite connection pool, see wiki/web/db.py
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", -16000))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 256 * 1024 * 1024))
@@ -0,0 +1,269 @@
+from Riki import app
+import os
+import tempfile
+import pytest
+from wiki.core import Page, Wiki
+from wiki.web.catalogDAO import CatalogDaoManager
+from wiki.web.pageDAO import PageDaoManager
+from wiki.web.db import *
+
+
+@pytest.fixture
+def client():
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["DATABASE"] = db_path
+    app.config["TESTING"] = True
+    app.config[
+        "PRIVATE"
+    ] = False  # sets PRIVATE to false to disable user auth (see protect dectorator in users.py)
+    app.config[
+        "WTF_CSRF_ENABLED"
+    ] = False  # disables CSRF in WTForms so that we can simulate posts
+    with app.test_client() as client:
+        with app.app_context():
+            init_db()
+        yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+@pytest.fixture
+def dao(client):
+    with app.app_context():
+        dao_manager = CatalogDaoManager()
+    yield dao_manager
+
+
+@pytest.fixture
+def wiki():
+    with tempfile.TemporaryDirectory() as root:
+        yield Wiki(root)
+
+
+def write_page(wiki, url, content):
+    path = wiki.path(url)
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
+
+
+def make_entry(path, url, title="Title", tags="tag"):
+    return {
+        "path": path,
+        "id": url + "_id",
+        "url": url,
+        "title": title,
+        "tags": tags,
+        "mtime": 1,
+        "size": 2,
+    }
+
+
+def test_update_and_get_entries(client, dao):
+    dao.update([make_entry("/a.md", "a"), make_entry("/b.md", "b", tags=None)])
+
+    entries = dao.get_entries()
+
+    assert sorted(entries) == ["/a.md", "/b.md"]
+    assert entries["/a.md"]["url"] == "a"
+    assert entries["/a.md"]["title"] == "Title"
+    assert entries["/b.md"]["tags"] is None
+
+
+def test_update_replaces_and_removes_entries(client, dao):
+    dao.update([make_entry("/a.md", "a"), make_entry("/b.md", "b")])
+
+    dao.update([make_entry("/a.md", "a", title="New Title")], removed_paths=["/b.md"])
+
+    entries = dao.get_entries()
+    assert list(entries) == ["/a.md"]
+    assert entries["/a.md"]["title"] == "New Title"
+
+
+def test_version_changes_with_every_update(client, dao):
+    assert dao.get_version() == 0
+    assert dao.update([make_entry("/a.md", "a"), make_entry("/b.md", "b")]) == (0, 1)
+
+    # the newest row is deleted and its rowid reused, the version still moves on
+    dao.update([], removed_paths=["/b.md"])
+    assert dao.update([make_entry("/c.md", "c")]) == (2, 3)
+    assert dao.update([]) == (3, 3)
+    assert dao.get_version() == 3
+
+
+def test_index_reads_new_pages(client, wiki):
+    write_page(wiki, "zebra", "title: Zebra\ntags: animal\n\nStripes")
+    write_page(wiki, "sub/apple", "title: Apple\n\nFruit")
+
+    with app.app_context():
+        pages = wiki.index()
+        entries = CatalogDaoManager().get_entries()
+
+    assert [page.title for page in pages] == ["Apple", "Zebra"]
+    assert [page.url for page in pages] == ["sub/apple", "zebra"]
+    assert pages[0].tags == ""
+    assert pages[1].tags == "animal"
+    assert len(entries) == 2
+
+
+def test_index_only_rereads_changed_pages(client, wiki, mocker):
+    write_page(wiki, "first", "title: First\n\nBody")
+    write_page(wiki, "second", "title: Second\n\nBody")
+    load_meta = mocker.spy(Page, "load_meta")
+
+    with app.app_context():
+        wiki.index()
+        assert load_meta.call_count == 2
+
+        wiki.index()
+        assert load_meta.call_count == 2
+
+        write_page(wiki, "second", "title: Second Edition\n\nLonger body")
+        pages = wiki.index()
+        assert load_meta.call_count == 3
+
+    assert [page.title for page in pages] == ["First", "Second Edition"]
+    assert pages[1].body == "Longer body"
+
+
+def test_index_drops_deleted_pages(client, wiki):
+    write_page(wiki, "first", "title: First\n\nBody")
+    write_page(wiki, "second", "title: Second\n\nBody")
+
+    with app.app_context():
+        wiki.index()
+        wiki.delete("second")
+        pages = wiki.index()
+        entries = CatalogDaoManager().get_entries()
+
+    assert [page.title for page in pages] == ["First"]
+    assert list(entries) == [wiki.path("first")]
+
+
+def test_get_entries_by_id(client, dao):
+    dao.update([make_entry("/a.md", "a"), make_entry("/b.md", "b"), make_entry("/c.md", "c")])
+
+    entries = dao.get_entries_by_id(["c_id", "a_id", "missing"], batch_size=2)
+
+    assert sorted(entries) == ["a_id", "c_id"]
+    assert entries["c_id"]["url"] == "c"
+    assert dao.get_entries_by_id([]) == {}
+
+
+def test_search_loads_only_matching_pages(client, wiki, mocker):
+    write_page(wiki, "zebra", "title: Zebra\n\nStripes")
+    write_page(wiki, "apple", "title: Apple\n\nFruit")
+
+    with app.app_context():
+        pages = {page.url: page for page in wiki.index()}
+        PageDaoManager().store_page_indexes(
+            [(pages["zebra"].id, {"stripes": 1}), (pages["apple"].id, {"fruit": 1})]
+        )
+        index = mocker.spy(wiki, "index")
+
+        results = wiki.search("stripes")
+
+    assert index.call_count == 0
+    assert [(page.url, page.title) for page in results] == [("zebra", "Zebra")]
+
+
+def test_search_pages_through_results(client, wiki):
+    for i in range(5):
+        write_page(wiki, "page{}".format(i), "title: Page {}\n\nBody".format(i))
+
+    with app.app_context():
+        pages = {page.url: page for page in wiki.index()}
+        PageDaoManager().store_page_indexes(
+            [(pages["page{}".format(i)].id, {"body": i + 1}) for i in range(5)]
+        )
+
+        first = wiki.search("body", limit=2)
+        second = wiki.search("body", limit=2, offset=2)
+
+    assert [page.url for page in first] == ["page4", "page3"]
+    assert [page.url for page in second] == ["page2", "page1"]
+
+
+def test_search_snippets(client, wiki):
+    path = write_page(wiki, "zebra", "title: Zebra\n\nHorses have no stripes, a zebra has")
+
+    with app.app_context():
+        page = wiki.index()[0]
+        PageDaoManager().store_page_indexes(
+            [(page.id, {"stripes": 1, "zebra": 1}, Page(path, "zebra").term_offsets(["stripes"]))]
+        )
+
+        results = wiki.search("stripes zebra", snippets=True)
+
+    assert results[0].snippet == "Horses have no <mark>stripes</mark>, a <mark>zebra</mark> has"
+
+
+def test_search_phrases_and_operators(client, wiki, mocker):
+    mocker.patch("wiki.core.Page.tokenize", staticmethod(str.split))
+    write_page(wiki, "fox", "title: Fox\n\nthe quick brown fox")
+    write_page(wiki, "dog", "title: Dog\n\nbrown quick dog")
+
+    with app.app_context():
+        pages = {page.url: page for page in wiki.index()}
+        PageDaoManager().store_page_indexes(
+            [(page.id, page.tokenize_and_count(), {}, page.token_positions()) for page in pages.values()]
+        )
+
+        assert [page.url for page in wiki.search('"quick brown"')] == ["fox"]
+        assert [page.url for page in wiki.search("brown -fox")] == ["dog"]
+        assert [page.url for page in wiki.search("quick AND dog")] == ["dog"]
+        read_snippet = mocker.spy(Page, "read_snippet")
+        results = wiki.search('"quick brown" OR dog', snippets=True)
+
+    assert sorted(page.url for page in results) == ["dog", "fox"]
+    # only phrases are highlighted as a whole
+    assert read_snippet.call_args[0][2] == ['"quick brown"', "dog"]
+    assert "<mark>quick brown</mark>" in {page.url: page for page in results}["fox"].snippet
+
+
+def test_search_prunes_deleted_pages(client, wiki, mocker):
+    for i in range(3):
+        write_page(wiki, "page{}".format(i), "title: Page {}\n\nBody".format(i))
+
+    with app.app_context():
+        pages = {page.url: page for page in wiki.index()}
+        dao = PageDaoManager()
+        dao.store_page_indexes(
+            [(pages["page{}".format(i)].id, {"body": i + 1}) for i in range(3)]
+            + [("deleted_id", {"body": 10})]
+        )
+        index = mocker.spy(wiki, "index")
+
+        first = wiki.search("body", limit=2)
+        second = wiki.search("body", limit=2)
+
+        assert index.call_count == 1
+        assert "deleted_id" not in dao.get_doc_ids()
+
+    # the window is filled up with the next hits
+    assert [page.url for page in first] == ["page2", "page1"]
+    assert [page.url for page in second] == ["page2", "page1"]
+
+
+def test_search_skips_pages_whose_file_is_gone(client, wiki):
+    for i in range(2):
+        write_page(wiki, "page{}".format(i), "title: Page {}\n\nBody".format(i))
+
+    with app.app_context():
+        pages = {page.url: page for page in wiki.index()}
+        dao = PageDaoManager()
+        dao.store_page_indexes([(pages["page{}".format(i)].id, {"body": i + 1}) for i in range(2)])
+        os.unlink(pages["page1"].path)
+
+        results = wiki.search("body", snippets=True)
+
+        assert [page.url for page in results] == ["page0"]
+        assert results[0].snippet == "<mark>Body</mark>"
+        assert pages["page1"].id not in dao.get_doc_ids()
+        assert pages["page1"].id not in CatalogDaoManager().get_entries_by_id([pages["page1"].id])
+
+    response = client.get("/search/results/?q=body")
+    assert response.status_code == 200
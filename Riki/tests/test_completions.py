@@ -0,0 +1,80 @@
+from wiki.web.completions import TitleIndex
+
+
+class MockCatalog:
+    def __init__(self, entries=()):
+        self.entries = {entry["path"]: entry for entry in entries}
+        self.version = 0
+        self.loads = 0
+
+    def get_version(self):
+        return self.version
+
+    def get_entries(self):
+        self.loads += 1
+        return dict(self.entries)
+
+    def update(self, entries, removed_paths=()):
+        for path in removed_paths:
+            self.entries.pop(path, None)
+        for entry in entries:
+            self.entries[entry["path"]] = entry
+        self.version += 1
+        return self.version - 1, self.version
+
+
+def entry(url, title):
+    return {"path": "/" + url + ".md", "url": url, "title": title}
+
+
+def test_complete_matches_title_and_word_prefixes():
+    index = TitleIndex()
+    index.load(
+        [
+            entry("guide", "Getting Started Guide"),
+            entry("getting", "Getting"),
+            entry("guides", "Guides"),
+            entry("untitled", None),
+        ]
+    )
+
+    # titles that start with the prefix come first, shorter ones before longer ones
+    assert index.complete("g") == [
+        ("guides", "Guides"),
+        ("getting", "Getting"),
+        ("guide", "Getting Started Guide"),
+    ]
+    assert index.complete("gu") == [("guides", "Guides"), ("guide", "Getting Started Guide")]
+    assert index.complete("  STARTED   gu") == [("guide", "Getting Started Guide")]
+    assert index.complete("unt") == [("untitled", "untitled")]
+    assert index.complete("g", limit=1) == [("guides", "Guides")]
+    assert index.complete("") == []
+
+
+def test_update_applies_changes_without_loading():
+    catalog = MockCatalog([entry("first", "First Page")])
+    index = TitleIndex()
+    index.refresh(catalog)
+
+    index.update(catalog, [entry("second", "Second Page"), entry("first", "Renamed")])
+    index.update(catalog, removed_paths=["/second.md"])
+    index.refresh(catalog)
+
+    assert catalog.loads == 1
+    assert index.complete("page") == []
+    assert index.complete("ren") == [("first", "Renamed")]
+
+
+def test_refresh_loads_changes_of_other_processes():
+    catalog = MockCatalog([entry("first", "First")])
+    index = TitleIndex()
+    index.refresh(catalog)
+
+    catalog.update([entry("other", "Other")])
+    # the update of this process does not hide the one of the other process
+    index.update(catalog, [entry("mine", "Mine")])
+    index.refresh(catalog)
+
+    assert catalog.loads == 2
+    assert len(index) == 3
+    assert index.complete("o") == [("other", "Other")]
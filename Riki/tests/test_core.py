@@ -1,13 +1,53 @@
+from Riki import app
 import pytest
 import tempfile, os, config
 from PIL import Image
 from collections import OrderedDict
-from wiki.core import Processor, Page, Wiki
+from wiki import core, nlp
+from wiki.core import Processor, Page, Wiki, RenderCache, render_cache
+from wiki.core import markdown_engine, wikilink
+import threading
 import config
+from wiki.web.catalogDAO import CatalogDaoManager
 from wiki.web.pageDAO import PageDaoManager
 from werkzeug.exceptions import NotFound
 
 
+def fake_url_for(endpoint, url):
+    return "/" + url + "/"
+
+
+class TestWikilink:
+    def test_simple_link(self):
+        html = wikilink("<p>See [[Some Page]]</p>", fake_url_for)
+        assert html == "<p>See <a href='/some_page/'>Some Page</a></p>"
+
+    def test_link_with_title(self):
+        html = wikilink("<p>[[sub/page|The Title]] and [[other]]</p>", fake_url_for)
+        assert html == (
+            "<p><a href='/sub/page/'>The Title</a> and <a href='/other/'>other</a></p>"
+        )
+
+    def test_link_in_code_is_ignored(self):
+        html = "<code>[[not a link]]</code>"
+        assert wikilink(html, fake_url_for) == html
+
+    def test_formats_each_target_once(self, mocker):
+        formatter = mocker.Mock(side_effect=fake_url_for)
+
+        html = wikilink("[[one]] [[two|Two]] [[one|First]] [[One]]", formatter)
+
+        assert formatter.call_count == 2
+        assert html == (
+            "<a href='/one/'>one</a> <a href='/two/'>Two</a> "
+            "<a href='/one/'>First</a> <a href='/one/'>One</a>"
+        )
+
+    def test_title_with_backslash(self):
+        html = wikilink(r"[[page|C:\new]]", fake_url_for)
+        assert html == r"<a href='/page/'>C:\new</a>"
+
+
 class TestProcessor:
     def test_constructor(self):
         # Complete setup and execution is in this fixture
@@ -76,6 +116,114 @@ class TestProcessor:
         assert sample.markdown == "# Sample Title\nSome sample paragraph text"
         assert sample.meta == OrderedDict([("meta", "page")])
 
+    def test_engine_is_reused_within_a_thread(self):
+        assert Processor("a").md is Processor("b").md is markdown_engine()
+
+    def test_engine_is_not_shared_between_threads(self):
+        engines = []
+        thread = threading.Thread(target=lambda: engines.append(markdown_engine()))
+        thread.start()
+        thread.join()
+
+        assert engines[0] is not markdown_engine()
+
+    def test_reused_engine_does_not_leak_meta(self):
+        first = Processor("title:first\nextra:value\n\nFirst text")
+        first.process()
+        second = Processor("title:second\n\nSecond text")
+        second.process()
+
+        assert second.meta == OrderedDict([("title", "second")])
+        assert second.final == "<p>Second text</p>"
+        assert first.meta == OrderedDict([("title", "first"), ("extra", "value")])
+
+    def test_process_markdown_collects_text(self):
+        sample = Processor(
+            "# Title &amp; more\n\nSee [[sub/page|The Page]] and [[other]].\n\n"
+            "    code < 1\n\n<div><b>Raw</b> html</div>"
+        )
+
+        sample.process_pre()
+        sample.process_markdown()
+
+        assert sample.text.split() == [
+            "Title", "&", "more", "See", "The", "Page", "and", "other.",
+            "code", "<", "1", "Raw", "html",
+        ]
+
+    def test_reused_engine_does_not_leak_text(self):
+        Processor("title:first\n\nFirst text").process()
+        second = Processor("")
+        second.process_pre()
+        second.process_markdown()
+
+        assert second.text == ""
+
+
+class TestRenderCache:
+    def setup_method(self):
+        self.cache = RenderCache(max_size=100)
+
+    def test_miss_then_hit(self):
+        key = RenderCache.key("content")
+        assert self.cache.get("/page.md", key) is None
+
+        self.cache.put("/page.md", key, "<p>a</p>", "a", OrderedDict([("title", "A")]))
+        html, body, meta = self.cache.get("/page.md", key)
+
+        assert (html, body, meta) == ("<p>a</p>", "a", OrderedDict([("title", "A")]))
+        assert self.cache.hits == 1
+        assert self.cache.misses == 1
+
+    def test_returns_copy_of_meta(self):
+        self.cache.put("/page.md", "key", "<p>a</p>", "a", OrderedDict([("title", "A")]))
+
+        self.cache.get("/page.md", "key")[2]["title"] = "Changed"
+
+        assert self.cache.get("/page.md", "key")[2]["title"] == "A"
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put("/a.md", "a", "x" * 40, "", {})
+        self.cache.put("/b.md", "b", "x" * 40, "", {})
+        self.cache.get("/a.md", "a")
+
+        self.cache.put("/c.md", "c", "x" * 40, "", {})
+
+        assert self.cache.get("/a.md", "a") is not None
+        assert self.cache.get("/b.md", "b") is None
+        assert self.cache.get("/c.md", "c") is not None
+        assert self.cache.size == 80
+
+    def test_eviction_forgets_paths(self):
+        self.cache.put("/a.md", "a", "x" * 40, "", {})
+        self.cache.put("/b.md", "b", "x" * 40, "", {})
+        self.cache.get("/c.md", "b")
+
+        self.cache.resize(0)
+
+        assert self.cache._keys == {}
+
+    def test_skips_entries_larger_than_budget(self):
+        self.cache.put("/a.md", "a", "x" * 101, "", {})
+        assert self.cache.stats()["entries"] == 0
+
+    def test_invalidate(self):
+        self.cache.put("/a.md", "a", "<p>a</p>", "a", {})
+
+        self.cache.invalidate("/a.md")
+
+        assert self.cache.get("/a.md", "a") is None
+        assert self.cache.size == 0
+
+    def test_resize(self):
+        self.cache.put("/a.md", "a", "x" * 40, "", {})
+        self.cache.put("/b.md", "b", "x" * 40, "", {})
+
+        self.cache.resize(50)
+
+        assert self.cache.get("/a.md", "a") is None
+        assert self.cache.get("/b.md", "b") is not None
+
 
 class TestPage:
     def setup_method(self):
@@ -158,6 +306,153 @@ class TestPage:
         token_count = self.page.tokenize_and_count()
         assert token_count == expected_result
 
+    def test_lazy_page_reads_only_meta(self, mocker):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("title: Lazy\ntags: a, b\n\n# Heading\n\nSome text")
+        render = mocker.spy(Page, "render")
+
+        page = Page(self.path, "url", lazy=True)
+
+        assert page.title == "Lazy"
+        assert page.tags == "a, b"
+        assert not hasattr(page, "content")
+        assert render.call_count == 0
+
+    def test_lazy_page_renders_on_html_access(self, mocker):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("title: Lazy\n\nSome text")
+        render = mocker.spy(Page, "render")
+        page = Page(self.path, "url", lazy=True)
+
+        assert page.html == "<p>Some text</p>"
+        assert page.__html__() == "<p>Some text</p>"
+        assert page.body == "Some text"
+        assert render.call_count == 1
+
+    def test_lazy_page_with_known_meta(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("title: On Disk\n\nSome text")
+
+        page = Page(self.path, "url", lazy=True, meta={"title": "Catalogued"})
+
+        assert page.title == "Catalogued"
+        assert page.body == "Some text"
+        assert page.title == "On Disk"
+
+
+    def test_render_reuses_cached_output(self, mocker):
+        render_cache.clear()
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("title: Cached\n\nSome text")
+        process = mocker.spy(Processor, "process")
+
+        first = Page(self.path, "url")
+        second = Page(self.path, "url")
+
+        assert process.call_count == 1
+        assert second.html == first.html == "<p>Some text</p>"
+        assert second.title == "Cached"
+        assert render_cache.hits == 1
+
+    def test_page_text_is_collected_while_rendering(self, mocker):
+        render_cache.clear()
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("title: Text\n\nSome *marked* `text`")
+        html_to_text = mocker.spy(core, "html_to_text")
+
+        rendered = Page(self.path, "url").get_page_text()
+        cached = Page(self.path, "url").get_page_text()
+
+        assert rendered.split() == cached.split() == ["Some", "marked", "text", "Text"]
+        assert html_to_text.call_count == 1
+
+    def test_save_invalidates_cached_output(self):
+        render_cache.clear()
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("title: Cached\n\nSome text")
+        page = Page(self.path, "url")
+
+        page.body = "Other text"
+        page.save()
+
+        assert page.html == "<p>Other text</p>"
+        assert Page(self.path, "url").html == "<p>Other text</p>"
+        assert render_cache.stats()["entries"] == 1
+
+    def test_term_offsets(self):
+        with open(self.path, "wb") as f:
+            f.write("title: Zebra\n\nCafé **zebra** stripes, Zebra again".encode("utf-8"))
+
+        offsets = Page(self.path, "url", lazy=True).term_offsets(["zebra", "Stripes", "title"])
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+        assert offsets == {"zebra": data.index(b"zebra"), "stripes": data.index(b"stripes")}
+
+    def test_read_snippet(self):
+        body = " ".join("word{}".format(i) for i in range(100))
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("title: Test\n\n" + body + " [[target|the needle]] " + body)
+        page = Page(self.path, "url", lazy=True)
+        position = page.term_offsets(["needle"])["needle"]
+
+        snippet = page.read_snippet(position, ["needle"])
+
+        assert "<mark>needle</mark>" in snippet
+        assert "the <mark>needle</mark> word0" in snippet
+        assert snippet.startswith("…") and snippet.endswith("…")
+        assert "[[" not in snippet and "title" not in snippet
+        assert len(snippet) < core.SNIPPET_LENGTH + 40
+
+    def test_read_snippet_without_position(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("title: Test\n\n# Heading\n\nSome *text* & <b>more</b>")
+
+        snippet = Page(self.path, "url", lazy=True).read_snippet(None, ["text"])
+
+        assert snippet == "Heading Some <mark>text</mark> &amp; more"
+
+    def test_read_snippet_skips_long_metadata(self):
+        tags = ", ".join("tag{}".format(i) for i in range(200))
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("title: Test\ntags: " + tags + "\n\nThe body text")
+
+        snippet = Page(self.path, "url", lazy=True).read_snippet(None, ["text"])
+
+        assert snippet == "The body <mark>text</mark>"
+
+    def test_snippets_of_crlf_files(self):
+        with open(self.path, "wb") as f:
+            f.write("title: Ünïcode\r\ntags: x\r\n\r\nA naïve body\r\n".encode("utf-8"))
+        page = Page(self.path, "url", lazy=True)
+
+        offsets = page.term_offsets(["naïve", "title", "x"])
+
+        with open(self.path, "rb") as f:
+            assert offsets == {"naïve": f.read().index("naïve".encode("utf-8"))}
+        assert page.read_snippet(offsets["naïve"], ["naïve"]) == "A <mark>naïve</mark> body"
+        assert page.read_snippet(None, ["body"]) == "A naïve <mark>body</mark>"
+
+    def test_read_body_offset_of_long_crlf_header(self):
+        header = "tags: " + ", ".join("tag{}".format(i) for i in range(500)) + "\r\n"
+        with open(self.path, "wb") as f:
+            f.write((header + "\r\nBody").encode("utf-8"))
+
+        with open(self.path, "rb") as f:
+            assert core.read_body_offset(f) == len(header) + 2
+
+    def test_term_offsets_use_configured_tokenizer(self, mocker):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write('title: Test\n\nSay "cannot" twice')
+        mocker.patch.object(config, "TOKENIZER", "nltk", create=True)
+        mocker.patch.object(nlp, "word_tokenize", return_value=["Say", "``", "can", "not", "\'\'", "twice"])
+
+        offsets = Page(self.path, "url", lazy=True).term_offsets(["not", "twice"])
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+        assert offsets == {"not": data.index(b"not"), "twice": data.index(b"twice")}
+
 
 class MockPage:
     def __init__(self, id, title=None, tags=None):
@@ -281,6 +576,17 @@ class TestWiki:
         assert page is True
         assert not self.wiki.exists(wiki_path)
 
+    def test_delete_invalidates_cached_output(self):
+        url = "cached-page"
+        with open(self.wiki.path(url), "w") as f:
+            f.write("title: Cached\n\nBody")
+        self.wiki.get(url)
+        entries = render_cache.stats()["entries"]
+
+        self.wiki.delete(url)
+
+        assert render_cache.stats()["entries"] == entries - 1
+
     def test_delete_nonexistent_page(self):
         url = "nonexistent-page"
         page = self.wiki.delete(url)
@@ -301,6 +607,12 @@ class TestWiki:
             assert im.size == (128, 128)
             assert im.mode == "L"
 
+    def test_save_image_rejects_unsafe_names(self):
+        file = Image.new("L", [8, 8])
+        file.filename = "../escaped.jpg"
+        with pytest.raises(ValueError):
+            self.wiki.save_image(file)
+
     def test_index_by(self, mocker):
         dummy_pages = [
             MockPage("ID1", "Title1", "tag1"),
@@ -401,10 +713,22 @@ class TestWiki:
         # Mock the behavior of the PageDaoManager.__init__ method to avoid creating a database connection
         mocker.patch.object(PageDaoManager, "__init__", return_value=None)
 
+        # The pages are not in the page catalog yet, so search calls the index method to catalogue them
+        entries = {
+            doc_id: {"path": os.path.join(self.tempdir, doc_id + ".md"), "url": doc_id, "title": doc_id, "tags": None}
+            for doc_id in search_results
+        }
+        for entry in entries.values():
+            open(entry["path"], "w").close()
+        mocker.patch.object(CatalogDaoManager, "__init__", return_value=None)
+        mocker.patch.object(CatalogDaoManager, "get_entries_by_id", side_effect=[{}, entries])
+
         # Call the search method on the Wiki object and store the result
-        matching_pages = wiki_obj.search(term)
+        with app.app_context():
+            matching_pages = wiki_obj.search(term)
 
         # Test that the correct number of pages were returned and that they match the expected IDs
         assert len(matching_pages) == 2
-        assert matching_pages[0].id == "ID1"
-        assert matching_pages[1].id == "ID2"
+        assert matching_pages[0].url == "ID1"
+        assert matching_pages[1].url == "ID2"
+        wiki_obj.index.assert_called_once_with()
@@ -6,7 +6,7 @@ import sqlite3
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 import pytest
-from wiki.web.userDAO import UserDao, UserDaoManager
+from wiki.web.userDAO import UserCache, UserDao, UserDaoManager
 from wiki.web.db import *
 
 
@@ -134,3 +134,224 @@ def test_UserDao_constructor(user_dao_manager):
     assert user.is_active()
     assert not user.is_anonymous()
     assert isinstance(user.get_id(), str)
+
+
+def test_init_db_migrates_page_index_terms():
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["DATABASE"] = db_path
+    db = sqlite3.connect(db_path)
+    db.executescript(
+        """
+        CREATE TABLE page_index (
+            word TEXT NOT NULL,
+            doc_id TEXT NOT NULL,
+            frequency INTEGER NOT NULL,
+            PRIMARY KEY (word, doc_id)
+        );
+        INSERT INTO page_index VALUES ('Hello', 'page1', 2), ('ÄPFEL', 'page1', 1);
+        """
+    )
+    db.close()
+
+    with app.app_context():
+        init_db()
+        init_db()
+        rows = get_db().execute("SELECT word, term FROM page_index ORDER BY word").fetchall()
+        indexes = [row[1] for row in get_db().execute("PRAGMA index_list(page_index)")]
+
+    assert [tuple(row) for row in rows] == [("Hello", "hello"), ("ÄPFEL", "äpfel")]
+    assert "page_index_term" in indexes
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def test_init_db_migrates_term_stats_versions():
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["DATABASE"] = db_path
+    db = sqlite3.connect(db_path)
+    db.executescript(
+        """
+        CREATE TABLE term_stats (term TEXT PRIMARY KEY, doc_freq INTEGER NOT NULL);
+        INSERT INTO term_stats VALUES ('hello', 2);
+        """
+    )
+    db.close()
+
+    with app.app_context():
+        init_db()
+        rows = get_db().execute("SELECT term, doc_freq, version FROM term_stats").fetchall()
+
+    assert [tuple(row) for row in rows] == [("hello", 2, 0)]
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def test_init_db_reindexes_pages_without_positions():
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["DATABASE"] = db_path
+    db = sqlite3.connect(db_path)
+    db.executescript(
+        """
+        CREATE TABLE page_index_state (doc_id TEXT PRIMARY KEY, mtime INTEGER NOT NULL, size INTEGER NOT NULL);
+        INSERT INTO page_index_state VALUES ('page1', 1, 2);
+        """
+    )
+    db.close()
+
+    with app.app_context():
+        init_db()
+        get_db().execute("INSERT INTO page_index_state VALUES ('page2', 1, 2)")
+        get_db().commit()
+        init_db()
+        rows = get_db().execute("SELECT doc_id FROM page_index_state").fetchall()
+
+    # only the states written before the positions were stored are forgotten
+    assert [tuple(row) for row in rows] == [("page2",)]
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def test_connections_are_reused_between_app_contexts(client):
+    with app.app_context():
+        first = get_db()
+    with app.app_context():
+        second = get_db()
+
+    assert first is second
+
+
+def test_pooled_connections_are_configured(client):
+    with app.app_context():
+        db = get_db()
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert db.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert db.execute("PRAGMA cache_size").fetchone()[0] == -16000
+        assert db.execute("PRAGMA mmap_size").fetchone()[0] == 256 * 1024 * 1024
+
+
+def test_pool_release_rolls_back_and_drops_closed_connections():
+    db_fd, db_path = tempfile.mkstemp()
+    pool = ConnectionPool(db_path, size=1)
+    connection = pool.acquire()
+    connection.execute("CREATE TABLE t (x)")
+    connection.execute("INSERT INTO t VALUES (1)")
+
+    pool.release(connection)
+    assert pool.acquire() is connection
+    assert connection.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+
+    other = pool.acquire()
+    pool.release(connection)
+    pool.release(other)  # the pool is full, so this one is closed
+    with pytest.raises(sqlite3.ProgrammingError):
+        other.execute("SELECT 1")
+
+    connection = pool.acquire()
+    connection.close()
+    pool.release(connection)
+    assert pool.acquire() is not connection
+
+    pool.close()
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_fd_count_is_stable_under_load(client):
+    # SOAK_REQUESTS=100000 turns this into the full soak test
+    requests = int(os.environ.get("SOAK_REQUESTS", 1000))
+    form = {
+        "first_name": "John",
+        "last_name": "Doe",
+        "email": "john@example.com",
+        "password": "password123",
+        "confirm_password": "password123",
+    }
+    client.post("/user/create/", data=form)
+    client.get("/")
+    baseline = open_fds()
+
+    for i in range(requests):
+        if i % 100 == 0:
+            client.get("/user/logout/")
+            client.post("/user/login/", data=form)
+        else:
+            # every page view of a logged in user loads the user from the database
+            assert client.get("/").status_code == 200
+
+    assert open_fds() <= baseline
+
+
+def count_statements(dao):
+    statements = []
+    dao.connection.set_trace_callback(statements.append)
+    return statements
+
+
+def test_get_user_uses_identity_map_and_cache(user_dao_manager):
+    user_dao_manager.create_user(UserDao("John", "Doe", "john@example.com", "pw"))
+    statements = count_statements(user_dao_manager)
+
+    first = user_dao_manager.get_user("john@example.com")
+    assert user_dao_manager.get_user("john@example.com") is first
+    assert len(statements) == 1
+
+    # a new app context gets its own objects, but from the process cache
+    with app.app_context():
+        dao_manager = UserDaoManager()
+        other_statements = count_statements(dao_manager)
+        other = dao_manager.get_user("john@example.com")
+        dao_manager.connection.set_trace_callback(None)
+    assert other is not first
+    assert other.email == first.email
+    assert other_statements == []
+    user_dao_manager.connection.set_trace_callback(None)
+
+
+def test_user_cache_is_invalidated_on_changes(user_dao_manager):
+    user_dao_manager.create_user(UserDao("John", "Doe", "john@example.com", "pw"))
+    assert user_dao_manager.get_user("john@example.com") is not None
+
+    user_dao_manager.delete_user("john@example.com")
+    assert user_dao_manager.get_user("john@example.com") is None
+    with app.app_context():
+        assert UserDaoManager().get_user("john@example.com") is None
+
+    user_dao_manager.create_user(UserDao("Jane", "Doe", "john@example.com", "pw"))
+    assert user_dao_manager.get_user("john@example.com").first_name == "Jane"
+
+    user_dao_manager.delete_all_users()
+    with app.app_context():
+        assert UserDaoManager().get_user("john@example.com") is None
+
+
+def test_user_cache_entries_expire(mocker):
+    cache = UserCache(ttl=30)
+    monotonic = mocker.patch("wiki.web.userDAO.time.monotonic", return_value=100)
+    cache.put("db", "john@example.com", ("row",))
+
+    monotonic.return_value = 129
+    assert cache.get("db", "john@example.com") == ("row",)
+    assert cache.get("other.db", "john@example.com") is None
+
+    monotonic.return_value = 131
+    assert cache.get("db", "john@example.com") is None
+
+
+def test_user_cache_invalidate():
+    cache = UserCache()
+    cache.put("db", "john@example.com", ("john",))
+    cache.put("db", "jane@example.com", ("jane",))
+    cache.put("other.db", "john@example.com", ("john",))
+
+    cache.invalidate("db", "john@example.com")
+    assert cache.get("db", "john@example.com") is None
+    assert cache.get("db", "jane@example.com") == ("jane",)
+
+    cache.invalidate("db")
+    assert cache.get("db", "jane@example.com") is None
+    assert cache.get("other.db", "john@example.com") == ("john",)
@@ -0,0 +1,166 @@
+from Riki import app
+import os
+import tempfile
+import pytest
+from wiki.core import Wiki
+from wiki.web.ftsDAO import FtsDaoManager
+from wiki.web.pageDAO import PageDaoManager, get_search_dao
+from wiki.web.query import parse_query
+from wiki.web.db import *
+
+
+@pytest.fixture
+def client():
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["DATABASE"] = db_path
+    app.config["TESTING"] = True
+    app.config[
+        "PRIVATE"
+    ] = False  # sets PRIVATE to false to disable user auth (see protect dectorator in users.py)
+    app.config[
+        "WTF_CSRF_ENABLED"
+    ] = False  # disables CSRF in WTForms so that we can simulate posts
+    app.config["SEARCH_BACKEND"] = "fts5"
+    with app.test_client() as client:
+        with app.app_context():
+            init_db()
+        yield client
+    app.config["SEARCH_BACKEND"] = "page_index"
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+@pytest.fixture
+def dao(client):
+    with app.app_context():
+        dao_manager = FtsDaoManager()
+    yield dao_manager
+
+
+class MockPage:
+    def __init__(self, id, title="", text=""):
+        self.id = id
+        self.title = title
+        self.text = text
+
+    def get_page_text(self):
+        return self.text
+
+
+def test_get_search_dao(client):
+    with app.app_context():
+        assert isinstance(get_search_dao(), FtsDaoManager)
+        app.config["SEARCH_BACKEND"] = "page_index"
+        assert isinstance(get_search_dao(), PageDaoManager)
+
+
+def test_search_ranks_matches(client, dao):
+    dao.update_page_index(MockPage("page1", "Trucks", "A red truck and a red car."))
+    dao.update_page_index(MockPage("page2", "Colors", "Red is a color, so is blue."))
+    dao.update_page_index(MockPage("page3", "Other", "Nothing to see here."))
+
+    assert list(dao.search(["truck"])) == ["page1"]
+    assert list(dao.search(["RED"])) == ["page1", "page2"]
+    assert dao.search(["missing"]) == {}
+
+
+def test_search_title_weighs_more(client, dao):
+    dao.store_pages(
+        [
+            MockPage("body", "Something", "apples and more apples"),
+            MockPage("title", "Apples", "a fruit"),
+        ]
+    )
+
+    assert list(dao.search(["apples"])) == ["title", "body"]
+
+
+def test_search_prefix_and_phrase(client, dao):
+    dao.store_pages(
+        [
+            MockPage("page1", "One", "the quick brown fox"),
+            MockPage("page2", "Two", "brown quick foxes"),
+        ]
+    )
+
+    assert set(dao.search(dao.split_query("fox*"))) == {"page1", "page2"}
+    assert set(dao.search(dao.split_query('"quick brown"'))) == {"page1"}
+    assert list(dao.search(dao.split_query("fox"))) == ["page1"]
+
+
+def test_search_limit(client, dao):
+    dao.store_pages([MockPage("page{}".format(i), text="word " * i) for i in range(1, 6)])
+
+    assert len(dao.search(["word"], limit=2)) == 2
+
+
+def test_split_query_quotes_syntax(client, dao):
+    assert dao.split_query('"red truck" car* -- NEAR(a) "') == ['"red truck"', "car*", "NEAR(a)"]
+    # characters of the FTS5 query syntax are searched for literally instead of raising errors
+    assert dao.search(dao.split_query('NEAR(a) AND "x OR')) == {}
+
+
+def test_update_replaces_text(client, dao):
+    dao.update_page_index(MockPage("page1", "Page", "old words"))
+    dao.update_page_index(MockPage("page1", "Page", "new words"))
+
+    assert dao.search(["old"]) == {}
+    assert list(dao.search(["new"])) == ["page1"]
+    assert dao.get_doc_ids() == {"page1"}
+
+
+def test_delete(client, dao):
+    page = MockPage("page1", "Page", "some words")
+    dao.update_page_index(page)
+
+    dao.delete(page)
+
+    assert dao.search(["words"]) == {}
+    assert dao.get_doc_ids() == set()
+
+
+def test_update_page_index_id(client, dao):
+    dao.update_page_index(MockPage("old_id", "Page", "some words"))
+
+    dao.update_page_index_id("new_id", "old_id")
+
+    assert list(dao.search(["words"])) == ["new_id"]
+
+
+def test_migrate_search_command(client):
+    with tempfile.TemporaryDirectory() as root:
+        with open(Wiki(root).path("first"), "w", encoding="utf-8") as f:
+            f.write("title: First\n\nSome *markdown* text")
+        with app.app_context():
+            PageDaoManager().store_page_indexes([("stale", {"token": 1})])
+
+        content_dir = app.config["CONTENT_DIR"]
+        app.config["CONTENT_DIR"] = root
+        try:
+            result = app.test_cli_runner().invoke(
+                args=["migrate-search", "--drop-page-index"]
+            )
+        finally:
+            app.config["CONTENT_DIR"] = content_dir
+
+    assert result.exit_code == 0, result.output
+    assert "Indexed 1 pages" in result.output
+    with app.app_context():
+        assert len(FtsDaoManager().search(["markdown"])) == 1
+        assert PageDaoManager().get_doc_ids() == set()
+
+
+def test_search_query(client, dao):
+    dao.store_pages(
+        [
+            MockPage("page1", "One", "the quick brown fox"),
+            MockPage("page2", "Two", "brown quick foxes"),
+            MockPage("page3", "Three", "a slow brown dog"),
+        ]
+    )
+
+    assert set(dao.search_query(parse_query('"quick brown" OR dog'))) == {"page1", "page3"}
+    assert set(dao.search_query(parse_query("brown AND quick"))) == {"page1", "page2"}
+    assert set(dao.search_query(parse_query('brown -"quick brown" -dog'))) == {"page2"}
+    assert set(dao.search_query(parse_query("fox* -fox"))) == {"page2"}
+    assert dao.search_query(parse_query('"" AND -x')) == {}
@@ -56,3 +56,19 @@ def test_get_image_owner(client, dao):
     dao.save_image('filename.jpg', 'email@email.com')
     assert dao.get_image_owner('filename.jpg')[0] == 'email@email.com'
 
+
+def test_get_image_owners(client, dao):
+    dao.save_image('filename.jpg', 'email@email.com')
+    dao.save_image('filename2.jpg', 'email2@email.com')
+    dao.save_image('filename3.jpg', 'email@email.com')
+
+    owners = dao.get_image_owners(['filename.jpg', 'filename2.jpg', 'missing.jpg'], batch_size=2)
+
+    assert owners == {'filename.jpg': 'email@email.com', 'filename2.jpg': 'email2@email.com'}
+    assert dao.get_image_owners([]) == {}
+
+def test_get_user_images_uses_email_index(client, dao):
+    plan = dao.cur.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM images WHERE email = (?)", ('email@email.com',)
+    ).fetchall()
+    assert "USING INDEX images_email" in " ".join(row[-1] for row in plan)
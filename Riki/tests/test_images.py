@@ -0,0 +1,136 @@
+from Riki import app
+import io
+import os
+import tempfile
+import pytest
+import config
+from PIL import Image
+from wiki.web import images
+
+
+@pytest.fixture
+def pic_base(mocker):
+    with tempfile.TemporaryDirectory() as root:
+        mocker.patch.object(config, "PIC_BASE", root)
+        yield root
+
+
+def write_image(pic_base, filename, size=(100, 80), mtime=None):
+    path = os.path.join(pic_base, filename)
+    Image.new("RGB", size, "red").save(path, images.image_format(filename))
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+    return path
+
+
+def test_derivative_is_encoded_once(pic_base, mocker):
+    write_image(pic_base, "photo.jpg")
+    image_open = mocker.spy(Image, "open")
+
+    path = images.get_derivative("photo.jpg")
+    assert images.get_derivative("photo.jpg") == path
+
+    assert image_open.call_count == 1
+    assert os.path.dirname(path) == os.path.join(pic_base, images.DERIVATIVE_DIR, "photo.jpg")
+    with Image.open(path) as img:
+        assert img.format == "JPEG"
+
+
+def test_changed_source_gets_a_new_derivative(pic_base):
+    write_image(pic_base, "photo.png", mtime=1000)
+    old = images.get_derivative("photo.png")
+
+    write_image(pic_base, "photo.png", mtime=2000)
+    new = images.get_derivative("photo.png")
+
+    assert new != old
+    assert os.listdir(os.path.dirname(new)) == [os.path.basename(new)]
+
+
+def test_missing_image_has_no_derivative(pic_base):
+    assert images.get_derivative("missing.jpg") is None
+    assert images.get_derivative(images.DERIVATIVE_DIR + ".jpg") is None
+
+
+def test_view_image_answers_conditional_requests(pic_base):
+    write_image(pic_base, "photo.jpg")
+    client = app.test_client()
+
+    response = client.get("/img/photo.jpg/")
+    etag = response.headers["ETag"]
+    response.close()
+
+    assert response.status_code == 200
+    assert response.mimetype == "image/jpeg"
+    assert response.headers["Last-Modified"]
+    assert client.get("/img/photo.jpg/", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/img/other.jpg/").status_code == 404
+
+
+def test_sizes_keep_the_aspect_ratio(pic_base):
+    write_image(pic_base, "photo.png", size=(1000, 500))
+    write_image(pic_base, "small.png", size=(100, 50))
+
+    for size, expected in (("thumbnail", (160, 80)), ("medium", (640, 320)), ("full", (1000, 500))):
+        with Image.open(images.get_derivative("photo.png", size)) as img:
+            assert img.size == expected
+    with Image.open(images.get_derivative("small.png", "thumbnail")) as img:
+        assert img.size == (100, 50)
+
+
+def test_schedule_encodes_every_size_once(pic_base, mocker):
+    write_image(pic_base, "photo.jpg", size=(800, 600))
+    encode = mocker.spy(images, "encode")
+
+    for future in images.schedule("photo.jpg"):
+        future.result()
+    assert images.schedule("photo.jpg") == []
+
+    assert encode.call_count == len(images.SIZES)
+    folder = os.path.join(pic_base, images.DERIVATIVE_DIR, "photo.jpg")
+    assert len(os.listdir(folder)) == len(images.SIZES)
+
+
+def test_view_image_size_parameter(pic_base):
+    write_image(pic_base, "photo.jpg", size=(800, 600))
+    client = app.test_client()
+
+    response = client.get("/img/photo.jpg/?size=thumbnail")
+    with Image.open(io.BytesIO(response.data)) as img:
+        assert img.size == (160, 120)
+    assert client.get("/img/photo.jpg/?size=huge").status_code == 400
+
+
+def test_list_images_pages(pic_base):
+    for i in range(5):
+        write_image(pic_base, "photo{}.png".format(i))
+    images.get_derivative("photo0.png")
+
+    names, more = images.list_images(limit=2)
+    assert names == ["photo0.png", "photo1.png"] and more
+    names, more = images.list_images(after=names[-1], limit=2)
+    assert names == ["photo2.png", "photo3.png"] and more
+    names, more = images.list_images(after=names[-1], limit=2)
+    assert names == ["photo4.png"] and not more
+
+
+def test_save_upload_copies_in_chunks(pic_base, mocker):
+    mocker.patch.object(images, "CHUNK_SIZE", 16)
+    data = io.BytesIO(b"x" * 100)
+    read = mocker.spy(data, "read")
+
+    path = images.save_upload(data, "photo.jpg")
+
+    assert read.call_count > 100 // 16
+    with open(path, "rb") as f:
+        assert f.read() == b"x" * 100
+    assert os.listdir(pic_base) == ["photo.jpg"]
+
+
+def test_verify(pic_base):
+    write_image(pic_base, "photo.png")
+    with open(os.path.join(pic_base, "broken.jpg"), "wb") as f:
+        f.write(b"not an image")
+
+    assert images.verify("photo.png")
+    assert not images.verify("broken.jpg")
@@ -0,0 +1,154 @@
+from Riki import app
+import os
+import tempfile
+import pytest
+from types import SimpleNamespace
+import click
+from wiki.core import Page, Wiki
+from wiki.web.indexer import reindex
+from wiki.web.ftsDAO import FtsDaoManager
+from wiki.web.pageDAO import PageDaoManager
+from wiki.web.db import *
+
+
+@pytest.fixture
+def client():
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["DATABASE"] = db_path
+    app.config["TESTING"] = True
+    app.config[
+        "PRIVATE"
+    ] = False  # sets PRIVATE to false to disable user auth (see protect dectorator in users.py)
+    app.config[
+        "WTF_CSRF_ENABLED"
+    ] = False  # disables CSRF in WTForms so that we can simulate posts
+    with app.test_client() as client:
+        with app.app_context():
+            init_db()
+        yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+@pytest.fixture
+def wiki():
+    with tempfile.TemporaryDirectory() as root:
+        yield Wiki(root)
+
+
+@pytest.fixture(autouse=True)
+def simple_tokenizer(mocker):
+    # keeps the tests independent of the nltk data; forked workers inherit the patch
+    mocker.patch.object(Page, "token_positions", split_positions)
+
+
+def split_positions(page):
+    positions = {}
+    for position, token in enumerate(page.body.split()):
+        positions.setdefault(token, []).append(position)
+    return positions
+
+
+def write_page(wiki, url, body):
+    with open(wiki.path(url), "w", encoding="utf-8") as f:
+        f.write("title: {}\n\n{}".format(url, body))
+
+
+def tokens(url):
+    return PageDaoManager().get_tokens(Page("", url, new=True))
+
+
+def test_reindex_indexes_all_pages(client, wiki):
+    write_page(wiki, "first", "alpha beta beta")
+    write_page(wiki, "second", "gamma")
+
+    with app.app_context():
+        result = reindex(wiki, workers=0)
+
+        assert tokens("first") == {"alpha": 1, "beta": 2}
+        assert tokens("second") == {"gamma": 1}
+    assert result == {"indexed": 2, "skipped": 0, "failed": 0, "removed": 0}
+
+
+def test_reindex_with_worker_processes(client, wiki):
+    for i in range(20):
+        write_page(wiki, "page{}".format(i), "word{}".format(i))
+
+    with app.app_context():
+        result = reindex(wiki, workers=2, batch_size=7)
+
+        assert tokens("page13") == {"word13": 1}
+    assert result["indexed"] == 20
+
+
+def test_incremental_reindex_skips_unchanged_pages(client, wiki):
+    write_page(wiki, "first", "alpha")
+    write_page(wiki, "second", "gamma")
+
+    with app.app_context():
+        reindex(wiki, workers=0)
+        write_page(wiki, "second", "gamma delta")
+        result = reindex(wiki, incremental=True, workers=0)
+
+        assert tokens("second") == {"gamma": 1, "delta": 1}
+    assert result["indexed"] == 1
+    assert result["skipped"] == 1
+
+
+def test_reindex_removes_deleted_pages(client, wiki):
+    write_page(wiki, "first", "alpha")
+    write_page(wiki, "second", "gamma")
+
+    with app.app_context():
+        reindex(wiki, workers=0)
+        wiki.delete("second")
+        result = reindex(wiki, incremental=True, workers=0)
+
+        assert tokens("second") == {}
+        assert PageDaoManager().get_doc_ids() == {Page("", "first", new=True).id}
+    assert result["removed"] == 1
+
+
+def test_reindex_reports_broken_pages(client, wiki):
+    write_page(wiki, "first", "alpha")
+    with open(wiki.path("broken"), "w", encoding="utf-8") as f:
+        f.write("no metadata header")
+
+    with app.app_context():
+        result = reindex(wiki, workers=0)
+
+    assert result["indexed"] == 1
+    assert result["failed"] == 1
+
+
+def test_reindex_command(client, wiki):
+    write_page(wiki, "first", "alpha")
+    content_dir = app.config["CONTENT_DIR"]
+    app.config["CONTENT_DIR"] = wiki.root
+    try:
+        result = app.test_cli_runner().invoke(args=["reindex", "--workers", "0"])
+    finally:
+        app.config["CONTENT_DIR"] = content_dir
+
+    assert result.exit_code == 0
+    assert "Indexed 1 pages" in result.output
+
+
+def test_reindex_rebuilds_fts_index(client, wiki):
+    write_page(wiki, "first", "alpha")
+    write_page(wiki, "second", "beta")
+    app.config["SEARCH_BACKEND"] = "fts5"
+    try:
+        with app.app_context():
+            get_db().executescript(open("wiki/web/schema_fts5.sql").read())
+            FtsDaoManager().store_pages([SimpleNamespace(id="stale", title="Stale", get_page_text=lambda: "alpha")])
+
+            result = reindex(wiki)
+
+            assert result == {"indexed": 2, "skipped": 0, "failed": 0, "removed": 1}
+            assert FtsDaoManager().get_doc_ids() == {Page("", "first", new=True).id, Page("", "second", new=True).id}
+            assert PageDaoManager().get_doc_ids() == set()
+            with pytest.raises(click.UsageError):
+                reindex(wiki, incremental=True)
+    finally:
+        app.config["SEARCH_BACKEND"] = "page_index"
@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+import tempfile
+import pytest
+import nltk
+import config
+from wiki import nlp
+
+
+@pytest.fixture
+def empty_data_path(mocker):
+    # hide any installed NLTK data so a missing resource can be simulated
+    with tempfile.TemporaryDirectory() as data_dir:
+        mocker.patch.object(nltk.data, "path", [data_dir])
+        yield data_dir
+
+
+def test_importing_core_does_not_load_nltk():
+    code = "import sys, wiki.core, wiki.web; print('nltk' in sys.modules)"
+    env = dict(os.environ, SECRET_KEY="x")
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, env=env
+    ).stdout
+
+    assert output.strip() == "False"
+
+
+def test_missing_resource_fails_fast(mocker, empty_data_path):
+    mocker.patch.object(config, "NLTK_DOWNLOAD", "False", create=True)
+    download = mocker.patch.object(nltk, "download")
+    load = mocker.Mock(side_effect=LookupError("missing"))
+
+    with pytest.raises(nlp.NLPResourceError, match="stopwords"):
+        nlp._load("stopwords", load)
+    with pytest.raises(LookupError, match="punkt"):
+        nlp._load("tokenizer", load)
+    download.assert_not_called()
+
+
+def test_missing_resource_is_downloaded_when_enabled(mocker, empty_data_path):
+    mocker.patch.object(config, "NLTK_DOWNLOAD", "True", create=True)
+    download = mocker.patch.object(nltk, "download")
+    load = mocker.Mock(side_effect=[LookupError("missing"), ["the", "a"]])
+
+    assert nlp._load("stopwords", load) == ["the", "a"]
+    download.assert_called_once_with("stopwords", quiet=True)
+
+
+def test_configure_adds_data_dirs(mocker):
+    mocker.patch.object(nltk.data, "path", ["/default"])
+    mocker.patch.object(config, "NLTK_DATA", "/first" + os.pathsep + "/second", create=True)
+    mocker.patch.object(nlp, "_configured", False)
+
+    nlp.configure()
+    nlp.configure()
+
+    assert nltk.data.path == ["/first", "/second", "/default"]
+
+
+def test_stopword_set_loads_corpus_once(mocker):
+    mocker.patch.dict(nlp._stopword_sets, clear=True)
+    load = mocker.patch.object(nlp, "stopwords", return_value=["the", "a", "the"])
+
+    words = nlp.stopword_set("english")
+
+    assert words == frozenset(["the", "a"])
+    assert nlp.stopword_set("english") is words
+    load.assert_called_once_with("english")
+
+
+def test_remove_stopwords(mocker):
+    mocker.patch.object(nlp, "stopword_set", return_value=frozenset(["the", "a"]))
+
+    assert nlp.remove_stopwords(["the", "red", "a", "truck", "The"]) == ["red", "truck", "The"]
+
+
+def test_regex_tokenize():
+    text = "The real-time search isn't slow, it's 2x faster (mostly)! Ünïcode…"
+
+    assert nlp.regex_tokenize(text) == [
+        "The", "real-time", "search", "isn't", "slow", "it's", "2x", "faster", "mostly", "Ünïcode",
+    ]
+
+
+def test_tokenize_uses_configured_tokenizer(mocker):
+    word_tokenize = mocker.patch.object(nlp, "word_tokenize", return_value=["nltk"])
+
+    mocker.patch.object(config, "TOKENIZER", "regex", create=True)
+    assert nlp.tokenize("some text") == ["some", "text"]
+    word_tokenize.assert_not_called()
+
+    mocker.patch.object(config, "TOKENIZER", "nltk")
+    assert nlp.tokenize("some text") == ["nltk"]
+
+
+def test_tokenize_spans(mocker):
+    text = 'Say "cannot" twice.'
+
+    mocker.patch.object(config, "TOKENIZER", "regex", create=True)
+    assert nlp.tokenize_spans(text) == [("Say", 0, 3), ("cannot", 5, 11), ("twice", 13, 18)]
+
+    mocker.patch.object(config, "TOKENIZER", "nltk")
+    mocker.patch.object(nlp, "word_tokenize", return_value=["Say", "``", "can", "not", "''", "twice", "."])
+    assert nlp.tokenize_spans(text) == [
+        ("Say", 0, 3), ("can", 5, 8), ("not", 8, 11), ("twice", 13, 18), (".", 18, 19)
+    ]
@@ -6,7 +6,9 @@ import sqlite3
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 import pytest
-from wiki.web.pageDAO import PageDaoManager
+from wiki.web.pageDAO import PageDaoManager, encode_positions
+from wiki.web.query import parse_query
+from wiki.web.terms import TermDictionary
 from wiki.web.db import *
 
 
@@ -37,8 +39,18 @@ def dao(client):
 
 
 class MockPage:
-    def __init__(self, id):
+    def __init__(self, id, tokens=None):
         self.id = id
+        self.tokens = tokens
+
+    def tokenize_and_count(self):
+        return self.tokens
+
+    def token_positions(self):
+        return {token: list(range(frequency)) for token, frequency in self.tokens.items()}
+
+    def term_offsets(self, tokens):
+        return {}
 
 
 def test_update_page_index_id(client, dao):
@@ -166,12 +178,12 @@ def test_search_case_sensitive(client, dao):
     dao.add_or_update_tokens(page2, page_index2)
 
     # Test a case-sensitive search for "word1" and "Word2"
-    result_dict = dao.search(["word1", "Word2"], ignore_case=False)
+    result_dict = dao.search(["word1", "Word2"], ignore_case=False, ranking="frequency")
     assert len(result_dict) == 1
     assert result_dict[page1.id] == 5
 
     # Test a case-sensitive search for "WORD1" and "word2"
-    result_dict = dao.search(["WORD1", "word2"], ignore_case=False)
+    result_dict = dao.search(["WORD1", "word2"], ignore_case=False, ranking="frequency")
     assert len(result_dict) == 1
     assert result_dict[page2.id] == 5
 
@@ -190,13 +202,13 @@ def test_search_case_insensitive(client, dao):
     dao.add_or_update_tokens(page2, page_index2)
 
     # Test a case-insensitive search for "word1" and "Word2"
-    result_dict = dao.search(["word1", "Word2"], ignore_case=True)
+    result_dict = dao.search(["word1", "Word2"], ignore_case=True, ranking="frequency")
     assert len(result_dict) == 2
     assert result_dict[page1.id] == 5
     assert result_dict[page2.id] == 5
 
     # Test a case-insensitive search for "WORD1" and "word2"
-    result_dict = dao.search(["WORD1", "word2"], ignore_case=True)
+    result_dict = dao.search(["WORD1", "word2"], ignore_case=True, ranking="frequency")
     assert len(result_dict) == 2
     assert result_dict[page1.id] == 5
     assert result_dict[page2.id] == 5
@@ -227,3 +239,280 @@ def test_search_returns_results_in_descending_order(client, dao):
         if first_frequency is not None:
             assert frequency <= first_frequency
         first_frequency = frequency
+
+
+def test_update_page_index_writes_only_changed_tokens(client, dao, mocker):
+    page = MockPage("testid", {"word1": 1, "word2": 2, "word3": 3})
+    dao.update_page_index(page)
+
+    page.tokens = {"word1": 1, "word2": 5, "word4": 1}
+    delete_tokens = mocker.spy(dao, "_delete_tokens")
+    add_or_update_tokens = mocker.spy(dao, "_add_or_update_tokens")
+    dao.update_page_index(page)
+
+    # word3 is deleted, word2 is updated and word4 is added; word1 is untouched
+    delete_tokens.assert_called_once_with("testid", {"word3"})
+    add_or_update_tokens.assert_called_once_with("testid", {"word2": 5, "word4": 1})
+    assert dao.get_tokens(page) == page.tokens
+    assert not dao.connection.in_transaction
+
+
+def test_reindex_pages(client, dao):
+    pages = [
+        MockPage("page1", {"word1": 1}),
+        MockPage("page2", {"word1": 2, "word2": 1}),
+        MockPage("page3", {}),
+    ]
+
+    dao.reindex_pages(pages)
+
+    for page in pages:
+        assert dao.get_tokens(page) == page.tokens
+    assert not dao.connection.in_transaction
+
+
+def test_store_page_indexes_rolls_back_on_error(client, dao):
+    dao.store_page_indexes([("page1", {"word1": 1})])
+
+    def page_indexes():
+        yield "page1", {"word2": 1}
+        raise RuntimeError("tokenizer failed")
+
+    with pytest.raises(RuntimeError):
+        dao.store_page_indexes(page_indexes())
+
+    assert dao.get_tokens(MockPage("page1")) == {"word1": 1}
+
+
+def test_token_updates_are_committed_with_statistics(client, dao):
+    page = MockPage("testid")
+
+    dao.add_or_update_tokens(page, {"word1": 3, "word2": 2})
+    dao.add_or_update_tokens(page, {"word2": 4})
+    dao.delete_old_tokens(page, {"word2": 1})
+    dao.connection.rollback()
+
+    assert dao.get_tokens(page) == {"word2": 4}
+    assert dict(dao.cur.execute("SELECT doc_id, length FROM page_stats").fetchall()) == {"testid": 4}
+    assert dict(dao.cur.execute("SELECT term, doc_freq FROM term_stats").fetchall()) == {"word1": 0, "word2": 1}
+
+
+def test_store_page_indexes_keeps_statistics(client, dao):
+    dao.store_page_indexes([("page1", {"Word": 2, "word": 1, "other": 3})])
+    dao.store_page_indexes([("page2", {"word": 4})])
+
+    assert dict(dao.cur.execute("SELECT doc_id, length FROM page_stats").fetchall()) == {
+        "page1": 6,
+        "page2": 4,
+    }
+    assert dict(dao.cur.execute("SELECT term, doc_freq FROM term_stats").fetchall()) == {
+        "word": 2,
+        "other": 1,
+    }
+
+    dao.store_page_indexes([("page1", {"other": 1})])
+    dao.delete_doc_ids(["page2"])
+
+    assert dict(dao.cur.execute("SELECT doc_id, length FROM page_stats").fetchall()) == {"page1": 1}
+    # terms no page contains anymore are kept at 0 until the statistics are rebuilt
+    assert dict(dao.cur.execute("SELECT term, doc_freq FROM term_stats").fetchall()) == {"word": 0, "other": 1}
+
+    dao.rebuild_statistics()
+    assert dict(dao.cur.execute("SELECT term, doc_freq FROM term_stats").fetchall()) == {"other": 1}
+
+
+def test_rebuild_statistics(client, dao):
+    dao.store_page_indexes([("page1", {"Word": 2, "word": 1, "other": 3}), ("page2", {"word": 4})])
+    stats = dict(dao.cur.execute("SELECT doc_id, length FROM page_stats").fetchall())
+    terms = dict(dao.cur.execute("SELECT term, doc_freq FROM term_stats").fetchall())
+
+    dao.rebuild_statistics()
+
+    assert dict(dao.cur.execute("SELECT doc_id, length FROM page_stats").fetchall()) == stats
+    assert dict(dao.cur.execute("SELECT term, doc_freq FROM term_stats").fetchall()) == terms
+
+
+def test_search_bm25_prefers_rare_terms(client, dao):
+    dao.store_page_indexes(
+        [
+            ("page1", {"common": 3, "filler": 1}),
+            ("page2", {"common": 1, "rare": 1, "filler": 2}),
+            ("page3", {"common": 1, "filler": 3}),
+        ]
+    )
+
+    result_dict = dao.search(["common", "rare"])
+
+    assert list(result_dict) == ["page2", "page1", "page3"]
+
+
+def test_search_bm25_prefers_shorter_pages(client, dao):
+    dao.store_page_indexes(
+        [
+            ("long", {"term": 2, "filler": 200}),
+            ("short", {"term": 2, "filler": 2}),
+            ("other", {"filler": 5}),
+        ]
+    )
+
+    result_dict = dao.search(["term"])
+
+    assert list(result_dict) == ["short", "long"]
+    assert result_dict["short"] > result_dict["long"] > 0
+
+
+def test_search_limit(client, dao):
+    dao.store_page_indexes([("page{}".format(i), {"term": i}) for i in range(1, 6)])
+
+    result_dict = dao.search(["term"], limit=2)
+
+    assert list(result_dict) == ["page5", "page4"]
+
+
+def test_search_case_insensitive_uses_term_index(client, dao):
+    dao.store_page_indexes([("page1", {"Word": 2, "WORD": 1}), ("page2", {"word": 4})])
+
+    plan = dao.cur.execute(
+        "EXPLAIN QUERY PLAN SELECT doc_id FROM page_index WHERE term IN (?)", ("word",)
+    ).fetchall()
+
+    assert "USING COVERING INDEX page_index_term" in " ".join(row[-1] for row in plan)
+    assert dao.search(["wOrD"], ranking="frequency") == {"page2": 4, "page1": 3}
+
+
+def test_store_term_offsets(client, dao):
+    dao.store_page_indexes([("page1", {"Word": 1, "other": 1}, {"word": 10, "other": 20})])
+    dao.store_page_indexes([("page2", {"word": 1}, {"word": 5})])
+
+    assert dao.get_term_positions(["page1", "page2"], ["WORD", "other"]) == {"page1": 10, "page2": 5}
+    assert dao.get_term_positions(["page1"], ["other"]) == {"page1": 20}
+
+    dao.store_page_indexes([("page1", {"other": 1}, {"other": 30})])
+    dao.delete_doc_ids(["page2"])
+
+    assert dao.get_term_positions(["page1", "page2"], ["word", "other"]) == {"page1": 30}
+    assert dao.get_term_positions([], ["word"]) == {}
+    assert dao.get_term_positions(["page1", "page2", "page3"], ["word", "other"], batch_size=1) == {"page1": 30}
+
+
+def test_search_expands_prefixes_and_typos(client, dao):
+    dao.store_page_indexes(
+        [
+            ("page1", {"deploy": 1, "filler": 5}),
+            ("page2", {"deployment": 1, "filler": 5}),
+            ("page3", {"kubernetes": 1, "filler": 5}),
+        ]
+    )
+
+    # the exact match ranks above the expanded one
+    assert list(dao.search(["deploy"])) == ["page1", "page2"]
+    assert list(dao.search(["kubernets"])) == ["page3"]
+    assert list(dao.search(["deploy"], expand=False)) == ["page1"]
+    assert list(dao.search(["deploy"], ignore_case=False)) == ["page1"]
+
+
+def test_exact_matches_outrank_rare_expansions(client, dao):
+    dao.store_page_indexes(
+        [("page{}".format(i), {"deploy": 3}) for i in range(10)] + [("rare", {"deployments": 1})]
+    )
+
+    # the expansion is rarer than the search term, but never scores above it
+    assert list(dao.search(["deploy"]))[-1] == "rare"
+    assert list(dao.search_query(parse_query("deploy")))[-1] == "rare"
+
+
+def test_term_dictionary_follows_index_updates(client, dao):
+    dao.store_page_indexes([("page1", {"deploy": 1})])
+    dao.search(["deploy"])
+    assert "deploy" in dao.term_dictionary
+
+    dao.store_page_indexes([("page2", {"deployment": 1})])
+    assert "deployment" in dao.term_dictionary
+
+    dao.delete_doc_ids(["page2"])
+    assert "deployment" not in dao.term_dictionary
+    assert list(dao.search(["deploy"])) == ["page1"]
+
+    # terms written by another process are picked up by the next search
+    with app.app_context():
+        other = PageDaoManager()
+    other.term_dictionary = TermDictionary()
+    other.store_page_indexes([("page3", {"deployed": 1})])
+    assert list(dao.search(["deploy"])) == ["page1", "page3"]
+
+
+def test_term_dictionary_follows_other_processes(client, dao):
+    dao.store_page_indexes([("page1", {"deploy": 1, "deployed": 1})])
+    dao.complete_terms("dep")
+    with app.app_context():
+        other = PageDaoManager()
+    other.term_dictionary = TermDictionary()
+
+    # document frequencies and removed terms, whatever the rowids
+    other.store_page_indexes([("page2", {"deploy": 1, "deployment": 1})])
+    other.store_page_indexes([("page1", {"deploy": 1})])
+    assert dao.complete_terms("dep") == ["deploy", "deployment"]
+
+    # a rebuild loads the dictionary again
+    other.clear()
+    other.store_page_indexes([("page3", {"depot": 1})])
+    assert dao.complete_terms("dep") == ["depot"]
+
+
+def store_text(dao, doc_id, text):
+    positions = {}
+    for position, token in enumerate(text.split()):
+        positions.setdefault(token, []).append(position)
+    page_index = {token: len(token_positions) for token, token_positions in positions.items()}
+    dao.store_page_indexes([(doc_id, page_index, {}, positions)])
+
+
+def test_store_positions(client, dao):
+    store_text(dao, "page1", "Red car red truck")
+
+    rows = dao.cur.execute("SELECT term, positions FROM page_positions WHERE doc_id = 'page1'").fetchall()
+    assert dict(rows) == {
+        "red": encode_positions([0, 2]), "car": encode_positions([1]), "truck": encode_positions([3])
+    }
+
+    store_text(dao, "page1", "red truck")
+    dao.update_page_index_id("page2", "page1")
+
+    rows = dao.cur.execute("SELECT term, doc_id FROM page_positions").fetchall()
+    assert sorted(map(tuple, rows)) == [("red", "page2"), ("truck", "page2")]
+
+    dao.delete_doc_ids(["page2"])
+    assert dao.cur.execute("SELECT COUNT(*) FROM page_positions").fetchone()[0] == 0
+
+
+def test_search_query_and_or_not(client, dao, mocker):
+    mocker.patch.object(PageDaoManager, "split_query", staticmethod(str.split))
+    store_text(dao, "page1", "red truck")
+    store_text(dao, "page2", "red car")
+    store_text(dao, "page3", "blue truck")
+
+    assert set(dao.search_query(parse_query("red AND truck"))) == {"page1"}
+    assert set(dao.search_query(parse_query("red truck"))) == {"page1", "page2", "page3"}
+    assert set(dao.search_query(parse_query("red AND car OR blue"))) == {"page2", "page3"}
+    assert set(dao.search_query(parse_query("truck -red"))) == {"page3"}
+    assert set(dao.search_query(parse_query("red AND missing"))) == set()
+    # pages that match more of the terms rank higher
+    assert list(dao.search_query(parse_query("red OR truck -blue")))[0] == "page1"
+
+
+def test_search_query_phrases(client, dao, mocker):
+    mocker.patch("wiki.core.Page.tokenize", staticmethod(str.split))
+    store_text(dao, "page1", "the quick brown fox")
+    store_text(dao, "page2", "quick brown quick brown dogs")
+    store_text(dao, "page3", "quick and brown")
+
+    assert list(dao.search_query(parse_query('"quick brown"'))) == ["page2", "page1"]
+    assert set(dao.search_query(parse_query('"Quick Brown"'))) == {"page1", "page2"}
+    assert set(dao.search_query(parse_query('"brown quick"'))) == {"page2"}
+    # stopwords are not indexed but keep their position
+    assert set(dao.search_query(parse_query('"quick and brown"'))) == {"page3"}
+    assert set(dao.search_query(parse_query('brown -"quick brown"'))) == {"page3"}
+    assert set(dao.search_query(parse_query('"quick brown" AND fox'))) == {"page1"}
+    assert dao.search_query(parse_query('"quick brown"'), limit=1, offset=1) == {
+        "page1": dao.search_query(parse_query('"quick brown"'))["page1"]
+    }
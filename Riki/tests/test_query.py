@@ -0,0 +1,31 @@
+from wiki.web.query import Phrase, Query, Term, parse_query
+
+
+def test_parse_words_are_or():
+    query = parse_query("red truck")
+
+    assert query == Query([[Term("red")], [Term("truck")]], [])
+    assert query.is_simple
+
+
+def test_parse_and_binds_tighter_than_or():
+    query = parse_query("a AND b OR c d AND e")
+
+    assert query.groups == [[Term("a"), Term("b")], [Term("c")], [Term("d"), Term("e")]]
+    assert not query.is_simple
+    # lower case operators are plain words
+    assert parse_query("a and b").groups == [[Term("a")], [Term("and")], [Term("b")]]
+
+
+def test_parse_phrases_and_exclusions():
+    query = parse_query('"quick brown" AND fox -dog -"lazy cat" "unterminated')
+
+    assert query.groups == [[Phrase("quick brown"), Term("fox")], [Phrase("unterminated")]]
+    assert query.excluded == [Term("dog"), Phrase("lazy cat")]
+    assert query.terms == [Phrase("quick brown"), Term("fox"), Phrase("unterminated")]
+
+
+def test_parse_dangling_operators():
+    assert parse_query("AND a AND").groups == [[Term("a")]]
+    assert parse_query("- -").groups == [[Term("-")], [Term("-")]]
+    assert parse_query("").groups == []
@@ -1,13 +1,15 @@
 import pytest
-from unittest.mock import patch
+from unittest.mock import call, patch
 import os
 from io import BytesIO
+from types import SimpleNamespace
 from Riki import app
 from PIL import Image
 import wiki.web.routes
 import tempfile
 import config
 from wiki.web.db import *
+from wiki.web.imageDAO import ImageDAO
 
 
 @pytest.fixture
@@ -29,6 +31,14 @@ def client():
     os.unlink(db_path)
 
 
+def image_file(filename):
+    # uploads that do not decode as images are removed again by the image workers
+    data = BytesIO()
+    Image.new("RGB", (10, 10)).save(data, "JPEG")
+    data.seek(0)
+    return data, filename
+
+
 # this fixture will create a page that we can test on, and destroy it when our
 # test is over.  Check out the official pytest docs for more details on fixtures.
 @pytest.fixture
@@ -268,11 +278,13 @@ def test_upload_image(client):
     ), follow_redirects=True)
 
     file = tempfile.NamedTemporaryFile(suffix='.jpg')
+    Image.new("RGB", (10, 10)).save(file, "JPEG")
+    file.seek(0)
     file.filename = 'filename.jpg'
-    # send the request
+    # send the request, the test client would send the path of the temporary file as its name
     rv = client.post(
         "/user/upload/",
-        data={"an_image": file},
+        data={"an_image": (file, file.filename)},
         follow_redirects=True,
     )
 
@@ -366,7 +378,7 @@ def test_upload_image_repeat_filename_error(client):
     rv1 = client.post(
         "/user/upload/",
         headers={'content-type':'multipart/form-data'},
-        data={"an_image": (tempfile.TemporaryFile(), 'filename.jpg')},
+        data={"an_image": image_file('filename.jpg')},
         follow_redirects=True,
     )
 
@@ -376,7 +388,7 @@ def test_upload_image_repeat_filename_error(client):
     rv2 = client.post(
         "/user/upload/",
         headers={'content-type':'multipart/form-data'},
-        data={"an_image": (tempfile.TemporaryFile(), 'filename.jpg')},
+        data={"an_image": image_file('filename.jpg')},
         follow_redirects=True,
     )
     assert b'Image Saved!' in rv1.data
@@ -444,7 +456,7 @@ def test_user_images(client):
         "/user/upload/",
         headers={"Content-Type": "multipart/form-data"},
         data={
-            'an_image' : (tempfile.TemporaryFile(), 'filename.jpg')
+            'an_image' : image_file('filename.jpg')
         },
         follow_redirects=True,
     )
@@ -480,7 +492,7 @@ def test_index_images(client):
         "/user/upload/",
         headers={"Content-Type": "multipart/form-data"},
         data={
-            'an_image' : (tempfile.TemporaryFile(), 'filename1.jpg')
+            'an_image' : image_file('filename1.jpg')
         },
         follow_redirects=True,
     )
@@ -488,7 +500,7 @@ def test_index_images(client):
         "/user/upload/",
         headers={"Content-Type": "multipart/form-data"},
         data={
-            'an_image' : (tempfile.TemporaryFile(), 'filename2.jpg')
+            'an_image' : image_file('filename2.jpg')
         },
         follow_redirects=True,
     )
@@ -496,7 +508,7 @@ def test_index_images(client):
         "/user/upload/",
         headers={"Content-Type": "multipart/form-data"},
         data={
-            'an_image' : (tempfile.TemporaryFile(), 'filename3.jpg')
+            'an_image' : image_file('filename3.jpg')
         },
         follow_redirects=True,
     )
@@ -504,7 +516,7 @@ def test_index_images(client):
         "/user/upload/",
         headers={"Content-Type": "multipart/form-data"},
         data={
-            'an_image' : (tempfile.TemporaryFile(), 'filename4.jpg')
+            'an_image' : image_file('filename4.jpg')
         },
         follow_redirects=True,
     )
@@ -519,3 +531,143 @@ def test_index_images(client):
     assert b'johnDoe%40riki.com' in rv.data
     
 
+
+def login(client):
+    client.post('/user/create/', data={
+        'first_name': 'john',
+        'last_name':  'doe',
+        'email': 'johnDoe@riki.com',
+        'password': 'password',
+        'confirm_password': 'password',
+    }, follow_redirects=True)
+    client.post('/user/login/', data=dict(
+        email='johnDoe@riki.com',
+        password='password'
+    ), follow_redirects=True)
+
+def test_upload_invalid_image_is_removed(client):
+    login(client)
+    with patch("wiki.web.routes.get_executor") as get_executor:
+        client.post(
+            "/user/upload/",
+            data={'an_image': (BytesIO(b'not an image'), 'broken.jpg')},
+            headers={"Referer": "/img/"},
+        )
+        # run the background job in the test
+        job, *args = get_executor.return_value.submit.call_args[0]
+    assert os.path.exists(os.path.join(config.PIC_BASE, 'broken.jpg'))
+
+    job(*args)
+
+    assert not os.path.exists(os.path.join(config.PIC_BASE, 'broken.jpg'))
+    with app.app_context():
+        assert not ImageDAO().filename_exists('broken.jpg')
+
+def test_upload_rejects_unsafe_file_names(client):
+    login(client)
+    with patch("wiki.web.routes.get_executor") as get_executor:
+        for filename in ('../escaped.jpg', 'with space.jpg'):
+            rv = client.post(
+                "/user/upload/",
+                data={'an_image': image_file(filename)},
+                headers={"Referer": "/img/"},
+                follow_redirects=True,
+            )
+            assert b'File name not allowed!' in rv.data
+    get_executor.return_value.submit.assert_not_called()
+    assert not os.path.exists(os.path.join(config.PIC_BASE, '..', 'escaped.jpg'))
+    assert not os.path.exists(os.path.join(config.PIC_BASE, 'with space.jpg'))
+    with app.app_context():
+        assert not ImageDAO().filename_exists('with space.jpg')
+
+
+def test_upload_image_too_large(client):
+    login(client)
+    with patch.dict(app.config, MAX_CONTENT_LENGTH=1024):
+        rv = client.post(
+            "/user/upload/",
+            data={'an_image': (BytesIO(b'x' * 2048), 'large.jpg')},
+            headers={"Referer": "/img/"},
+            follow_redirects=True,
+        )
+    assert b'The image is too large!' in rv.data
+    assert not os.path.exists(os.path.join(config.PIC_BASE, 'large.jpg'))
+
+def test_search_results_api(client):
+    pages = [
+        SimpleNamespace(
+            url="page{}".format(i), title="Title page{}".format(i), snippet="<mark>body</mark>"
+        )
+        for i in range(3)
+    ]
+    with patch("wiki.core.Wiki.search", return_value=pages) as search:
+        rv = client.get("/search/results/?q=body&offset=4&limit=2")
+
+    search.assert_called_once_with("body", True, limit=3, offset=4, snippets=True)
+    assert rv.get_json() == {
+        "results": [
+            {"url": "page0", "title": "Title page0", "snippet": "<mark>body</mark>"},
+            {"url": "page1", "title": "Title page1", "snippet": "<mark>body</mark>"},
+        ],
+        "offset": 4,
+        "limit": 2,
+        "next_offset": 6,
+    }
+
+
+def test_search_pages_through_results(client):
+    pages = [
+        SimpleNamespace(url="page{}".format(i), title="Title page{}".format(i), snippet=None)
+        for i in range(3)
+    ]
+    app.config["SEARCH_PAGE_SIZE"] = 2
+    try:
+        with patch("wiki.core.Wiki.search", return_value=pages) as search:
+            first = client.post("/search/", data={"term": "body", "ignore_case": "y"})
+            second = client.get("/search/?q=body&ignore_case=false&offset=2")
+    finally:
+        del app.config["SEARCH_PAGE_SIZE"]
+
+    assert search.call_args_list[0] == call("body", True, limit=3, offset=0, snippets=True)
+    assert search.call_args_list[1] == call("body", False, limit=3, offset=2, snippets=True)
+    assert b"Title page1" in first.data and b"Title page2" not in first.data
+    assert b"/search/?q=body&amp;ignore_case=true&amp;offset=2" in first.data
+    assert b'value="body"' in second.data
+
+
+def test_search_results_api_without_snippet(client):
+    page = SimpleNamespace(url="page", title="Page", snippet=None)
+    with patch("wiki.core.Wiki.search", return_value=[page]):
+        rv = client.get("/search/results/?q=body")
+
+    assert rv.get_json()["results"] == [{"url": "page", "title": "Page", "snippet": None}]
+
+
+def test_search_complete(client, testpage):
+    with patch("wiki.web.pageDAO.PageDaoManager.complete_terms", return_value=["test"]) as complete_terms:
+        rv = client.get("/search/complete/?q=Test")
+        assert rv.get_json() == {"titles": [{"url": "testpage", "title": "testpage"}], "terms": ["test"]}
+        complete_terms.assert_called_once_with("Test", 8)
+
+        # only the last word is completed to a term, and only while it is typed
+        client.get("/search/complete/?q=this is a te&limit=50")
+        complete_terms.assert_called_with("te", 20)
+        rv = client.get("/search/complete/?q=test ")
+        assert rv.get_json()["terms"] == []
+
+
+def test_search_complete_follows_edits(client, testpage):
+    client.get("/search/complete/?q=x")
+    client.post(
+        "/edit/testpage",
+        data={"title": "Renamed test page", "body": "body", "tags": ""},
+        follow_redirects=True,
+    )
+    assert client.get("/search/complete/?q=renamed").get_json()["titles"] == [
+        {"url": "testpage", "title": "Renamed test page"}
+    ]
+
+    client.get("/delete/testpage/")
+    assert client.get("/search/complete/?q=renamed").get_json()["titles"] == []
+    # the fixture removes the file again
+    open("content/testpage.md", "w").close()
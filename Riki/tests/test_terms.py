@@ -0,0 +1,116 @@
+import sqlite3
+from wiki.web import terms
+from wiki.web.terms import TermDictionary
+
+
+def make_dictionary(doc_freqs):
+    dictionary = TermDictionary()
+    dictionary.load(doc_freqs.items())
+    return dictionary
+
+
+def test_prefixed_returns_most_frequent_terms():
+    dictionary = make_dictionary({"deploy": 3, "deployment": 5, "deployed": 1, "depot": 9})
+
+    assert dictionary.prefixed("deploy") == ["deployment", "deploy", "deployed"]
+    assert dictionary.prefixed("deploy", limit=1) == ["deployment"]
+    assert dictionary.prefixed("zzz") == []
+
+
+def test_similar_finds_terms_one_edit_away():
+    dictionary = make_dictionary({"search": 2, "starch": 1, "serach": 4, "research": 1})
+
+    # transposition, insertion, deletion and substitution
+    assert dictionary.similar("serach") == ["search"]
+    assert set(dictionary.similar("sarch")) == {"search", "starch"}
+    assert set(dictionary.similar("esearch")) == {"research", "search"}
+    assert dictionary.similar("seerch") == ["search"]
+
+
+def test_expand():
+    dictionary = make_dictionary({"deploy": 3, "deployment": 5, "kubernetes": 2})
+
+    assert dictionary.expand(["deploy", "kubernets", "de"]) == {
+        "deploy": 1,
+        "deployment": terms.PREFIX_WEIGHT,
+        "kubernets": 1,
+        "kubernetes": terms.TYPO_WEIGHT,
+        "de": 1,
+    }
+    assert dictionary.expansions(["deploy", "kubernets"]) == {
+        "deploy": (1, "deploy"),
+        "deployment": (terms.PREFIX_WEIGHT, "deploy"),
+        "kubernets": (1, "kubernets"),
+        "kubernetes": (terms.TYPO_WEIGHT, "kubernets"),
+    }
+
+
+def test_add_and_remove():
+    dictionary = make_dictionary({"alpha": 1})
+
+    dictionary.add("alphabet")
+    dictionary.add("alphabet")
+    dictionary.remove("alphabet")
+    assert set(dictionary.prefixed("alpha")) == {"alpha", "alphabet"}
+
+    dictionary.remove("alphabet")
+    dictionary.remove("alpha")
+    assert dictionary.prefixed("alpha") == []
+    assert len(dictionary) == 0
+
+
+def test_added_terms_are_merged(mocker):
+    mocker.patch.object(terms, "MERGE_THRESHOLD", 2)
+    dictionary = make_dictionary({"b": 1})
+
+    for term in ("a", "c", "d", "b"):
+        dictionary.add(term)
+
+    matches = dictionary.prefixed("")
+    assert matches[0] == "b" and sorted(matches) == ["a", "b", "c", "d"]
+    assert dictionary.prefixed("c") == ["c"]
+
+
+def test_changes_before_loading_are_ignored():
+    dictionary = TermDictionary()
+    dictionary.add("term")
+
+    assert "term" not in dictionary
+
+
+def make_database(doc_freqs, version=1, rebuild=0):
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE term_stats (term TEXT PRIMARY KEY, doc_freq INTEGER, version INTEGER)")
+    db.execute("CREATE TABLE table_versions (name TEXT PRIMARY KEY, version INTEGER)")
+    db.executemany("INSERT INTO term_stats VALUES (?, ?, ?)", [(term, doc_freq, version) for term, doc_freq in doc_freqs.items()])
+    db.executemany("INSERT INTO table_versions VALUES (?, ?)", [("term_stats", version), ("term_stats_rebuild", rebuild)])
+    return db
+
+
+def test_refresh_reads_rows_of_newer_versions():
+    db = make_database({"deploy": 1, "deployed": 1})
+    dictionary = TermDictionary()
+    dictionary.refresh(db.cursor())
+
+    db.execute("UPDATE term_stats SET doc_freq = 0, version = 2 WHERE term = 'deployed'")
+    db.execute("INSERT INTO term_stats VALUES ('deployment', 3, 2)")
+    db.execute("UPDATE table_versions SET version = 2 WHERE name = 'term_stats'")
+    dictionary.refresh(db.cursor())
+
+    assert dictionary.prefixed("dep") == ["deployment", "deploy"]
+
+
+def test_reload_does_not_block_lookups():
+    db = make_database({"deploy": 1})
+    dictionary = TermDictionary()
+    dictionary.refresh(db.cursor())
+
+    db.execute("DELETE FROM term_stats")
+    db.execute("UPDATE table_versions SET version = version + 1")
+    # another thread is loading the rebuilt statistics, this one keeps the old terms
+    with dictionary._load_lock:
+        dictionary.refresh(db.cursor())
+        assert "deploy" in dictionary
+
+    dictionary.refresh(db.cursor())
+    assert len(dictionary) == 0
@@ -5,28 +5,27 @@
 from collections import OrderedDict
 from io import open
 
+import html
 import os
 import re
+import threading
 
 from flask import abort
 from flask import url_for
 from flask import send_file
 import markdown
 import config
+from markupsafe import escape
+from markupsafe import Markup
+from werkzeug.utils import secure_filename
 import hashlib
 
-import nltk
-
-nltk.download("stopwords")
-nltk.download("punkt")
-
-nltk.download("stopwords")
-nltk.download("punkt")
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
+from wiki import nlp
 from collections import Counter
-from bs4 import BeautifulSoup
-import markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+from markdown.util import AMP_SUBSTITUTE
+from markdown.util import HTML_PLACEHOLDER_RE
 
 
 def clean_url(url):
@@ -48,6 +47,11 @@ def clean_url(url):
     return url
 
 
+LINK_REGEX = re.compile(
+    r"((?<!\<code\>)\[\[([^<].+?) \s*([|] \s* (.+?) \s*)?]])", re.X | re.U
+)
+
+
 def wikilink(text, url_formatter=None):
     """
     Processes Wikilink syntax "[[Link]]" within the html body.
@@ -64,22 +68,192 @@ def wikilink(text, url_formatter=None):
         base location "/", therefore sub-pages need to use the
         [[page/subpage|Subpage]].
 
+    All links are replaced in a single pass over the html and every
+    distinct link target is only run through the url formatter once.
+
     :returns: the processed html
     :rtype: str
     """
     if url_formatter is None:
         url_formatter = url_for
-    link_regex = re.compile(
-        r"((?<!\<code\>)\[\[([^<].+?) \s*([|] \s* (.+?) \s*)?]])", re.X | re.U
+    urls = {}
+
+    def replace(match):
+        title = match.group(4) or match.group(2)
+        url = clean_url(match.group(2))
+        if url not in urls:
+            urls[url] = url_formatter("wiki.display", url=url)
+        return "<a href='{0}'>{1}</a>".format(urls[url], title)
+
+    return LINK_REGEX.sub(replace, text)
+
+
+TAG_REGEX = re.compile(r"<[^>]*>")
+
+
+def html_to_text(text):
+    """
+    Strips the tags from a piece of html and resolves its entities.
+
+    :param str text: the html
+    :returns: the plain text
+    :rtype: str
+    """
+    return html.unescape(TAG_REGEX.sub("", text))
+
+
+# Search result excerpts: bytes read around the first match and shown before it
+SNIPPET_LENGTH = 240
+SNIPPET_CONTEXT = 60
+
+# Markdown syntax that is dropped from excerpts, which are cut from the page source
+SNIPPET_LINK_REGEX = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+SNIPPET_MARKUP_REGEX = re.compile(r"(?<!\w)[*_`~]+|[*_`~]+(?!\w)|^\s*(?:#+|>|[-+*]|\d+\.)\s", re.M)
+# A blank line in a page file, which may have been saved with CRLF line endings
+BLANK_LINE_REGEX = re.compile(rb"\r?\n\r?\n")
+
+
+def body_offset(data):
+    """
+    Returns where the body of a page file starts, after the first blank line
+    that ends the metadata, see :meth:`Page.load_meta`.
+
+    :param bytes data: the start of the page file
+    :rtype: int
+    """
+    match = BLANK_LINE_REGEX.search(data)
+    return match.end() if match is not None else 0
+
+
+def read_body_offset(f):
+    """
+    Returns where the body of a page file starts like :func:`body_offset`,
+    but only reads the metadata header, however long it is.
+
+    :param f: the page file, opened in binary mode
+    :rtype: int
+    """
+    f.seek(0)
+    data = b""
+    for chunk in iter(lambda: f.read(SNIPPET_LENGTH * 4), b""):
+        # only search the new chunk, and the line ending it may complete
+        match = BLANK_LINE_REGEX.search(data + chunk, max(len(data) - 3, 0))
+        if match is not None:
+            return match.end()
+        data += chunk
+    return 0
+
+
+def markdown_to_snippet(text):
+    """
+    Turns a piece of markdown source into plain text for a search result
+    excerpt, without rendering it. Links and wikilinks are replaced by their
+    text and the most common inline and block markup is removed.
+
+    :param str text: the markdown source
+    :returns: the text on a single line
+    :rtype: str
+    """
+    text = LINK_REGEX.sub(lambda match: match.group(4) or match.group(2), text)
+    text = SNIPPET_LINK_REGEX.sub(r"\1", text)
+    text = SNIPPET_MARKUP_REGEX.sub("", TAG_REGEX.sub("", text))
+    return " ".join(text.split())
+
+
+def highlight(text, terms):
+    """
+    Escapes a piece of text and wraps every occurrence of the given search
+    terms in ``<mark>``. Phrases in quotes and prefixes ending in ``*`` are
+    understood as well.
+
+    :param str text: the plain text
+    :param list terms: the search terms
+    :returns: the html
+    :rtype: markupsafe.Markup
+    """
+    patterns = []
+    for term in terms:
+        term = term.strip('"')
+        prefix = term.endswith("*")
+        term = " ".join(term.rstrip("*").split())
+        if term:
+            patterns.append(r"\s+".join(map(re.escape, term.split(" "))) + (r"\w*" if prefix else ""))
+    if not patterns:
+        return escape(text)
+
+    # Longer terms first, so they win over terms they contain
+    regex = re.compile(
+        r"(?<!\w)(?:{})(?!\w)".format("|".join(sorted(patterns, key=len, reverse=True))),
+        re.I,
     )
-    for i in link_regex.findall(text):
-        title = [i[-1] if i[-1] else i[1]][0]
-        url = clean_url(i[1])
-        html_url = "<a href='{0}'>{1}</a>".format(
-            url_formatter("wiki.display", url=url), title
+    result, last = Markup(), 0
+    for match in regex.finditer(text):
+        result += text[last:match.start()] + Markup("<mark>%s</mark>") % match.group()
+        last = match.end()
+    return result + text[last:]
+
+
+class TextTreeprocessor(Treeprocessor):
+    """
+    Collects the plain text of a document from the element tree while it
+    is rendered, so indexing does not have to parse the html again.
+
+    Code blocks and raw html are only stashed placeholders in the tree,
+    those are replaced by the text of the stashed html. Wikilinks are
+    replaced by their titles, like in the rendered page.
+    """
+
+    def run(self, root):
+        stash = self.md.htmlStash.rawHtmlBlocks
+        text = "".join(root.itertext())
+        text = HTML_PLACEHOLDER_RE.sub(
+            lambda match: TAG_REGEX.sub("", stash[int(match.group(1))]), text
         )
-        text = re.sub(link_regex, html_url, text, count=1)
-    return text
+        text = LINK_REGEX.sub(lambda match: match.group(4) or match.group(2), text)
+        self.md.plain_text = html.unescape(text.replace(AMP_SUBSTITUTE, "&"))
+
+
+class TextExtension(Extension):
+    """
+    Makes the plain text of the last converted document available as
+    ``md.plain_text``.
+    """
+
+    def extendMarkdown(self, md):
+        md.registerExtension(self)
+        self.md = md
+        # after all other treeprocessors, including unescape (0)
+        md.treeprocessors.register(TextTreeprocessor(md), "plain_text", -10)
+        self.reset()
+
+    def reset(self):
+        # empty documents are not run through the treeprocessors
+        self.md.plain_text = ""
+
+
+MARKDOWN_EXTENSIONS = ["codehilite", "fenced_code", "meta", "tables"]
+
+_markdown_engines = threading.local()
+
+
+def markdown_engine():
+    """
+    Returns the markdown engine of the current thread.
+
+    Building a :class:`markdown.Markdown` instance sets up the whole
+    extension registry, so every thread builds one engine and reuses it
+    for all documents it renders. Engines are never shared between
+    threads and have to be reset before each document.
+
+    :returns: the markdown engine
+    :rtype: markdown.Markdown
+    """
+    md = getattr(_markdown_engines, "md", None)
+    if md is None:
+        md = _markdown_engines.md = markdown.Markdown(
+            extensions=MARKDOWN_EXTENSIONS + [TextExtension()]
+        )
+    return md
 
 
 class Processor(object):
@@ -100,15 +274,15 @@ class Processor(object):
 
         :param str text: the text to process
         """
-        self.md = markdown.Markdown(
-            extensions=["codehilite", "fenced_code", "meta", "tables"]
-        )
+        self.md = markdown_engine()
         self.input = text
         self.markdown = None
         self.meta_raw = None
 
         self.pre = None
         self.html = None
+        self.md_meta = None
+        self.text = None
         self.final = None
         self.meta = None
 
@@ -125,7 +299,12 @@ class Processor(object):
         """
         Convert to HTML.
         """
+        # the engine is reused between documents, so clear what is left
+        # of the previous one and keep our own reference to the metadata
+        self.md.reset()
         self.html = self.md.convert(self.pre)
+        self.md_meta = self.md.Meta
+        self.text = self.md.plain_text
 
     def split_raw(self):
         """
@@ -148,7 +327,7 @@ class Processor(object):
             key = line.split(":", 1)[0]
             # markdown metadata always returns a list of lines, we will
             # reverse that here
-            self.meta[key.lower()] = "\n".join(self.md.Meta[key.lower()])
+            self.meta[key.lower()] = "\n".join(self.md_meta[key.lower()])
 
     def process_post(self):
         """
@@ -174,8 +353,156 @@ class Processor(object):
         return self.final, self.markdown, self.meta
 
 
+class RenderCache(object):
+    """
+    A bounded cache of rendered page output.
+
+    Entries hold the html, body and meta of a rendered page and are keyed
+    on a hash of the page content, so an edited file never matches a stale
+    entry. When the approximate size of all entries exceeds ``max_size``
+    the least recently used entries are evicted. The cache is shared by
+    all threads of a process.
+    """
+
+    def __init__(self, max_size=32 * 1024 * 1024):
+        """
+        Initialization of the cache.
+
+        :param int max_size: the memory budget in (approximate) bytes
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(content):
+        """
+        Builds the cache key for the given page content.
+
+        :param str content: the raw page content
+
+        :returns: the content hash
+        :rtype: str
+        """
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, path, key):
+        """
+        Looks up the rendered output for the given key.
+
+        :param str path: the path of the page that is rendered
+        :param str key: the content hash of the page
+
+        :returns: a tuple of html, body and meta or None
+        :rtype: tuple
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._set_key(path, key)
+            self.hits += 1
+        html, body, meta = entry[:3]
+        # pages modify their meta in place, so never hand out the cached one
+        return html, body, OrderedDict(meta)
+
+    def put(self, path, key, html, body, meta):
+        """
+        Stores rendered output and evicts the least recently used entries
+        until the cache fits into its memory budget again.
+
+        :param str path: the path of the page that was rendered
+        :param str key: the content hash of the page
+        :param str html: the rendered html
+        :param str body: the markdown body
+        :param meta: the page metadata
+        """
+        size = len(html) + len(body)
+        size += sum(len(k) + len(v) for k, v in meta.items())
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[3]
+            # the paths last rendered with this key, dropped from _keys on eviction
+            self._entries[key] = (html, body, OrderedDict(meta), size, set())
+            self._set_key(path, key)
+            self.size += size
+            self._evict()
+
+    def invalidate(self, path):
+        """
+        Drops the entry that was last rendered for the given path.
+
+        :param str path: the path of the page
+        """
+        with self._lock:
+            key = self._keys.pop(os.path.abspath(path), None)
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[3]
+
+    def resize(self, max_size):
+        """
+        Changes the memory budget, evicting entries if needed.
+
+        :param int max_size: the memory budget in (approximate) bytes
+        """
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self):
+        """
+        Drops all entries and resets the hit and miss counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        :returns: the hit and miss counters and the current usage
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "size": self.size,
+                "max_size": self.max_size,
+            }
+
+    def _set_key(self, path, key):
+        path = os.path.abspath(path)
+        self._keys[path] = key
+        self._entries[key][4].add(path)
+
+    def _evict(self):
+        while self._entries and self.size > self.max_size:
+            key, entry = self._entries.popitem(last=False)
+            self.size -= entry[3]
+            for path in entry[4]:
+                # the path may have been rendered with newer content since
+                if self._keys.get(path) == key:
+                    del self._keys[path]
+
+
+render_cache = RenderCache()
+
+
 class Page(object):
-    def __init__(self, path, url, new=False):
+    def __init__(self, path, url, new=False, lazy=False, meta=None):
         # Initialize instance variables with provided values
         self.path = path
         self.url = url
@@ -183,9 +510,21 @@ class Page(object):
 
         # Create an empty ordered dictionary for storing metadata
         self._meta = OrderedDict()
+        self._html = None
+        self._body = None
+        self._text = None  # Plain text collected while rendering, see `get_page_text`
+        self.snippet = None  # Excerpt shown in search results, see `Wiki.search`
+
+        # A lazy page only knows its metadata until the html or body is accessed
+        self._lazy = lazy and not new
 
         # Load and render the page contents if this is not a new page
-        if not new:
+        if self._lazy:
+            if meta is not None:
+                self._meta = OrderedDict(meta)  # Metadata is already known, e.g. from the page catalog
+            else:
+                self.load_meta()  # Only read the metadata header from file at `path`
+        elif not new:
             self.load()  # Load page contents from file at `path` into instance
             self.render()  # Render page as HTML
 
@@ -198,12 +537,47 @@ class Page(object):
             # Read the contents of the file and store them in the instance's `content` attribute
             self.content = f.read()
 
+    def load_meta(self):
+        """
+        Reads only the metadata header of the page file, which is the block
+        before the first blank line that :meth:`Processor.split_raw` splits on.
+        The page body is neither read nor rendered.
+        """
+        self._meta = OrderedDict()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                # The first blank line ends the metadata header
+                if line == "":
+                    break
+                if ":" not in line:
+                    continue
+                key, value = line.split(":", 1)
+                self._meta[key.lower()] = value.strip()
+
     def render(self):
+        # Reuse the output of an earlier render of the same content if there is one
+        key = render_cache.key(self.content)
+        cached = render_cache.get(self.path, key)
+        if cached is not None:
+            self._html, self._body, self._meta = cached
+            self._text = None
+            return
+
         # Create a `Processor` object to process the page content
         processor = Processor(self.content)
 
         # Process the content and store the resulting HTML, body, and metadata in instance variables
-        self._html, self.body, self._meta = processor.process()
+        self._html, self._body, self._meta = processor.process()
+        self._text = processor.text
+        render_cache.put(self.path, key, self._html, self._body, self._meta)
+
+    def _ensure_rendered(self):
+        # Load and render a lazy page the first time its contents are needed
+        if self._lazy:
+            self._lazy = False
+            self.load()
+            self.render()
 
     def save(self, update=True):
         # Get the directory containing the page file
@@ -213,6 +587,9 @@ class Page(object):
         if not os.path.exists(folder):
             os.makedirs(folder)
 
+        # The cached output of the old content is of no use anymore
+        render_cache.invalidate(self.path)
+
         # Write metadata and page body to the page file
         with open(self.path, "w", encoding="utf-8") as f:
             # Write metadata to the file in the format `key: value`
@@ -247,8 +624,21 @@ class Page(object):
     @property
     def html(self):
         # Returns the HTML code for the page
+        self._ensure_rendered()
         return self._html
 
+    @property
+    def body(self):
+        # Returns the markdown body of the page
+        self._ensure_rendered()
+        return self._body
+
+    @body.setter
+    def body(self, value):
+        # Sets the markdown body of the page
+        self._ensure_rendered()
+        self._body = value
+
     def __html__(self):
         # Returns the HTML code for the page (used by certain frameworks and libraries)
         return self.html
@@ -281,13 +671,16 @@ class Page(object):
 
     def get_page_text(self):
         """
-        Extracts text content from the HTML body using Beautiful Soup, and concatenates it with page title.
+        Returns the text content of the page body, concatenated with the page title.
+
+        The text is collected from the markdown element tree while the page is rendered. Only if that is not
+        available, e.g. when the output came from the render cache, the tags are stripped from the html.
 
         Returns:
             str: A string containing the body text and title of the page separated by a space.
         """
-        # Extract the text content from the HTML body using Beautiful Soup
-        body_text = BeautifulSoup(self.html, "html.parser").get_text()
+        page_html = self.html  # Renders a lazy page, which also collects its text
+        body_text = self._text if self._text is not None else html_to_text(page_html)
 
         # Concatenate the body text and title into a single string with a space in between
         return body_text + " " + self.title
@@ -295,7 +688,9 @@ class Page(object):
     @staticmethod
     def tokenize(page_text):
         """
-        Tokenizes the given text using the word_tokenize function from the nltk library.
+        Tokenizes the given text using the word_tokenize function from the nltk library,
+        which is only loaded on first use, or the regex tokenizer if the TOKENIZER setting
+        is "regex" (see :mod:`wiki.nlp`).
 
         Args:
             page_text (str): The text to be tokenized.
@@ -303,7 +698,7 @@ class Page(object):
         Returns:
             list: A list of tokens extracted from the text.
         """
-        return word_tokenize(page_text)
+        return nlp.tokenize(page_text)
 
     @staticmethod
     def remove_stopwords(tokens):
@@ -317,9 +712,8 @@ class Page(object):
             A list of tokens with stopwords removed.
 
         """
-        # Get a list of English stopwords
-        english_stopwords = stopwords.words("english")
-        return [t for t in tokens if t not in english_stopwords]
+        # The English stopwords are loaded into a frozenset once
+        return nlp.remove_stopwords(tokens, "english")
 
     def token_frequency(self, tokens_wo_stopwords):
         """
@@ -359,6 +753,94 @@ class Page(object):
         # Return the dictionary of word frequencies
         return token_freq
 
+    def token_positions(self):
+        """
+        Tokenizes the page text like :meth:`tokenize_and_count`, but returns where
+        each token occurs instead of how often, for phrase queries. Stopwords are
+        left out, but still count as a position, so the positions of a phrase with
+        a stopword in the middle are not adjacent in the page either.
+
+        Returns:
+            dict: A dictionary containing the list of positions of each token.
+        """
+        stopwords = nlp.stopword_set("english")
+        positions = {}
+        for position, token in enumerate(Page.tokenize(self.get_page_text())):
+            if token not in stopwords:
+                positions.setdefault(token, []).append(position)
+        return positions
+
+    def term_offsets(self, tokens):
+        """
+        Finds the first occurrence of each of the given tokens in the page
+        body, so that search results can show an excerpt around it without
+        reading or rendering the whole page. The body source is split with
+        the configured tokenizer, see :func:`wiki.nlp.tokenize_spans`.
+        Tokens that only occur in the metadata, or only in the rendered
+        text, are left out.
+
+        :param tokens: the indexed tokens, e.g. from :meth:`tokenize_and_count`
+        :returns: the byte offset in the page file by normalized term
+        :rtype: dict
+        """
+        from wiki.web.pageDAO import normalize_term
+
+        wanted = {normalize_term(token) for token in tokens}
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        body_start = body_offset(data)
+        # surrogateescape keeps invalid bytes, so the byte offsets stay exact
+        text = data[body_start:].decode("utf-8", "surrogateescape")
+
+        offsets = {}
+        position, char_position = body_start, 0
+        for token, start, _ in nlp.tokenize_spans(text):
+            term = normalize_term(token)
+            if term in wanted and term not in offsets:
+                position += len(text[char_position:start].encode("utf-8", "surrogateescape"))
+                char_position = start
+                offsets[term] = position
+                if len(offsets) == len(wanted):
+                    break
+        return offsets
+
+    def read_snippet(self, position=None, terms=()):
+        """
+        Builds a search result excerpt from a bounded read of the page file,
+        around the given offset or from the top of the body, with the search
+        terms highlighted.
+
+        :param int position: the byte offset of the first match, see :meth:`term_offsets`
+        :param list terms: the search terms to highlight
+        :returns: the excerpt as html
+        :rtype: markupsafe.Markup
+        """
+        with open(self.path, "rb") as f:
+            if position is None:
+                # No match in the body, e.g. the terms are only in the title
+                position = read_body_offset(f)
+            start = max(position - SNIPPET_CONTEXT, 0)
+            f.seek(start)
+            data = f.read(SNIPPET_LENGTH)
+            truncated = f.read(1) != b""
+
+        # Start after a blank line in front of the match, e.g. the end of the metadata
+        paragraphs = list(BLANK_LINE_REGEX.finditer(data, 0, position - start))
+        if paragraphs:
+            data = data[paragraphs[-1].end():]
+            start = 0
+
+        text = data.decode("utf-8", "ignore")
+        # Drop the words that were cut in half
+        if start > 0 and text.strip():
+            text = text.split(None, 1)[-1]
+        if truncated and text.strip():
+            text = text.rsplit(None, 1)[0]
+
+        snippet = highlight(markdown_to_snippet(text), terms)
+        return Markup("…" if start > 0 else "") + snippet + Markup("…" if truncated else "")
+
 
 class Wiki(object):
     def __init__(self, root):
@@ -410,36 +892,114 @@ class Wiki(object):
         if not os.path.exists(folder):
             os.makedirs(folder)
         os.rename(source, target)
+        render_cache.invalidate(source)
 
     def delete(self, url):
         path = self.path(url)
         if not self.exists(url):
             return False
         os.remove(path)
+        render_cache.invalidate(path)
         return True
 
-    def index(self):
+    def walk(self):
         """
-        Builds up a list of all the available pages.
+        Walks the content directory and yields every markdown file.
 
-        :returns: a list of all the wiki pages
-        :rtype: list
+        :returns: tuples of the file path and the url of each page
+        :rtype: generator
         """
         # make sure we always have the absolute path for fixing the
         # walk path
-        pages = []
         root = os.path.abspath(self.root)
         for cur_dir, _, files in os.walk(root):
             # get the url of the current directory
             cur_dir_url = cur_dir[len(root) + 1 :]
             for cur_file in files:
-                path = os.path.join(cur_dir, cur_file)
                 if cur_file.endswith(".md"):
+                    path = os.path.join(cur_dir, cur_file)
                     url = clean_url(os.path.join(cur_dir_url, cur_file[:-3]))
-                    page = Page(path, url)
-                    pages.append(page)
+                    yield path, url
+
+    def index(self):
+        """
+        Builds up a list of all the available pages.
+
+        The title and tags of each page are answered from the page
+        catalog. Only files that are new, or whose mtime or size changed
+        since they were last catalogued, are read from disk, and then only
+        their metadata header. The returned pages are lazy and render on
+        first access to their html or body.
+
+        :returns: a list of all the wiki pages
+        :rtype: list
+        """
+        # If this isn't locally imported, then a circular import error arises
+        from wiki.web.catalogDAO import CatalogDaoManager
+
+        catalog = CatalogDaoManager()
+        entries = catalog.get_entries()
+        changed = []
+        pages = []
+        for path, url in self.walk():
+            stat = os.stat(path)
+            entry = entries.pop(path, None)
+            if (
+                entry is None
+                or entry["url"] != url
+                or entry["mtime"] != stat.st_mtime_ns
+                or entry["size"] != stat.st_size
+            ):
+                entry = self.catalog_entry(Page(path, url, lazy=True), stat)
+                changed.append(entry)
+            pages.append(self.catalog_page(entry))
+
+        # whatever is left over was not found on disk anymore
+        catalog.update(changed, removed_paths=entries.keys())
         return sorted(pages, key=lambda x: x.title.lower())
 
+    @staticmethod
+    def catalog_entry(page, stat=None):
+        """
+        Creates the page catalog entry of a page from its metadata. The entry is
+        keyed by the absolute file path, like the paths of :meth:`walk`.
+
+        :param page: the page
+        :param stat: the result of :func:`os.stat` for the page file, if already known
+
+        :returns: the entry, see :meth:`wiki.web.catalogDAO.CatalogDaoManager.update`
+        :rtype: dict
+        """
+        path = os.path.abspath(page.path)
+        if stat is None:
+            stat = os.stat(path)
+        return {
+            "path": path,
+            "id": page.id,
+            "url": page.url,
+            "title": page.meta.get("title"),
+            "tags": page.meta.get("tags"),
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+        }
+
+    @staticmethod
+    def catalog_page(entry):
+        """
+        Creates a page from a catalog entry without touching the file.
+
+        :param entry: a row of the page catalog
+
+        :returns: a lazy page with its title and tags populated
+        :rtype: Page
+        """
+        meta = OrderedDict()
+        if entry["title"] is not None:
+            meta["title"] = entry["title"]
+        if entry["tags"] is not None:
+            meta["tags"] = entry["tags"]
+        return Page(entry["path"], entry["url"], lazy=True, meta=meta)
+
     def index_by(self, key):
         """
         Get an index based on the given key.
@@ -488,44 +1048,95 @@ class Wiki(object):
                 tagged.append(page)
         return sorted(tagged, key=lambda x: x.title.lower())
 
-    def search(self, term, ignore_case=True):
+    def search(self, term, ignore_case=True, limit=None, offset=0, snippets=False):
         """
         Search for pages based on given search term(s), and return a list of Page objects in order of relevance.
 
-        :param term: A string containing the search term(s).
+        Only the matching pages are loaded, from the page catalog, so the cost of a search grows with the
+        number of results rather than with the size of the wiki.
+
+        :param term: A string containing the search term(s), optionally with "quoted phrases", AND, OR and
+                     -excluded terms.
         :type term: str
         :param ignore_case: Flag to indicate whether to ignore case sensitivity or not. Default is True.
         :type ignore_case: bool
+        :param limit: The maximum number of pages to return, or None for all matching pages.
+        :type limit: int
+        :param offset: The number of best matching pages to skip, for paging through the results.
+        :type offset: int
+        :param snippets: Set the ``snippet`` of every matching page to an excerpt with the terms highlighted.
+        :type snippets: bool
         :return: A list of page objects matching the search terms in order of relevance.
         :rtype: list[Page]
         """
         # If this isn't locally imported, then a circular import error arises
-        from wiki.web.pageDAO import PageDaoManager
-
-        dao = PageDaoManager()
-        pages = self.index()
-
-        # Tokenize the search term(s)
-        # search_terms = word_tokenize(term.lower() if ignore_case else term)
-        search_terms = word_tokenize(term)
-
-        # english_stopwords = stopwords.words("english")
-        # search_terms_wo_stopwords = [
-        #     t for t in search_terms if t not in english_stopwords
-        # ]
-
-        search_terms_wo_stopwords = Page.remove_stopwords(search_terms)
-
-        # Gather the search results from the database with the given search terms
-        search_results = dao.search(search_terms_wo_stopwords, ignore_case)
-
-        # Create a dictionary of pages indexed by their ids
-        pages_dict = {page.id: page for page in pages}
-
-        # Filter the matching pages based on the order of the search_results keys (doc_ids)
-        matching_pages = [
-            pages_dict[doc_id] for doc_id in search_results if doc_id in pages_dict
-        ]
+        from wiki.web.catalogDAO import CatalogDaoManager
+        from wiki.web.pageDAO import get_search_dao
+        from wiki.web.query import Phrase, parse_query
+
+        dao = get_search_dao()
+        catalog = CatalogDaoManager()
+        query = parse_query(term)
+
+        if query.is_simple:
+            # Split the search term(s) the way the configured search backend indexed the pages
+            search_terms = highlighted = dao.split_query(term)
+        else:
+            # Phrases, AND, OR and excluded terms, see wiki.web.query
+            search_terms = dao.split_query(" ".join(item.text for item in query.terms))
+            highlighted = [
+                '"{}"'.format(item.text) if isinstance(item, Phrase) else item.text for item in query.terms
+            ]
+
+        while True:
+            # Gather the search results from the database with the given search terms
+            if query.is_simple:
+                search_results = dao.search(search_terms, ignore_case, limit=limit, offset=offset)
+            else:
+                search_results = dao.search_query(query, ignore_case, limit=limit, offset=offset)
+            if not search_results:
+                return []
+
+            # Look up the url and metadata of the matching pages by their ids (doc_ids)
+            entries = catalog.get_entries_by_id(search_results)
+            missing = [doc_id for doc_id in search_results if doc_id not in entries]
+            if missing:
+                # Pages that were indexed but not catalogued yet, walking the wiki catalogues them
+                self.index()
+                entries.update(catalog.get_entries_by_id(missing))
+
+            # Pages deleted outside of the web editor, either never catalogued or with a catalog row
+            # whose file is gone
+            deleted_paths = [
+                entries[doc_id]["path"]
+                for doc_id in search_results
+                if doc_id in entries and not os.path.exists(entries[doc_id]["path"])
+            ]
+            stale = [
+                doc_id for doc_id in search_results
+                if doc_id not in entries or entries[doc_id]["path"] in deleted_paths
+            ]
+            if not stale:
+                break
+            # Dropping them from the search index and the catalog means the next search does not
+            # walk the wiki again; searching again fills up this page
+            dao.delete_doc_ids(stale)
+            catalog.update([], removed_paths=deleted_paths)
+
+        # Keep the order of the search_results keys
+        matching_pages = [self.catalog_page(entries[doc_id]) for doc_id in search_results]
+
+        if snippets:
+            # Excerpts are cut around the offsets stored at index time, nothing is rendered
+            positions = dao.get_term_positions(
+                [page.id for page in matching_pages], search_terms, ignore_case
+            )
+            for page in matching_pages:
+                try:
+                    page.snippet = page.read_snippet(positions.get(page.id), highlighted)
+                except OSError:
+                    # Deleted since the search, the page is listed without an excerpt
+                    page.snippet = None
 
         return matching_pages
 
@@ -537,5 +1148,8 @@ class Wiki(object):
         )
 
     def save_image(self, image):
+        # only plain file names, so the image cannot end up outside PIC_BASE
+        if secure_filename(image.filename) != image.filename:
+            raise ValueError("Unsafe image file name: %r" % image.filename)
         path = os.path.join(config.PIC_BASE, image.filename)
         image.save(path)
@@ -0,0 +1,202 @@
+"""
+    NLP resources
+    ~~~~~~~~~~~~~
+
+Lazy access to the NLTK tokenizer and stopword corpus. Nothing is
+imported or loaded until a page is tokenized for the first time, and
+the data is only read from local directories: the ones NLTK searches
+by default, the ``NLTK_DATA`` environment variable and the
+``NLTK_DATA`` setting. A missing resource raises
+:class:`NLPResourceError` right away instead of going to the network,
+unless ``NLTK_DOWNLOAD`` is enabled.
+
+With ``TOKENIZER = "regex"`` pages and queries are split by a regular
+expression instead of NLTK's ``word_tokenize``, which is much faster
+and needs no tokenizer data. Changing the tokenizer requires a full
+``flask reindex``, since queries must be split like the indexed pages.
+
+The Docker image preinstalls the data, for other setups run::
+
+    python -m nltk.downloader -d /usr/local/share/nltk_data stopwords punkt punkt_tab
+"""
+import os
+import re
+import threading
+
+import config
+
+# NLTK packages that provide each resource; newer NLTK versions tokenize with punkt_tab
+RESOURCE_PACKAGES = {
+    "stopwords": ("stopwords",),
+    "tokenizer": ("punkt_tab", "punkt"),
+}
+
+# Words, including inner apostrophes and hyphens as in "don't" or "real-time"
+TOKEN_REGEX = re.compile(r"\w+(?:['\u2019-]\w+)*")
+WORD_REGEX = re.compile(r"\w")
+
+_lock = threading.Lock()
+_configured = False
+_stopword_sets = {}
+
+
+class NLPResourceError(LookupError):
+    pass
+
+
+def configure():
+    """
+    Adds the directories of the ``NLTK_DATA`` setting to the NLTK search path.
+    Only has an effect the first time it is called.
+    """
+    global _configured
+    with _lock:
+        if _configured:
+            return
+        import nltk
+
+        data_dirs = getattr(config, "NLTK_DATA", None)
+        if data_dirs:
+            for data_dir in reversed(data_dirs.split(os.pathsep)):
+                if data_dir not in nltk.data.path:
+                    nltk.data.path.insert(0, data_dir)
+        _configured = True
+
+
+def download_enabled():
+    return str(getattr(config, "NLTK_DOWNLOAD", "")).lower() in ("1", "true", "yes")
+
+
+def _load(resource, load):
+    """
+    Calls ``load`` and turns a missing NLTK resource into a :class:`NLPResourceError`,
+    or downloads it once when ``NLTK_DOWNLOAD`` is enabled.
+    """
+    configure()
+    try:
+        return load()
+    except LookupError as e:
+        packages = RESOURCE_PACKAGES[resource]
+        if not download_enabled():
+            raise NLPResourceError(
+                "The NLTK {} data is not installed. Install it with "
+                "'python -m nltk.downloader {}', point NLTK_DATA at a directory "
+                "that contains it or set NLTK_DOWNLOAD=True.".format(
+                    resource, " ".join(packages)
+                )
+            ) from e
+
+    import nltk
+
+    for package in packages:
+        nltk.download(package, quiet=True)
+    return load()
+
+
+def stopwords(language="english"):
+    """
+    Returns the stopwords of the given language.
+
+    :param str language: the name of the stopword list
+    :return: list of stopwords
+    :raises NLPResourceError: if the stopword corpus is not installed
+    """
+
+    def load():
+        from nltk.corpus import stopwords
+
+        return stopwords.words(language)
+
+    return _load("stopwords", load)
+
+
+def stopword_set(language="english"):
+    """
+    Returns the stopwords of the given language as a frozenset. The corpus is
+    only read the first time, later calls return the same set.
+
+    :param str language: the name of the stopword list
+    :return: frozenset of stopwords
+    :raises NLPResourceError: if the stopword corpus is not installed
+    """
+    words = _stopword_sets.get(language)
+    if words is None:
+        words = _stopword_sets[language] = frozenset(stopwords(language))
+    return words
+
+
+def remove_stopwords(tokens, language="english"):
+    """
+    Removes the stopwords of the given language from a list of tokens.
+
+    :param list tokens: the tokens to filter
+    :param str language: the name of the stopword list
+    :return: list of the remaining tokens
+    """
+    words = stopword_set(language)
+    return [token for token in tokens if token not in words]
+
+
+def regex_tokenize(text):
+    """
+    Splits a text into word tokens with :data:`TOKEN_REGEX`. Punctuation is
+    dropped instead of becoming tokens of its own.
+
+    :param str text: the text to tokenize
+    :return: list of tokens
+    """
+    return TOKEN_REGEX.findall(text)
+
+
+def tokenize(text):
+    """
+    Splits a text into word tokens with the tokenizer selected by the
+    ``TOKENIZER`` setting, "nltk" (default) or "regex".
+
+    :param str text: the text to tokenize
+    :return: list of tokens
+    """
+    if getattr(config, "TOKENIZER", "nltk") == "regex":
+        return regex_tokenize(text)
+    return word_tokenize(text)
+
+
+def tokenize_spans(text):
+    """
+    Splits a text like :func:`tokenize` and returns where each token is.
+    NLTK tokens are aligned with the text in order; the ones that NLTK
+    rewrites, e.g. double quotes, are left out.
+
+    :param str text: the text to tokenize
+    :return: list of tuples of the token and its start and end offset
+    """
+    if getattr(config, "TOKENIZER", "nltk") == "regex":
+        return [(match.group(), match.start(), match.end()) for match in TOKEN_REGEX.finditer(text)]
+
+    spans = []
+    position = 0
+    for token in word_tokenize(text):
+        start = text.find(token, position)
+        # a token that is not next in the text was rewritten, only skip punctuation to find it
+        if start == -1 or WORD_REGEX.search(text, position, start):
+            continue
+        position = start + len(token)
+        spans.append((token, start, position))
+    return spans
+
+
+def word_tokenize(text):
+    """
+    Splits a text into word tokens with NLTK's ``word_tokenize``.
+
+    :param str text: the text to tokenize
+    :return: list of tokens
+    :raises NLPResourceError: if the punkt tokenizer models are not installed
+    """
+
+    def load():
+        from nltk.tokenize import word_tokenize
+
+        return word_tokenize(text)
+
+    return _load("tokenizer", load)
@@ -7,7 +7,9 @@ from flask_login import LoginManager
 from werkzeug.local import LocalProxy
 from wiki.web.db import *
 from wiki.core import Wiki
+from wiki.core import render_cache
 from wiki.web.userDAO import UserDaoManager
+from wiki.web.userDAO import user_cache
 
 class WikiError(Exception):
     pass
@@ -45,15 +47,20 @@ def create_app(directory):
         msg = "You need to place a config.py in your content directory."
         raise WikiError(msg)
 
+    render_cache.resize(app.config.get("RENDER_CACHE_SIZE", render_cache.max_size))
+    user_cache.ttl = app.config.get("USER_CACHE_TTL", user_cache.ttl)
+
     loginmanager.init_app(app)
+    init_app(app)
 
     from wiki.web.routes import bp
 
     app.register_blueprint(bp)
 
-    if not os.path.exists(app.config["DATABASE"]):
-        with app.app_context():
-            init_db()
+    # the schema only creates missing tables, so running it on every start
+    # also brings existing databases up to date
+    with app.app_context():
+        init_db()
     return app
 
 
@@ -0,0 +1,82 @@
+from wiki.web.db import *
+
+
+class CatalogDaoManager(BaseDao):
+    def get_entries(self):
+        """
+        Retrieves every row of the page_catalog table.
+
+        Returns:
+            dict[str, sqlite3.Row]: A dictionary mapping the file path of each catalogued page to its row.
+        """
+        rows = self.cur.execute(
+            "SELECT path, id, url, title, tags, mtime, size FROM page_catalog"
+        ).fetchall()
+        return {row["path"]: row for row in rows}
+
+    def get_entries_by_id(self, doc_ids, batch_size=500):
+        """
+        Retrieves the catalog rows of the given pages, e.g. to turn search results into pages without
+        walking the content directory.
+
+        Args:
+            doc_ids (iterable[str]): The ids of the pages.
+            batch_size (int): The number of ids bound per query, below SQLite's variable limit.
+
+        Returns:
+            dict[str, sqlite3.Row]: A dictionary mapping the id of each catalogued page to its row.
+        """
+        doc_ids = list(doc_ids)
+        entries = {}
+        for start in range(0, len(doc_ids), batch_size):
+            batch = doc_ids[start:start + batch_size]
+            rows = self.cur.execute(
+                "SELECT path, id, url, title, tags, mtime, size FROM page_catalog WHERE id IN ({})".format(
+                    ", ".join("?" for _ in batch)
+                ),
+                batch,
+            ).fetchall()
+            entries.update((row["id"], row) for row in rows)
+        return entries
+
+    def get_version(self):
+        """
+        Retrieves a counter that grows whenever rows are added, replaced or removed, e.g. to tell whether an
+        in-memory copy of the catalog is still current.
+
+        Returns:
+            int: The version of the page_catalog table, 0 if it was never changed.
+        """
+        return self._get_version("page_catalog")
+
+    def update(self, entries, removed_paths=()):
+        """
+        Adds or replaces the given catalog entries and removes the rows of deleted files in a single transaction.
+
+        Args:
+            entries (list[dict]): Catalog entries with the keys path, id, url, title, tags, mtime and size.
+            removed_paths (iterable[str]): File paths of pages that no longer exist.
+
+        Returns:
+            tuple[int, int]: The version of the catalog before and after the update, read in the same
+            transaction, so that a difference of more than one means someone else changed it in between.
+        """
+        removed_paths = list(removed_paths)
+        if not entries and not removed_paths:
+            version = self.get_version()
+            return version, version
+
+        with self.connection:
+            version = self._bump_version("page_catalog")
+            self.cur.executemany(
+                """
+                INSERT OR REPLACE INTO page_catalog (path, id, url, title, tags, mtime, size)
+                VALUES (:path, :id, :url, :title, :tags, :mtime, :size)
+                """,
+                entries,
+            )
+            self.cur.executemany(
+                "DELETE FROM page_catalog WHERE path = ?",
+                [(path,) for path in removed_paths],
+            )
+        return version - 1, version
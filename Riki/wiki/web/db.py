@@ -1,39 +1,286 @@
+import os
 import sqlite3
+import threading
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
 
+# Defaults for the settings of pooled connections, see configure_connection
+POOL_SIZE = 8
+CACHED_STATEMENTS = 256
+CACHE_SIZE = -16000  # negative values are KiB, i.e. 16 MiB of page cache
+MMAP_SIZE = 256 * 1024 * 1024
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool(object):
+    """
+    Keeps idle connections to one database so that requests reuse them
+    instead of opening a new connection each time.
+
+    Connections are only ever used by one borrower at a time, but may be
+    handed to a different thread on the next request. Every connection is
+    configured once when it is opened, and its statement cache survives
+    between requests.
+    """
+
+    def __init__(self, database, size=POOL_SIZE, cached_statements=CACHED_STATEMENTS,
+                 cache_size=CACHE_SIZE, mmap_size=MMAP_SIZE):
+        self.database = database
+        self.size = size
+        self.cached_statements = cached_statements
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def connect(self):
+        connection = sqlite3.connect(
+            self.database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+        connection.row_factory = sqlite3.Row
+        self.configure_connection(connection)
+        return connection
+
+    def configure_connection(self, connection):
+        # WAL lets readers go on while a page save writes, and with WAL
+        # synchronous=NORMAL is still safe against corruption
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA cache_size={:d}".format(self.cache_size))
+        connection.execute("PRAGMA mmap_size={:d}".format(self.mmap_size))
+
+    def acquire(self):
+        """
+        Returns an idle connection, or a new one if there is none.
+        """
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.connect()
+
+    def release(self, connection):
+        """
+        Gives a connection back. A transaction left open by the borrower is
+        rolled back, and connections beyond the pool size are closed.
+        """
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.ProgrammingError:
+            return  # the borrower closed the connection itself
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Closes all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def get_pool(app=None):
+    """
+    Returns the connection pool for the database of the given (or current)
+    app. Pools are per process, so forked processes never reuse the
+    connections of their parent.
+    """
+    config = (app or current_app).config
+    key = (os.getpid(), config["DATABASE"])
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(
+                config["DATABASE"],
+                size=config.get("DB_POOL_SIZE", POOL_SIZE),
+                cached_statements=config.get("DB_CACHED_STATEMENTS", CACHED_STATEMENTS),
+                cache_size=config.get("DB_CACHE_SIZE", CACHE_SIZE),
+                mmap_size=config.get("DB_MMAP_SIZE", MMAP_SIZE),
+            )
+    return pool
+
 
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(
-            current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        # remember the pool, the DATABASE setting may change before teardown
+        pool = g.db_pool = get_pool()
+        g.db = pool.acquire()
     return g.db
 
 
 def close_db(e=None):
     db = g.pop("db", None)
+    pool = g.pop("db_pool", None)
     if db is not None:
-        db.close()
+        pool.release(db)
+
+
+class BaseDao(object):
+    """
+    Base of the data access objects.
+
+    A DAO uses the connection of the current app context, which all DAOs of
+    that context share. DAOs never close it themselves, the app context
+    teardown (see :func:`init_app`) hands it back to the pool, so a request
+    holds at most one connection and always gives it back.
+    """
+
+    def __init__(self):
+        self.connection = get_db()
+        self.cur = self.connection.cursor()
+
+    def close_db(self):
+        """
+        Closes the cursor of this DAO. The shared connection stays open for
+        the other DAOs of the app context until the teardown releases it.
+        """
+        self.cur.close()
+
+    def _get_version(self, name):
+        row = self.cur.execute(
+            "SELECT version FROM table_versions WHERE name = ?", (name,)
+        ).fetchone()
+        return row["version"] if row is not None else 0
+
+    def _bump_version(self, name):
+        """
+        Increments the version of the given table and returns the new one.
+        Call it inside the transaction that changes the table, the write
+        lock it takes keeps other writers out until the commit.
+        """
+        self.cur.execute(
+            """
+            INSERT INTO table_versions (name, version) VALUES (?, 1)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1
+            """,
+            (name,),
+        )
+        return self._get_version(name)
 
 
 def init_db():
     #print(" * Starting database...")
     db = get_db()
+    migrate_db(db)
     with open("wiki/web/schema.sql") as f:
         db.executescript(f.read())
+    if current_app.config.get("SEARCH_BACKEND") == "fts5":
+        with open("wiki/web/schema_fts5.sql") as f:
+            db.executescript(f.read())
+
+
+def migrate_db(db):
+    """
+    Brings the tables of a database created by an older version up to date, so that
+    the statements in schema.sql (e.g. indexes on new columns) can be applied to it.
+    Does nothing for new or already migrated databases.
+    """
+    from wiki.web.pageDAO import normalize_term
+
+    columns = [row[1] for row in db.execute("PRAGMA table_info(page_index)")]
+    if columns and "term" not in columns:
+        # store the case-folded form of every token so that case-insensitive
+        # searches can use an index instead of scanning LOWER(word)
+        db.create_function("normalize_term", 1, normalize_term)
+        with db:
+            db.execute("ALTER TABLE page_index ADD COLUMN term TEXT NOT NULL DEFAULT ''")
+            db.execute("UPDATE page_index SET term = normalize_term(word)")
+
+    columns = [row[1] for row in db.execute("PRAGMA table_info(term_stats)")]
+    if columns and "version" not in columns:
+        # the term dictionaries of other processes re-read the rows stamped
+        # with a newer version than the one they last saw, see wiki.web.terms
+        with db:
+            db.execute("ALTER TABLE term_stats ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    tables = [row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    if "page_index_state" in tables and "page_positions" not in tables:
+        # phrase searches need the token positions, which older versions did not
+        # store; forgetting the index states makes `flask reindex --incremental`
+        # index every page again instead of skipping the unchanged ones
+        with db:
+            db.execute("DELETE FROM page_index_state")
 
 
 @click.command("init-db")
 @with_appcontext
 def init_db_command():
-    """Clear the existing data and create new tables."""
+    """Create missing tables and migrate existing ones."""
     init_db()
     click.echo("Initialized the database.")
 
 
+@click.command("reindex")
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Skip pages that did not change since they were last indexed.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="Number of tokenizer processes, defaults to the number of CPUs.",
+)
+@click.option(
+    "--batch-size", type=int, default=200, help="Number of pages per transaction."
+)
+@with_appcontext
+def reindex_command(incremental, workers, batch_size):
+    """Rebuild the search index of the configured backend from the content directory."""
+    from wiki.web import current_wiki
+    from wiki.web.indexer import reindex
+
+    reindex(current_wiki, incremental, workers, batch_size)
+
+
+@click.command("migrate-search")
+@click.option(
+    "--drop-page-index",
+    is_flag=True,
+    help="Delete the tokens of the page_index backend afterwards.",
+)
+@with_appcontext
+def migrate_search_command(drop_page_index):
+    """Build the FTS5 search index from the content directory."""
+    from wiki.web import current_wiki
+    from wiki.web.indexer import rebuild_fts
+    from wiki.web.pageDAO import PageDaoManager
+
+    db = get_db()
+    with open("wiki/web/schema_fts5.sql") as f:
+        db.executescript(f.read())
+
+    # the stored tokens cannot be turned back into text, so every page is read again
+    rebuild_fts(current_wiki)
+
+    if drop_page_index:
+        PageDaoManager().clear()
+        db.execute("VACUUM")
+        click.echo("Removed the page_index tokens.")
+    if current_app.config.get("SEARCH_BACKEND") != "fts5":
+        click.echo("Set SEARCH_BACKEND=fts5 to search the new index.")
+
+
+def init_commands(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(reindex_command)
+    app.cli.add_command(migrate_search_command)
+
+
 def init_app(app):
+    # hands the connection of each app context back to the pool
     app.teardown_appcontext(close_db)
-    app.cli.add_command(init_db_command)
+    init_commands(app)
+
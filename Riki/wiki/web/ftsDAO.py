@@ -0,0 +1,250 @@
+import re
+
+from wiki.web.db import *
+from wiki.web.query import Phrase
+
+# A quoted phrase or a single term, optionally followed by * for a prefix query
+QUERY_TERM_REGEX = re.compile(r'"([^"]*)"|(\S+)')
+
+
+class FtsDaoManager(BaseDao):
+    """
+    Search backend that keeps the plain text of every page in an SQLite FTS5 index.
+
+    It provides the same calls as :class:`wiki.web.pageDAO.PageDaoManager`, but tokenizing, case folding and
+    ranking are all done by SQLite, so no NLTK data is needed. Matching is always case-insensitive.
+    """
+
+    def update_page_index(self, page):
+        """
+        Adds or replaces the text of the given page in the full-text index.
+
+        Args:
+            page (Page): The page object.
+
+        Returns:
+            None
+        """
+        self.store_pages([page])
+
+    def store_pages(self, pages):
+        """
+        Adds or replaces the text of many pages in a single transaction.
+
+        Args:
+            pages (iterable[Page]): The page objects to index.
+
+        Returns:
+            None
+        """
+        with self.connection:
+            self.cur.executemany(
+                """
+                INSERT INTO page_text (doc_id, title, body) VALUES (?, ?, ?)
+                ON CONFLICT (doc_id) DO UPDATE SET title = excluded.title, body = excluded.body
+                """,
+                [(page.id, page.title, page.get_page_text()) for page in pages],
+            )
+
+    def rebuild(self, pages):
+        """
+        Replaces the whole full-text index with the text of the given pages.
+
+        Args:
+            pages (iterable[Page]): Every page of the wiki.
+
+        Returns:
+            int: The number of indexed pages.
+        """
+        rows = [(page.id, page.title, page.get_page_text()) for page in pages]
+        with self.connection:
+            self.cur.execute("DELETE FROM page_text")
+            self.cur.executemany(
+                "INSERT INTO page_text (doc_id, title, body) VALUES (?, ?, ?)", rows
+            )
+            self.cur.execute("INSERT INTO page_fts (page_fts) VALUES ('optimize')")
+        return len(rows)
+
+    def update_page_index_id(self, new_id, old_id):
+        """
+        Moves the indexed text of a page to its new id.
+
+        Args:
+            new_id (str): The ID of the new page that will replace the old page's ID.
+            old_id (str): The ID of the old page that will be replaced by the new page's ID.
+
+        Returns:
+            None
+        """
+        with self.connection:
+            self.cur.execute("DELETE FROM page_text WHERE doc_id = ?", (new_id,))
+            self.cur.execute(
+                "UPDATE page_text SET doc_id = ? WHERE doc_id = ?", (new_id, old_id)
+            )
+
+    def delete(self, page):
+        """
+        Removes the given page from the full-text index.
+
+        Args:
+            page (Page): The page object.
+
+        Returns:
+            None
+        """
+        self.delete_doc_ids([page.id])
+
+    def delete_doc_ids(self, doc_ids):
+        """
+        Removes all given pages from the full-text index in a single transaction.
+
+        Args:
+            doc_ids (iterable[str]): The ids of the pages to remove.
+
+        Returns:
+            None
+        """
+        with self.connection:
+            self.cur.executemany(
+                "DELETE FROM page_text WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids]
+            )
+
+    def get_doc_ids(self):
+        """
+        Retrieves the ids of all indexed pages.
+
+        Returns:
+            set[str]: The page ids.
+        """
+        return {row[0] for row in self.cur.execute("SELECT doc_id FROM page_text")}
+
+    def get_term_positions(self, doc_ids, search_terms, ignore_case=True):
+        """
+        The FTS5 index keeps no offsets into the page files, so search result excerpts of this backend start
+        at the top of the page body.
+
+        Returns:
+            dict[str, int]: Always empty.
+        """
+        return {}
+
+    def complete_terms(self, prefix, limit=10):
+        """
+        The terms of the FTS5 index are not kept in the term dictionary, so this backend only completes titles
+        (see :mod:`wiki.web.completions`).
+
+        Returns:
+            list[str]: Always empty.
+        """
+        return []
+
+    @staticmethod
+    def split_query(text):
+        """
+        Splits a search query into terms. Quoted phrases are kept together and a trailing * turns a term
+        into a prefix query.
+
+        Args:
+            text (str): The search query as entered by the user.
+
+        Returns:
+            list[str]: The search terms, phrases still enclosed in double quotes.
+        """
+        terms = []
+        for phrase, term in QUERY_TERM_REGEX.findall(text):
+            term = '"{}"'.format(phrase) if phrase else term
+            if re.search(r"\w", term):
+                terms.append(term)
+        return terms
+
+    @staticmethod
+    def match_expression(search_terms):
+        """
+        Builds an FTS5 query that matches pages containing any of the given terms. Every term is quoted, so
+        characters with a meaning in the FTS5 query syntax are searched for literally.
+
+        Args:
+            search_terms (list[str]): Terms as returned by :meth:`split_query`.
+
+        Returns:
+            str: The FTS5 MATCH expression.
+        """
+        expressions = []
+        for term in search_terms:
+            prefix = term.endswith("*")
+            term = term.rstrip("*")
+            if len(term) > 1 and term.startswith('"') and term.endswith('"'):
+                term = term[1:-1]
+            expression = '"{}"'.format(term.replace('"', '""'))
+            expressions.append(expression + " *" if prefix else expression)
+        return " OR ".join(expressions)
+
+    def search(self, search_terms, ignore_case=True, limit=None, offset=0):
+        """
+        Searches for pages containing any of the provided terms, phrases or prefixes, ranked with the bm25()
+        function of FTS5 (configured in schema_fts5.sql). Matches in the title weigh more than matches in the
+        body.
+
+        Args:
+            search_terms (list[str]): A list of search terms, see :meth:`split_query`.
+            ignore_case (bool): Ignored, the FTS5 index is always case-insensitive.
+            limit (int): The maximum number of results, or None for all matching pages.
+            offset (int): The number of best matches to skip, for paging through the results.
+
+        Returns:
+            dict[string, float]: A dictionary containing doc_id as the key and the score as the value for the
+            matching pages, ordered from best to worst.
+        """
+        search_terms = [term for term in search_terms if re.search(r"\w", term)]
+        if not search_terms:
+            return {}
+        return self._match(self.match_expression(search_terms), limit, offset)
+
+    def search_query(self, query, ignore_case=True, limit=None, offset=0):
+        """
+        Searches for pages matching a parsed query with phrases, AND, OR and excluded terms (see
+        :mod:`wiki.web.query`). The query is translated into the FTS5 query syntax, which evaluates it on the
+        positional FTS5 index, and ranked like :meth:`search`.
+
+        Args:
+            query (Query): The parsed query.
+            ignore_case (bool): Ignored, the FTS5 index is always case-insensitive.
+            limit (int): The maximum number of results, or None for all matching pages.
+            offset (int): The number of best matches to skip, for paging through the results.
+
+        Returns:
+            dict[string, float]: A dictionary containing doc_id as the key and the score as the value for the
+            matching pages, ordered from best to worst.
+        """
+        groups = [self._query_expressions(group, " AND ") for group in query.groups]
+        groups = [group for group in groups if group]
+        if not groups:
+            return {}
+        expression = " OR ".join(groups)
+        excluded = self._query_expressions(query.excluded, " OR ")
+        if excluded:
+            expression = "({}) NOT {}".format(expression, excluded)
+        return self._match(expression, limit, offset)
+
+    def _query_expressions(self, items, operator):
+        terms = ['"{}"'.format(item.text) if isinstance(item, Phrase) else item.text for item in items]
+        terms = [term for term in terms if re.search(r"\w", term)]
+        if not terms:
+            return ""
+        return "({})".format(operator.join(self.match_expression([term]) for term in terms))
+
+    def _match(self, expression, limit, offset):
+        # The rank is lower for better matches, so negate it to get a score. Ordering by rank inside
+        # the subquery lets FTS5 stop after the best ``limit`` rows.
+        results = self.cur.execute(
+            """
+            SELECT page_text.doc_id, -matches.rank AS score
+            FROM (
+                SELECT rowid, rank FROM page_fts WHERE page_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?
+            ) AS matches
+            JOIN page_text ON page_text.id = matches.rowid
+            ORDER BY matches.rank
+            """,
+            (expression, -1 if limit is None else limit, offset),
+        ).fetchall()
+        return {row[0]: row[1] for row in results}
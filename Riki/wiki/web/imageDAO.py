@@ -2,11 +2,7 @@ import sqlite3
 from wiki.web.db import *
 
 
-class ImageDAO(object):
-    def __init__(self):
-        self.connection = get_db()
-        self.cur = self.connection.cursor()
-
+class ImageDAO(BaseDao):
     def save_image(self, filename, email):
         """
         this method adds an image associated with an email to the database
@@ -17,15 +13,22 @@ class ImageDAO(object):
         )
         self.connection.commit()
 
+    def delete_image(self, filename):
+        """
+        Removes an image from the database.
+
+        Args:
+            filename (str): The image file name.
+        """
+        self.cur.execute("DELETE FROM images WHERE filename = ?", (filename,))
+        self.connection.commit()
+
     def get_user_images(self, email):
         self.cur.execute(
             "SELECT * FROM images WHERE email = (?)", ((email,))
         )
         return self.cur.fetchall()
     
-    def close_db(self):
-        self.connection.close() 
-
     def filename_exists(self, filename):
         self.cur.execute(
             "SELECT 1 FROM images WHERE filename = (?)", ((filename,))
@@ -38,3 +41,28 @@ class ImageDAO(object):
             (filename,)
         )
         return self.cur.fetchone()
+
+    def get_image_owners(self, filenames, batch_size=500):
+        """
+        Looks up the owners of many images at once, with one query per
+        batch instead of one per image.
+
+        Args:
+            filenames (iterable): The image file names.
+            batch_size (int): The number of file names bound per query, below SQLite's variable limit.
+
+        Returns:
+            dict: The email of the owner by file name, images without an owner are left out.
+        """
+        filenames = list(filenames)
+        owners = {}
+        for start in range(0, len(filenames), batch_size):
+            batch = filenames[start:start + batch_size]
+            self.cur.execute(
+                "SELECT filename, email FROM images WHERE filename IN ({})".format(
+                    ", ".join("?" * len(batch))
+                ),
+                batch,
+            )
+            owners.update(self.cur.fetchall())
+        return owners
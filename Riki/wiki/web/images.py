@@ -0,0 +1,269 @@
+"""
+    Images
+    ~~~~~~
+
+Re-encoded copies ("derivatives") of the uploaded images in a few fixed
+widths, see :data:`SIZES`. Every derivative is encoded once and kept on
+disk in a hidden directory under ``PIC_BASE``, one folder per image. Its
+file name contains the mtime of the source and the encode parameters, so
+replacing an image or changing the parameters never serves a stale copy.
+
+Derivatives are encoded by a small pool of worker threads, which bounds
+how many images are decoded at the same time. Uploads queue all sizes
+right away; a request for a size that is not ready yet waits for it.
+
+Uploads are copied into ``PIC_BASE`` in chunks and renamed into place
+once complete. Decoding them to check that they really are images is
+left to the same worker pool, so it never holds up the request.
+"""
+import heapq
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from PIL import Image
+from werkzeug.utils import secure_filename
+
+# Hidden, so it is easy to tell apart from the uploaded images
+DERIVATIVE_DIR = ".derivatives"
+
+# Encode parameters of the served copies
+QUALITY = 70
+
+# Bytes copied at a time when an upload is saved
+CHUNK_SIZE = 64 * 1024
+
+# Maximum width of each size in pixels, None keeps the original width
+SIZES = {
+    "thumbnail": 160,
+    "medium": 640,
+    "full": None,
+}
+
+_lock = threading.Lock()
+_executor = None
+# Futures of the derivatives that are being encoded, by path
+_pending = {}
+
+
+def image_format(filename):
+    """
+    Returns the PIL format name for the extension of the given file name.
+
+    :param str filename: the image file name
+    :returns: e.g. "JPEG" or "PNG"
+    :rtype: str
+    """
+    image_type = filename.rsplit(".", 1)[1].upper()
+    return "JPEG" if image_type == "JPG" else image_type
+
+
+def is_image_file(filename):
+    """
+    Whether the given entry of ``PIC_BASE`` is an uploaded image, as
+    opposed to e.g. the derivative directory.
+
+    :param str filename: the name of the directory entry
+    :rtype: bool
+    """
+    return not filename.startswith(".") and os.path.isfile(
+        os.path.join(config.PIC_BASE, filename)
+    )
+
+
+def list_images(after=None, limit=50):
+    """
+    Lists the uploaded images in file name order, one page at a time.
+
+    :param str after: the last file name of the previous page, None for the first page
+    :param int limit: the maximum number of file names
+    :returns: the file names and whether more images follow
+    :rtype: tuple
+    """
+    with os.scandir(config.PIC_BASE) as entries:
+        names = heapq.nsmallest(
+            limit + 1,
+            (
+                entry.name
+                for entry in entries
+                if not entry.name.startswith(".")
+                and (after is None or entry.name > after)
+                and entry.is_file()
+            ),
+        )
+    return names[:limit], len(names) > limit
+
+
+def save_upload(stream, filename):
+    """
+    Copies an uploaded file into ``PIC_BASE`` in chunks. The data goes to a
+    hidden temporary file first, which is renamed once it is complete, so
+    the gallery never lists a half written image.
+
+    :param stream: a file-like object with the uploaded data
+    :param str filename: the image file name, see :func:`werkzeug.utils.secure_filename`
+    :returns: the path of the saved image
+    :rtype: str
+    :raises ValueError: if the file name is not a plain file name
+    """
+    if secure_filename(filename) != filename:
+        raise ValueError("Unsafe image file name: %r" % filename)
+    path = os.path.join(config.PIC_BASE, filename)
+    fd, tmp_path = tempfile.mkstemp(dir=config.PIC_BASE, prefix=".tmp")
+    try:
+        # mkstemp creates the file readable by its owner only
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(stream, f, CHUNK_SIZE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def verify(filename):
+    """
+    Whether an uploaded file can be decoded as an image. Decompression
+    bombs count as invalid.
+
+    :param str filename: the image file name
+    :rtype: bool
+    """
+    try:
+        with Image.open(os.path.join(config.PIC_BASE, filename)) as img:
+            img.load()
+    except Exception:
+        return False
+    return True
+
+
+def derivative_path(filename, mtime_ns, size="full", quality=QUALITY):
+    """
+    Builds the path of a derivative.
+
+    :param str filename: the image file name
+    :param int mtime_ns: the mtime of the source image in nanoseconds
+    :param str size: one of :data:`SIZES`
+    :param int quality: the encoder quality
+    :returns: the path of the derivative
+    :rtype: str
+    """
+    name = "{}.{}.q{}.{}".format(mtime_ns, size, quality, filename.rsplit(".", 1)[1])
+    return os.path.join(config.PIC_BASE, DERIVATIVE_DIR, filename, name)
+
+
+def get_executor():
+    """
+    Returns the worker pool, started on first use with ``IMAGE_WORKERS``
+    threads.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(config, "IMAGE_WORKERS", 2),
+                thread_name_prefix="images",
+            )
+        return _executor
+
+
+def submit(source, path, size, quality=QUALITY):
+    """
+    Queues the encoding of a derivative, unless it is already queued.
+
+    :returns: the future of the encoding
+    :rtype: concurrent.futures.Future
+    """
+    executor = get_executor()
+    with _lock:
+        future = _pending.get(path)
+        if future is None:
+            future = _pending[path] = executor.submit(
+                encode, source, path, SIZES[size], quality
+            )
+            future.add_done_callback(lambda _: _done(path))
+        return future
+
+
+def _done(path):
+    with _lock:
+        _pending.pop(path, None)
+
+
+def schedule(filename, quality=QUALITY):
+    """
+    Queues the encoding of every size of an image without waiting for it,
+    e.g. right after an upload.
+
+    :param str filename: the image file name
+    :param int quality: the encoder quality
+    :returns: the futures of the derivatives that did not exist yet
+    :rtype: list
+    """
+    if not is_image_file(filename):
+        return []
+    source = os.path.join(config.PIC_BASE, filename)
+    mtime_ns = os.stat(source).st_mtime_ns
+
+    futures = []
+    for size in SIZES:
+        path = derivative_path(filename, mtime_ns, size, quality)
+        if not os.path.exists(path):
+            futures.append(submit(source, path, size, quality))
+    return futures
+
+
+def get_derivative(filename, size="full", quality=QUALITY):
+    """
+    Returns the path of the re-encoded copy of an uploaded image in the
+    given size and waits for it to be encoded if it does not exist yet.
+
+    :param str filename: the image file name
+    :param str size: one of :data:`SIZES`
+    :param int quality: the encoder quality
+    :returns: the path of the derivative, or None if there is no such image
+    :rtype: str
+    """
+    source = os.path.join(config.PIC_BASE, filename)
+    if not is_image_file(filename):
+        return None
+
+    path = derivative_path(filename, os.stat(source).st_mtime_ns, size, quality)
+    if not os.path.exists(path):
+        submit(source, path, size, quality).result()
+    return path
+
+
+def encode(source, path, width, quality):
+    """
+    Encodes the source image, scaled down to at most ``width`` pixels,
+    into a temporary file next to ``path`` and renames it into place, so
+    no request ever reads a half written file. Derivatives of older
+    versions of the source are removed.
+    """
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, Image.open(source) as img:
+            output_format = image_format(source)
+            if width is not None and img.width > width:
+                height = max(1, round(img.height * width / img.width))
+                img = img.resize((width, height), Image.LANCZOS)
+            if output_format == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.save(f, output_format, quality=quality)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    version = os.path.basename(path).split(".", 1)[0] + "."
+    for name in os.listdir(folder):
+        if not name.startswith((version, ".tmp")):
+            os.unlink(os.path.join(folder, name))
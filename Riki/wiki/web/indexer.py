@@ -0,0 +1,191 @@
+"""
+    Indexer
+    ~~~~~~~
+
+Rebuilds the search index from the pages in the content directory.
+Pages are tokenized in a pool of worker processes while the calling
+process is the only one writing to the database. The FTS5 backend
+(``SEARCH_BACKEND = "fts5"``) tokenizes in SQLite, so its index is
+rebuilt from the page text in the calling process.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import current_app
+from flask import Flask
+
+from wiki.core import Page
+from wiki.web.ftsDAO import FtsDaoManager
+from wiki.web.pageDAO import PageDaoManager
+
+
+def init_worker():
+    """
+    Gives a worker process a request context, since rendering wikilinks
+    goes through :func:`flask.url_for`.
+    """
+    from wiki.web.routes import bp
+
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    app.test_request_context().push()
+
+
+def tokenize_page(item):
+    """
+    Tokenizes a single page file.
+
+    Args:
+        item (tuple): The page id, file path, url, mtime and size.
+
+    Returns:
+        tuple: The page id, mtime, size, either the token frequencies or an error message, the term offsets
+               and the token positions.
+    """
+    doc_id, path, url, mtime, size = item
+    try:
+        page = Page(path, url)
+        positions = page.token_positions()
+        tokens = {token: len(token_positions) for token, token_positions in positions.items()}
+        return doc_id, mtime, size, tokens, page.term_offsets(tokens), positions
+    except Exception as e:
+        return doc_id, mtime, size, "{}: {}".format(path, e), None, None
+
+
+def reindex(wiki, incremental=False, workers=None, batch_size=200):
+    """
+    Rebuilds the search index of the given wiki.
+
+    Args:
+        wiki (Wiki): The wiki whose content directory should be indexed.
+        incremental (bool): Skip pages whose mtime and size did not change since they were last indexed.
+        workers (int): The number of tokenizer processes, defaults to the number of CPUs. With 0 pages
+                       are tokenized in the current process.
+        batch_size (int): The number of pages written per transaction.
+
+    Returns:
+        dict: The number of indexed, skipped, failed and removed pages.
+
+    Raises:
+        click.UsageError: For an incremental reindex with the FTS5 backend, which has no index states.
+    """
+    if current_app.config.get("SEARCH_BACKEND", "page_index") == "fts5":
+        if incremental:
+            raise click.UsageError(
+                "--incremental is only supported by the page_index search backend."
+            )
+        return rebuild_fts(wiki)
+
+    dao = PageDaoManager()
+    states = dao.get_index_states() if incremental else {}
+    stale_ids = dao.get_doc_ids()
+
+    queue = []
+    skipped = 0
+    for path, url in wiki.walk():
+        stat = os.stat(path)
+        doc_id = Page(path, url, new=True).id
+        stale_ids.discard(doc_id)
+        if states.get(doc_id) == (stat.st_mtime_ns, stat.st_size):
+            skipped += 1
+            continue
+        queue.append((doc_id, path, url, stat.st_mtime_ns, stat.st_size))
+
+    click.echo(
+        "Indexing {} pages, {} unchanged pages skipped.".format(len(queue), skipped)
+    )
+
+    started = time.time()
+    indexed = failed = 0
+    page_indexes, index_states = [], []
+
+    def flush():
+        dao.store_page_indexes(page_indexes, index_states)
+        del page_indexes[:], index_states[:]
+        elapsed = max(time.time() - started, 1e-6)
+        click.echo(
+            "  {}/{} pages ({:.1f} pages/s)".format(
+                indexed + failed, len(queue), (indexed + failed) / elapsed
+            )
+        )
+
+    def collect(results):
+        nonlocal indexed, failed
+        for doc_id, mtime, size, tokens, term_offsets, positions in results:
+            if isinstance(tokens, str):
+                failed += 1
+                click.echo("  Skipping {}".format(tokens), err=True)
+            else:
+                indexed += 1
+                page_indexes.append((doc_id, tokens, term_offsets, positions))
+                index_states.append((doc_id, mtime, size))
+            if len(page_indexes) >= batch_size:
+                flush()
+
+    if workers == 0:
+        with current_app.test_request_context():
+            collect(map(tokenize_page, queue))
+    elif queue:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            collect(pool.map(tokenize_page, queue, chunksize=16))
+    if page_indexes:
+        flush()
+
+    # pages that were deleted or moved outside of the web editor
+    dao.delete_doc_ids(stale_ids)
+
+    # a full rebuild also recomputes the ranking statistics from scratch,
+    # e.g. for tokens that were indexed before the statistics existed
+    if not incremental:
+        dao.rebuild_statistics()
+
+    elapsed = time.time() - started
+    click.echo(
+        "Indexed {} pages in {:.1f}s ({:.1f} pages/s), {} failed, {} removed.".format(
+            indexed, elapsed, indexed / max(elapsed, 1e-6), failed, len(stale_ids)
+        )
+    )
+    return {
+        "indexed": indexed,
+        "skipped": skipped,
+        "failed": failed,
+        "removed": len(stale_ids),
+    }
+
+
+def rebuild_fts(wiki):
+    """
+    Replaces the FTS5 full-text index with the text of every page of the given wiki.
+
+    Args:
+        wiki (Wiki): The wiki whose content directory should be indexed.
+
+    Returns:
+        dict: The number of indexed, skipped, failed and removed pages.
+    """
+    dao = FtsDaoManager()
+    stale_ids = dao.get_doc_ids()
+
+    started = time.time()
+    pages = []
+    failed = 0
+    # rendering wikilinks goes through url_for and needs a request
+    with current_app.test_request_context():
+        for path, url in wiki.walk():
+            try:
+                pages.append(Page(path, url))
+            except Exception as e:
+                failed += 1
+                click.echo("  Skipping {}: {}".format(path, e), err=True)
+        indexed = dao.rebuild(pages)
+    stale_ids.difference_update(page.id for page in pages)
+
+    elapsed = time.time() - started
+    click.echo(
+        "Indexed {} pages with FTS5 in {:.1f}s, {} failed, {} removed.".format(
+            indexed, elapsed, failed, len(stale_ids)
+        )
+    )
+    return {"indexed": indexed, "skipped": 0, "failed": failed, "removed": len(stale_ids)}
@@ -1,15 +1,158 @@
+import bisect
+import heapq
+import math
+import sys
+from array import array
+from collections import namedtuple
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import current_app
+
+from wiki import nlp
 from wiki.web.db import *
+from wiki.web.query import Term
+from wiki.web.terms import get_term_dictionary
+
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# A term or phrase of a query: the looked up terms with their weights and the
+# search terms they expand, the positions of the terms in a phrase, and the
+# sorted ids of the candidate pages
+_SearchItem = namedtuple("_SearchItem", "weights phrase doc_ids")
+
+
+def normalize_term(word):
+    """
+    Folds a token into the form that case-insensitive searches and document frequencies use.
+
+    Args:
+        word (str): The token.
+
+    Returns:
+        str: The case-folded token.
+    """
+    return word.lower()
+
+
+def encode_positions(positions):
+    """
+    Packs a sorted list of token positions into the blob stored in the page_positions table.
 
+    Args:
+        positions (list[int]): The positions.
 
-class PageDaoManager(object):
+    Returns:
+        bytes: The positions as little-endian 32 bit integers.
+    """
+    packed = array("I", positions)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def decode_positions(blob):
+    """
+    Unpacks the token positions stored by :func:`encode_positions`.
+
+    Args:
+        blob (bytes): The stored positions.
+
+    Returns:
+        array: The positions.
+    """
+    positions = array("I")
+    positions.frombytes(blob)
+    if sys.byteorder == "big":
+        positions.byteswap()
+    return positions
+
+
+def intersect(first, second):
+    """
+    Intersects two sorted lists of page ids. Every id of the shorter list is looked up in the longer one by
+    bisection, starting where the previous lookup ended, so a rare term is cheap to AND with a common one.
+
+    Args:
+        first (list[str]): Sorted page ids.
+        second (list[str]): Sorted page ids.
+
+    Returns:
+        list[str]: The sorted page ids in both lists.
+    """
+    if len(first) > len(second):
+        first, second = second, first
+    result = []
+    index = 0
+    for doc_id in first:
+        index = bisect.bisect_left(second, doc_id, index)
+        if index == len(second):
+            break
+        if second[index] == doc_id:
+            result.append(doc_id)
+    return result
+
+
+def union(lists):
+    """
+    Merges sorted lists of page ids.
+
+    Args:
+        lists (list[list[str]]): Sorted page ids.
+
+    Returns:
+        list[str]: The sorted page ids in any of the lists, without duplicates.
+    """
+    result = []
+    for doc_id in heapq.merge(*lists):
+        if not result or result[-1] != doc_id:
+            result.append(doc_id)
+    return result
+
+
+def difference(first, second):
+    """
+    Removes the page ids of one sorted list from another.
+
+    Args:
+        first (list[str]): Sorted page ids.
+        second (list[str]): Sorted page ids to remove.
+
+    Returns:
+        list[str]: The sorted page ids that are only in the first list.
+    """
+    excluded = set(intersect(first, second))
+    return [doc_id for doc_id in first if doc_id not in excluded]
+
+
+def get_search_dao():
+    """
+    Creates the data access object of the search backend selected by the SEARCH_BACKEND setting.
+
+    Returns:
+        PageDaoManager | FtsDaoManager: The page_index backend (default) or, for "fts5", the FTS5 backend.
+    """
+    if current_app.config.get("SEARCH_BACKEND", "page_index") == "fts5":
+        from wiki.web.ftsDAO import FtsDaoManager
+
+        return FtsDaoManager()
+    return PageDaoManager()
+
+
+class PageDaoManager(BaseDao):
     def __init__(self):
-        self.connection = get_db()
-        self.cur = self.connection.cursor()
+        super(PageDaoManager, self).__init__()
+        # Expands search terms, kept up to date with the writes of this DAO
+        self.term_dictionary = get_term_dictionary(current_app.config["DATABASE"])
 
     def update_page_index(self, page):
         """
         Updates the page_index table for a given page by deleting the old tokens and adding or updating the new ones.
 
+        Only rows that actually changed are written, all within a single transaction.
+
         Args:
             page (Page): The page object.
 
@@ -17,21 +160,87 @@ class PageDaoManager(object):
             None
 
         """
-        page_index = page.tokenize_and_count()
+        positions = page.token_positions()
+        page_index = {token: len(token_positions) for token, token_positions in positions.items()}
 
-        # Delete the old tokens from the page_index table
-        self.delete_old_tokens(page, page_index)
+        self.store_page_indexes([(page.id, page_index, page.term_offsets(page_index), positions)])
 
-        # Add or update the new tokens in the page_index table
-        self.add_or_update_tokens(page, page_index)
+    def reindex_pages(self, pages):
+        """
+        Tokenizes and indexes many pages in a single transaction.
 
-        # Commit the changes to the database
-        self.connection.commit()
+        Args:
+            pages (iterable[Page]): The page objects to index.
+
+        Returns:
+            None
+
+        """
+        def page_indexes():
+            for page in pages:
+                positions = page.token_positions()
+                page_index = {token: len(token_positions) for token, token_positions in positions.items()}
+                yield page.id, page_index, page.term_offsets(page_index), positions
+
+        self.store_page_indexes(page_indexes())
+
+    def store_page_indexes(self, page_indexes, index_states=()):
+        """
+        Writes the token frequencies of one or more pages in a single transaction.
+
+        Each page index is diffed against the tokens stored for that page, so tokens that are gone are deleted,
+        new or changed tokens are written and unchanged tokens are left alone. The same goes for the term
+        offsets and token positions, if a page index comes with them.
+
+        Args:
+            page_indexes (iterable[tuple]): Pairs of a page id and a dictionary containing the page's tokens and
+                                            their frequencies, optionally followed by a dictionary with the byte
+                                            offset of each term in the page file (see ``Page.term_offsets``) and
+                                            one with the positions of each token (see ``Page.token_positions``).
+            index_states (iterable[tuple[str, int, int]]): Triples of a page id and the mtime (in nanoseconds)
+                                                          and size of the file that was indexed.
+
+        Returns:
+            None
+
+        """
+        with self._updating_terms() as version:
+            self.cur.executemany(
+                "INSERT OR REPLACE INTO page_index_state (doc_id, mtime, size) VALUES (?,?,?)",
+                list(index_states),
+            )
+
+            for doc_id, page_index, *extra in page_indexes:
+                current_index = self._get_tokens(doc_id)
+
+                # Delete the old tokens from the page_index table
+                self._delete_tokens(doc_id, set(current_index) - set(page_index))
+
+                # Add or update the new and changed tokens in the page_index table
+                self._add_or_update_tokens(
+                    doc_id,
+                    {
+                        token: frequency
+                        for token, frequency in page_index.items()
+                        if current_index.get(token) != frequency
+                    },
+                )
+
+                # Keep the document length and document frequencies used for ranking up to date
+                self._update_statistics(doc_id, current_index, page_index, version)
+
+                if len(extra) > 0:
+                    self._store_term_offsets(doc_id, extra[0])
+                if len(extra) > 1:
+                    self._store_positions(doc_id, extra[1])
 
     def delete_old_tokens(self, page, new_page_index):
         """
         Deletes tokens from the page_index table for a given page that are not included in the new page index.
 
+        The tokens are written by :meth:`store_page_indexes`, in their own transaction along with the ranking
+        statistics.
+
         Args:
             page (Page): The page object.
             page_index (dict): A dictionary containing tokens and their frequencies to be included in the new page index.
@@ -43,28 +252,18 @@ class PageDaoManager(object):
         # Get the current tokens for the page using the get_tokens method
         current_index = self.get_tokens(page)
 
-        # Find the tokens to be deleted by getting the difference between the current tokens and the new page index
-        tokens_to_delete = set(current_index.keys()) - set(new_page_index.keys())
-
-        # Check if there are any tokens to delete, if not, return
-        if not tokens_to_delete:
-            return
-
-        # Construct a SQL query to delete tokens that are in tokens_to_delete and match the given page's ID
-        self.cur.execute(
-            """
-            DELETE FROM page_index
-            WHERE doc_id = ? AND word IN ({})
-        """.format(
-                ", ".join("?" for _ in tokens_to_delete)
-            ),
-            [page.id] + list(tokens_to_delete),
+        # Keep the current tokens that are in the new page index, the others are deleted
+        self.store_page_indexes(
+            [(page.id, {token: frequency for token, frequency in current_index.items() if token in new_page_index})]
         )
 
     def add_or_update_tokens(self, page, page_index):
         """
         Adds or updates the token frequency in the page_index table for a given page.
 
+        The tokens are written by :meth:`store_page_indexes`, in their own transaction along with the ranking
+        statistics.
+
         Args:
             page (Page): The page object.
             page_index (dict): A dictionary containing tokens and their frequencies
@@ -74,15 +273,177 @@ class PageDaoManager(object):
             None
 
         """
-        # Iterate over each token and its frequency in the page index
-        for token, frequency in page_index.items():
-            # Add or update the token's frequency for the given page in the page_index table
+        # The other current tokens of the page are kept
+        current_index = self.get_tokens(page)
+        current_index.update(page_index)
+        self.store_page_indexes([(page.id, current_index)])
+
+    def _update_statistics(self, doc_id, old_index, new_index, version):
+        # Count a document once per normalized term, however many variants of it the page contains
+        old_terms = {normalize_term(token) for token in old_index}
+        new_terms = {normalize_term(token) for token in new_index}
+        added = [(version, term) for term in new_terms - old_terms]
+        removed = [(version, term) for term in old_terms - new_terms]
+
+        # The rows are stamped with the version of the transaction, so that other processes re-read them (see
+        # wiki.web.terms); terms no page contains anymore stay at 0 for the same reason
+        self.cur.executemany(
+            "INSERT OR IGNORE INTO term_stats (version, term, doc_freq) VALUES (?, ?, 0)", added
+        )
+        self.cur.executemany(
+            "UPDATE term_stats SET doc_freq = doc_freq + 1, version = ? WHERE term = ?", added
+        )
+        self.cur.executemany(
+            "UPDATE term_stats SET doc_freq = doc_freq - 1, version = ? WHERE term = ?", removed
+        )
+        for _, term in added:
+            self.term_dictionary.add(term)
+        for _, term in removed:
+            self.term_dictionary.remove(term)
+
+        if new_index or old_index:
             self.cur.execute(
-                "INSERT OR REPLACE INTO page_index (word, doc_id, frequency) VALUES (?,?,?)",
-                (token, page.id, frequency),
+                "INSERT OR REPLACE INTO page_stats (doc_id, length) VALUES (?, ?)",
+                (doc_id, sum(new_index.values())),
+            )
+
+    def rebuild_statistics(self):
+        """
+        Recomputes all document lengths and document frequencies from the page_index table.
+
+        This is only needed for tokens that were written without :meth:`store_page_indexes`, e.g. by an index
+        that was built before ranking statistics existed. It also drops the terms no page contains anymore.
+
+        Returns:
+            None
+        """
+        with self.connection:
+            version = self._bump_version("term_stats")
+            self._bump_version("term_stats_rebuild")
+            self.cur.execute("DELETE FROM page_stats")
+            self.cur.execute("DELETE FROM term_stats")
+            self.cur.execute(
+                """
+                INSERT INTO page_stats (doc_id, length)
+                SELECT doc_id, SUM(frequency) FROM page_index GROUP BY doc_id
+                """
+            )
+            self.cur.execute(
+                """
+                INSERT INTO term_stats (term, doc_freq, version)
+                SELECT term, COUNT(DISTINCT doc_id), ? FROM page_index GROUP BY term
+                """,
+                (version,),
             )
-        # Commit the changes to the database
-        self.connection.commit()
+
+    def _store_term_offsets(self, doc_id, term_offsets):
+        # Diff the offsets like the tokens, so an edit only rewrites the terms that moved
+        current_offsets = dict(
+            self.cur.execute(
+                "SELECT term, position FROM page_offsets WHERE doc_id = ?", (doc_id,)
+            ).fetchall()
+        )
+        self.cur.executemany(
+            "DELETE FROM page_offsets WHERE doc_id = ? AND term = ?",
+            [(doc_id, term) for term in set(current_offsets) - set(term_offsets)],
+        )
+        self.cur.executemany(
+            "INSERT OR REPLACE INTO page_offsets (doc_id, term, position) VALUES (?,?,?)",
+            [
+                (doc_id, term, position)
+                for term, position in term_offsets.items()
+                if current_offsets.get(term) != position
+            ],
+        )
+
+    def _store_positions(self, doc_id, positions):
+        # Phrases match case-insensitively, so the positions of all case variants of a term are merged
+        merged = {}
+        for token, token_positions in positions.items():
+            merged.setdefault(normalize_term(token), []).extend(token_positions)
+        blobs = {term: encode_positions(sorted(term_positions)) for term, term_positions in merged.items()}
+
+        current_blobs = dict(
+            self.cur.execute(
+                "SELECT term, positions FROM page_positions WHERE doc_id = ?", (doc_id,)
+            ).fetchall()
+        )
+        self.cur.executemany(
+            "DELETE FROM page_positions WHERE term = ? AND doc_id = ?",
+            [(term, doc_id) for term in set(current_blobs) - set(blobs)],
+        )
+        self.cur.executemany(
+            "INSERT OR REPLACE INTO page_positions (term, doc_id, positions) VALUES (?,?,?)",
+            [
+                (term, doc_id, blob)
+                for term, blob in blobs.items()
+                if current_blobs.get(term) != blob
+            ],
+        )
+
+    def get_term_positions(self, doc_ids, search_terms, ignore_case=True, batch_size=500):
+        """
+        Looks up where the given pages first mention any of the search terms, e.g. to show an excerpt of each
+        search result without reading the whole page.
+
+        Args:
+            doc_ids (list[str]): The ids of the pages.
+            search_terms (list[str]): The search terms, as passed to :meth:`search`.
+            ignore_case (bool): Ignored, the offsets are stored per normalized term.
+            batch_size (int): The number of ids bound per query, below SQLite's variable limit.
+
+        Returns:
+            dict[str, int]: The smallest byte offset of a search term in the page file, by page id. Pages that
+            were indexed without offsets or only mention the terms in their title are left out.
+        """
+        doc_ids = list(doc_ids)
+        terms = list({normalize_term(term) for term in search_terms})
+        positions = {}
+        if not terms:
+            return positions
+        for start in range(0, len(doc_ids), batch_size):
+            batch = doc_ids[start:start + batch_size]
+            rows = self.cur.execute(
+                """
+                SELECT doc_id, MIN(position) FROM page_offsets
+                WHERE doc_id IN ({}) AND term IN ({})
+                GROUP BY doc_id
+                """.format(", ".join("?" for _ in batch), ", ".join("?" for _ in terms)),
+                batch + terms,
+            ).fetchall()
+            positions.update(rows)
+        return positions
+
+    @contextmanager
+    def _updating_terms(self):
+        # A transaction that also changes the term dictionary, which is loaded again if it is rolled back.
+        # Yields the version of term_stats the transaction writes.
+        try:
+            with self.connection:
+                version = self._bump_version("term_stats")
+                yield version
+        except BaseException:
+            self.term_dictionary.invalidate()
+            raise
+        self.term_dictionary.applied(version)
+
+    def _delete_tokens(self, doc_id, tokens):
+        # Delete all given tokens of the page with one prepared statement
+        self.cur.executemany(
+            "DELETE FROM page_index WHERE doc_id = ? AND word = ?",
+            [(doc_id, token) for token in tokens],
+        )
+
+    def _add_or_update_tokens(self, doc_id, page_index):
+        # Add or update the frequencies of all given tokens with one prepared statement,
+        # along with the normalized term that case-insensitive searches look up
+        self.cur.executemany(
+            "INSERT OR REPLACE INTO page_index (word, term, doc_id, frequency) VALUES (?,?,?,?)",
+            [
+                (token, normalize_term(token), doc_id, frequency)
+                for token, frequency in page_index.items()
+            ],
+        )
 
     def update_page_index_id(self, new_id, old_id):
         """
@@ -100,6 +461,18 @@ class PageDaoManager(object):
         self.cur.execute(
             "UPDATE page_index SET doc_id = ? WHERE doc_id = ?", (new_id, old_id)
         )
+        self.cur.execute(
+            "UPDATE OR REPLACE page_index_state SET doc_id = ? WHERE doc_id = ?", (new_id, old_id)
+        )
+        self.cur.execute(
+            "UPDATE OR REPLACE page_stats SET doc_id = ? WHERE doc_id = ?", (new_id, old_id)
+        )
+        self.cur.execute(
+            "UPDATE OR REPLACE page_offsets SET doc_id = ? WHERE doc_id = ?", (new_id, old_id)
+        )
+        self.cur.execute(
+            "UPDATE OR REPLACE page_positions SET doc_id = ? WHERE doc_id = ?", (new_id, old_id)
+        )
 
         # Commit the changes to the database.
         self.connection.commit()
@@ -111,15 +484,44 @@ class PageDaoManager(object):
         :param page: Page object representing the page to retrieve tokens for.
         :return: Dictionary containing words as keys and their corresponding frequencies as values.
         """
+        return self._get_tokens(page.id)
+
+    def _get_tokens(self, doc_id):
         # Query the database for the updated tokens and convert to a dictionary
         tokens_dict = {
             word: frequency
             for word, frequency in self.cur.execute(
-                "SELECT word, frequency FROM page_index WHERE doc_id=?", (page.id,)
+                "SELECT word, frequency FROM page_index WHERE doc_id=?", (doc_id,)
             ).fetchall()
         }
         return tokens_dict
 
+    def get_index_states(self):
+        """
+        Retrieves the mtime and size of every page file at the time it was last indexed by a reindex run.
+
+        Returns:
+            dict[str, tuple[int, int]]: A dictionary mapping page ids to the mtime (in nanoseconds) and size.
+        """
+        return {
+            doc_id: (mtime, size)
+            for doc_id, mtime, size in self.cur.execute(
+                "SELECT doc_id, mtime, size FROM page_index_state"
+            ).fetchall()
+        }
+
+    def get_doc_ids(self):
+        """
+        Retrieves the ids of all pages that have tokens or an index state stored.
+
+        Returns:
+            set[str]: The page ids.
+        """
+        rows = self.cur.execute(
+            "SELECT doc_id FROM page_index_state UNION SELECT DISTINCT doc_id FROM page_index"
+        ).fetchall()
+        return {row[0] for row in rows}
+
     def delete(self, page):
         """
         This method deletes rows from the page_index table corresponding to
@@ -131,44 +533,406 @@ class PageDaoManager(object):
         Returns:
         - None
         """
-        # Remove rows from the page_index table where doc_id = page.id
-        self.cur.execute("DELETE FROM page_index WHERE doc_id=?", (page.id,))
+        self.delete_doc_ids([page.id])
 
-        # Commit changes to update the database
-        self.connection.commit()
+    def delete_doc_ids(self, doc_ids):
+        """
+        Removes the tokens and index state of all given pages in a single transaction.
 
-    def search(self, search_terms, ignore_case=True):
+        Args:
+            doc_ids (iterable[str]): The ids of the pages to remove from the index.
+
+        Returns:
+            None
+        """
+        doc_ids = [(doc_id,) for doc_id in doc_ids]
+        with self._updating_terms() as version:
+            for (doc_id,) in doc_ids:
+                self._update_statistics(doc_id, self._get_tokens(doc_id), {}, version)
+
+            # Remove rows from the page_index table where doc_id = page.id
+            self.cur.executemany("DELETE FROM page_index WHERE doc_id=?", doc_ids)
+            self.cur.executemany("DELETE FROM page_index_state WHERE doc_id=?", doc_ids)
+            self.cur.executemany("DELETE FROM page_stats WHERE doc_id=?", doc_ids)
+            self.cur.executemany("DELETE FROM page_offsets WHERE doc_id=?", doc_ids)
+            self.cur.executemany("DELETE FROM page_positions WHERE doc_id=?", doc_ids)
+
+    def clear(self):
+        """
+        Removes all tokens, index states and ranking statistics, e.g. after switching to another search backend.
+
+        Returns:
+            None
+        """
+        with self.connection:
+            self._bump_version("term_stats")
+            self._bump_version("term_stats_rebuild")
+            for table in (
+                "page_index", "page_index_state", "page_stats", "term_stats", "page_offsets", "page_positions"
+            ):
+                self.cur.execute("DELETE FROM {}".format(table))
+
+    @staticmethod
+    def split_query(text):
         """
-        Searches for pages containing all of the provided search terms.
+        Splits a search query into the terms that are looked up in the page_index table, using the same
+        tokenizer and stopwords as the indexed pages.
+
+        Args:
+            text (str): The search query as entered by the user.
+
+        Returns:
+            list[str]: The search terms.
+        """
+        # If this isn't locally imported, then a circular import error arises
+        from wiki.core import Page
+
+        return Page.remove_stopwords(Page.tokenize(text))
+
+    def complete_terms(self, prefix, limit=10):
+        """
+        Finds the indexed terms that start with a prefix, for search-as-you-type.
+
+        Args:
+            prefix (str): The word being typed.
+            limit (int): The maximum number of terms.
+
+        Returns:
+            list[str]: The normalized terms, the ones that occur on the most pages first.
+        """
+        prefix = normalize_term(prefix)
+        if not prefix:
+            return []
+        self.term_dictionary.refresh(self.cur)
+        return self.term_dictionary.prefixed(prefix, limit)
+
+    def search(self, search_terms, ignore_case=True, limit=None, ranking="bm25", offset=0, expand=True):
+        """
+        Searches for pages containing any of the provided search terms.
+
+        By default matches are ranked with Okapi BM25, which weighs rare terms higher than common ones and
+        normalizes term frequencies by the length of each page. The whole ranking runs as a single SQL query
+        that only returns the best ``limit`` pages. Case-insensitive searches look up the normalized term column
+        and case-sensitive searches the word column, so both are served by an index.
 
         Args:
             search_terms (list[str]): A list of search terms to be searched.
             ignore_case (bool): Set to True to ignore case sensitivity while searching.
+            limit (int): The maximum number of results, or None for all matching pages.
+            ranking (str): "bm25", or "frequency" to rank by the summed frequency of the search terms.
+            offset (int): The number of best matches to skip, for paging through the results.
+            expand (bool): For case-insensitive searches, also match the indexed terms that start with a search
+                           term, and for search terms that are not indexed the terms one typo away. Expanded
+                           terms weigh less than the search terms themselves, see :mod:`wiki.web.terms`.
 
         Returns:
-            dict[string, int]: A dictionary containing doc_id as the key and total_frequency as the value for matching pages.
+            dict[string, float]: A dictionary containing doc_id as the key and the score as the value for the
+            matching pages, ordered from best to worst.
 
         """
         if ignore_case:
-            search_terms = [term.lower() for term in search_terms]
-            word_compare = "LOWER(word)"
+            search_terms = [normalize_term(term) for term in search_terms]
+            word_compare = "term"
 
         else:
             word_compare = "word"
 
-        # Build a SQL query string to retrieve the documents that match the search terms
-        query = f"""
-            SELECT doc_id, SUM(frequency) as total_frequency
-            FROM page_index
-            WHERE {word_compare} IN ({', '.join('?' for _ in search_terms)})
-            GROUP BY doc_id
-            ORDER BY total_frequency DESC
-            """
+        # Drop duplicate terms but keep their order
+        search_terms = list(OrderedDict.fromkeys(search_terms))
+        if not search_terms:
+            return {}
+
+        expansions = None
+        if ignore_case and expand:
+            self.term_dictionary.refresh(self.cur)
+            expansions = self.term_dictionary.expansions(search_terms)
+            search_terms = list(expansions)
+
+        placeholders = ", ".join("?" for _ in search_terms)
+        if ranking == "frequency":
+            # Build a SQL query string to retrieve the documents that match the search terms
+            query = f"""
+                SELECT doc_id, SUM(frequency) as total_frequency
+                FROM page_index
+                WHERE {word_compare} IN ({placeholders})
+                GROUP BY doc_id
+                ORDER BY total_frequency DESC
+                LIMIT ? OFFSET ?
+                """
+            params = search_terms + [-1 if limit is None else limit, offset]
+        else:
+            query, params = self._bm25_query(search_terms, word_compare, limit, offset, expansions)
 
         # Execute the query and fetch all results
-        results = self.cur.execute(query, search_terms).fetchall()
+        results = self.cur.execute(query, params).fetchall()
 
         # Convert the results into a dictionary
         result_dict = {row[0]: row[1] for row in results}
 
         return result_dict
+
+    def _bm25_query(self, search_terms, word_compare, limit, offset=0, expansions=None):
+        # Corpus statistics: number of documents and their average length
+        doc_count, avg_length = self.cur.execute(
+            "SELECT COUNT(*), AVG(length) FROM page_stats"
+        ).fetchone()
+        avg_length = avg_length or 1
+
+        # Inverse document frequency of each search term
+        idf = self._inverse_document_frequencies(search_terms, doc_count)
+        if expansions is not None:
+            # A rare expansion weighs no more than the search term it stands for, so exact matches rank first
+            idf = {
+                term: min(idf[term], idf[source]) * weight for term, (weight, source) in expansions.items()
+            }
+
+        query = f"""
+            WITH query_terms (term, idf) AS (
+                VALUES {", ".join("(?, ?)" for _ in search_terms)}
+            ),
+            matches AS (
+                SELECT doc_id, {word_compare} AS term, SUM(frequency) AS tf
+                FROM page_index
+                WHERE {word_compare} IN ({", ".join("?" for _ in search_terms)})
+                GROUP BY doc_id, term
+            )
+            SELECT matches.doc_id,
+                   SUM(
+                       query_terms.idf * matches.tf * ({BM25_K1} + 1)
+                       / (matches.tf + {BM25_K1} * (1 - {BM25_B} + {BM25_B} * COALESCE(page_stats.length, ?) / ?))
+                   ) AS score
+            FROM matches
+            JOIN query_terms ON query_terms.term = matches.term
+            LEFT JOIN page_stats ON page_stats.doc_id = matches.doc_id
+            GROUP BY matches.doc_id
+            ORDER BY score DESC
+            LIMIT ? OFFSET ?
+            """
+        params = [value for term in search_terms for value in (term, idf[term])]
+        params += search_terms
+        params += [avg_length, avg_length, -1 if limit is None else limit, offset]
+        return query, params
+
+    def _inverse_document_frequencies(self, search_terms, doc_count):
+        terms = {term: normalize_term(term) for term in search_terms}
+        doc_freqs = dict(
+            self.cur.execute(
+                "SELECT term, doc_freq FROM term_stats WHERE term IN ({})".format(
+                    ", ".join("?" for _ in terms)
+                ),
+                list(set(terms.values())),
+            ).fetchall()
+        )
+        idf = {}
+        for term, normalized in terms.items():
+            doc_freq = doc_freqs.get(normalized, 0)
+            idf[term] = math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+        return idf
+
+    def search_query(self, query, ignore_case=True, limit=None, offset=0, expand=True, batch_size=500):
+        """
+        Searches for pages matching a parsed query with phrases, AND, OR and excluded terms (see
+        :mod:`wiki.web.query`).
+
+        Every term is looked up as a posting list, the ids of the pages that contain it in sorted order. The
+        terms of an AND group are intersected starting with the shortest list, so a rare term keeps the work
+        small even if the other terms occur on almost every page. Phrases are only checked against the
+        positions stored in the page_positions table for the pages that are left after the intersection. The
+        groups are merged and the excluded pages removed in the same sorted order. The matching pages are then
+        ranked with BM25 like :meth:`search`, a phrase scoring like its terms would with the number of times
+        the whole phrase occurs.
+
+        Args:
+            query (Query): The parsed query.
+            ignore_case (bool): Set to True to ignore case sensitivity while searching. Phrases always match
+                                case-insensitively, but their terms must also occur as given.
+            limit (int): The maximum number of results, or None for all matching pages.
+            offset (int): The number of best matches to skip, for paging through the results.
+            expand (bool): For case-insensitive searches, let single terms also match the indexed terms that start
+                           with them or are one typo away, like :meth:`search`. Phrases and excluded terms only
+                           match exactly.
+            batch_size (int): The number of pages whose positions or lengths are fetched per SQL query.
+
+        Returns:
+            dict[string, float]: A dictionary containing doc_id as the key and the score as the value for the
+            matching pages, ordered from best to worst.
+        """
+        word_compare = "term" if ignore_case else "word"
+        if ignore_case and expand:
+            self.term_dictionary.refresh(self.cur)
+
+        # Term frequencies by looked up term and page, filled while fetching the posting lists
+        frequencies = {}
+
+        def postings(terms):
+            # Pages that contain any of the terms, case variants and expansions are merged
+            new_terms = [term for term in terms if term not in frequencies]
+            for term in new_terms:
+                frequencies[term] = {}
+            if new_terms:
+                rows = self.cur.execute(
+                    "SELECT doc_id, {0}, SUM(frequency) FROM page_index WHERE {0} IN ({1}) GROUP BY doc_id, {0}".format(
+                        word_compare, ", ".join("?" for _ in new_terms)
+                    ),
+                    new_terms,
+                )
+                for doc_id, term, frequency in rows:
+                    frequencies[term][doc_id] = frequency
+            return union([sorted(frequencies[term]) for term in terms])
+
+        def analyze(item, exact):
+            tokens = self.split_query(item.text) if isinstance(item, Term) else []
+            if len(tokens) == 1:
+                term = normalize_term(tokens[0]) if ignore_case else tokens[0]
+                if ignore_case and expand and not exact:
+                    weights = self.term_dictionary.expansions([term])
+                else:
+                    weights = {term: (1, term)}
+                return _SearchItem(weights, None, postings(list(weights)))
+            phrase = self.phrase_terms(item.text, ignore_case)
+            if not phrase:
+                return None
+            if len(phrase) == 1:
+                return _SearchItem({phrase[0][0]: (1, phrase[0][0])}, None, postings([phrase[0][0]]))
+            # The phrase can only occur on pages that contain all of its terms
+            candidates = [postings([term]) for term, _ in phrase]
+            candidates.sort(key=len)
+            doc_ids = candidates[0]
+            for other in candidates[1:]:
+                doc_ids = intersect(doc_ids, other)
+            return _SearchItem({term: (1, term) for term, _ in phrase}, phrase, doc_ids)
+
+        phrase_counts = {}
+
+        def match_phrase(item, doc_ids):
+            # Narrows the candidate pages down to those where the phrase occurs
+            counts = self._count_phrases(item.phrase, doc_ids, batch_size)
+            phrase_counts.setdefault(id(item), {}).update(counts)
+            return [doc_id for doc_id in doc_ids if counts.get(doc_id)]
+
+        groups = []
+        for group in query.groups:
+            items = [analyze(item, exact=False) for item in group]
+            items = [item for item in items if item is not None]
+            if items:
+                groups.append(items)
+
+        results = []
+        for items in groups:
+            doc_ids = None
+            for item in sorted(items, key=lambda item: len(item.doc_ids)):
+                doc_ids = item.doc_ids if doc_ids is None else intersect(doc_ids, item.doc_ids)
+            for item in items:
+                if item.phrase is not None:
+                    doc_ids = match_phrase(item, doc_ids)
+            results.append(doc_ids)
+        doc_ids = union(results)
+
+        for item in query.excluded:
+            if not doc_ids:
+                break
+            item = analyze(item, exact=True)
+            if item is None:
+                continue
+            excluded = intersect(doc_ids, item.doc_ids)
+            if item.phrase is not None:
+                excluded = match_phrase(item, excluded)
+            doc_ids = difference(doc_ids, excluded)
+        if not doc_ids:
+            return {}
+
+        # Rank the matching pages with BM25
+        doc_count, avg_length = self.cur.execute(
+            "SELECT COUNT(*), AVG(length) FROM page_stats"
+        ).fetchone()
+        avg_length = avg_length or 1
+        lengths = {}
+        for start in range(0, len(doc_ids), batch_size):
+            batch = doc_ids[start:start + batch_size]
+            lengths.update(
+                self.cur.execute(
+                    "SELECT doc_id, length FROM page_stats WHERE doc_id IN ({})".format(
+                        ", ".join("?" for _ in batch)
+                    ),
+                    batch,
+                ).fetchall()
+            )
+        idf = self._inverse_document_frequencies(list(frequencies), doc_count)
+
+        def bm25(term, source, weight, tf, length):
+            # An expansion weighs no more than the search term it stands for, like in search()
+            norm = 1 - BM25_B + BM25_B * length / avg_length
+            return min(idf[term], idf[source]) * weight * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+
+        scores = {}
+        for doc_id in doc_ids:
+            length = lengths.get(doc_id, avg_length)
+            score = 0
+            for item in (item for items in groups for item in items):
+                if item.phrase is not None:
+                    count = phrase_counts.get(id(item), {}).get(doc_id)
+                    if count:
+                        score += sum(bm25(term, term, 1, count, length) for term in item.weights)
+                    continue
+                for term, (weight, source) in item.weights.items():
+                    tf = frequencies[term].get(doc_id)
+                    if tf:
+                        score += bm25(term, source, weight, tf, length)
+            scores[doc_id] = score
+
+        ranked = sorted(scores.items(), key=lambda result: -result[1])
+        ranked = ranked[offset:] if limit is None else ranked[offset:offset + limit]
+        return OrderedDict(ranked)
+
+    @staticmethod
+    def phrase_terms(text, ignore_case=True):
+        """
+        Splits a phrase into the terms that are looked up and their position in the phrase. Stopwords are left
+        out like in the indexed pages, but still count as a position.
+
+        Args:
+            text (str): The phrase.
+            ignore_case (bool): Set to True to normalize the terms.
+
+        Returns:
+            list[tuple[str, int]]: The terms and their positions.
+        """
+        # If this isn't locally imported, then a circular import error arises
+        from wiki.core import Page
+
+        stopwords = nlp.stopword_set("english")
+        terms = []
+        for position, token in enumerate(Page.tokenize(text)):
+            if token not in stopwords:
+                terms.append((normalize_term(token) if ignore_case else token, position))
+        return terms
+
+    def _count_phrases(self, phrase, doc_ids, batch_size=500):
+        # The positions of every term are stored case-insensitively, see _store_positions
+        first_position = phrase[0][1]
+        terms = {normalize_term(term) for term, _ in phrase}
+        counts = {}
+        for start in range(0, len(doc_ids), batch_size):
+            batch = doc_ids[start:start + batch_size]
+            positions = {}
+            rows = self.cur.execute(
+                "SELECT doc_id, term, positions FROM page_positions WHERE term IN ({}) AND doc_id IN ({})".format(
+                    ", ".join("?" for _ in terms), ", ".join("?" for _ in batch)
+                ),
+                list(terms) + batch,
+            )
+            for doc_id, term, blob in rows:
+                positions.setdefault(doc_id, {})[term] = decode_positions(blob)
+            for doc_id, term_positions in positions.items():
+                if len(term_positions) < len(terms):
+                    continue
+                # Start positions of the phrase where every term is at its offset from the first one
+                starts = None
+                for term, position in phrase:
+                    shifted = {value - position + first_position for value in term_positions[normalize_term(term)]}
+                    starts = shifted if starts is None else starts & shifted
+                    if not starts:
+                        break
+                if starts:
+                    counts[doc_id] = len(starts)
+        return counts
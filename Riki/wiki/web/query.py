@@ -0,0 +1,90 @@
+"""
+    Query language
+    ~~~~~~~~~~~~~~
+
+Parses search queries with a small boolean syntax:
+
+* ``"exact phrase"`` matches the words next to each other, in order
+* ``-term`` or ``-"a phrase"`` excludes the pages that match it
+* ``a AND b`` only matches pages that contain both, ``a OR b`` pages that
+  contain either; operators are upper case, AND binds tighter than OR
+* ``a b`` without an operator is ``a OR b``, as it has always been
+
+A query is kept as a disjunction of conjunctions plus the excluded
+terms, e.g. ``a AND "b c" OR d -e`` becomes ``[[a, "b c"], [d]]`` and
+``[e]``. There are no parentheses. The terms are the raw query text,
+each search backend splits them into its own index terms.
+"""
+import re
+from collections import namedtuple
+
+# An optionally excluded quoted phrase or a single word
+QUERY_REGEX = re.compile(r'(-?)"([^"]*)"?|(\S+)')
+
+OPERATORS = ("AND", "OR")
+
+
+class Term(namedtuple("Term", "text")):
+    pass
+
+
+class Phrase(namedtuple("Phrase", "text")):
+    pass
+
+
+class Query(namedtuple("Query", "groups excluded")):
+    """
+    A parsed search query.
+
+    :ivar list groups: lists of terms and phrases that must all match, one of the lists has to match
+    :ivar list excluded: terms and phrases that must not match
+    """
+
+    @property
+    def is_simple(self):
+        """
+        Whether the query is a plain list of words without operators, phrases
+        or exclusions, which the search backends rank as before.
+        """
+        return not self.excluded and all(
+            len(group) == 1 and isinstance(group[0], Term) for group in self.groups
+        )
+
+    @property
+    def terms(self):
+        """
+        The terms and phrases that a page can match, e.g. to highlight them.
+        """
+        return [item for group in self.groups for item in group]
+
+
+def parse_query(text):
+    """
+    Parses a search query.
+
+    :param str text: the query as entered by the user
+    :returns: the parsed query
+    :rtype: Query
+    """
+    groups, excluded = [[]], []
+    operator = "OR"
+    for match in QUERY_REGEX.finditer(text):
+        negated, phrase, word = match.groups()
+        if word in OPERATORS:
+            operator = word
+            continue
+        if phrase is not None:
+            item = Phrase(phrase)
+        elif word.startswith("-") and len(word) > 1:
+            negated, item = "-", Term(word[1:])
+        else:
+            item = Term(word)
+
+        if negated:
+            excluded.append(item)
+            continue
+        if operator == "OR" and groups[-1]:
+            groups.append([])
+        groups[-1].append(item)
+        operator = "OR"
+    return Query([group for group in groups if group], excluded)
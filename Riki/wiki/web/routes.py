@@ -4,9 +4,11 @@
 """
 import os
 import config
-from io import BytesIO
+from flask import abort
 from flask import Blueprint
+from flask import current_app
 from flask import flash
+from flask import jsonify
 from flask import redirect
 from flask import render_template
 from flask import request
@@ -16,6 +18,7 @@ from flask_login import current_user
 from flask_login import login_required
 from flask_login import login_user
 from flask_login import logout_user
+from werkzeug.utils import secure_filename
 
 
 from wiki.core import Processor
@@ -25,15 +28,27 @@ from wiki.web.forms import LoginForm
 from wiki.web.forms import SignupForm
 from wiki.web.forms import SearchForm
 from wiki.web.forms import URLForm
+from wiki.web.catalogDAO import CatalogDaoManager
+from wiki.web.completions import DEFAULT_LIMIT
+from wiki.web.completions import get_title_index
+from wiki.web.completions import MAX_LIMIT
+from wiki.web.completions import update_titles
 from wiki.web import current_wiki
 from wiki.web import current_users
 from wiki.web.userDAO import protect
 from wiki.web.userDAO import UserDaoManager
 from wiki.web.userDAO import UserDao
 from wiki.web.imageDAO import ImageDAO
-from wiki.web.pageDAO import PageDaoManager
+from wiki.web.images import get_derivative
+from wiki.web.images import get_executor
+from wiki.web.images import image_format
+from wiki.web.images import list_images
+from wiki.web.images import save_upload
+from wiki.web.images import schedule
+from wiki.web.images import SIZES
+from wiki.web.images import verify
+from wiki.web.pageDAO import get_search_dao
 import sqlite3
-from PIL import Image
 
 bp = Blueprint("wiki", __name__)
 
@@ -83,9 +98,10 @@ def edit(url):
 
         form.populate_obj(page)
         page.save()
+        update_titles([current_wiki.catalog_entry(page)])
 
         # Connect to the database
-        pageDaoManager = PageDaoManager()
+        pageDaoManager = get_search_dao()
 
         # Update the page index
         pageDaoManager.update_page_index(page)
@@ -135,10 +151,12 @@ def move(url):
         current_wiki.move(url, newurl)
 
         # Get the id of the new page
-        new_page_id = current_wiki.get(newurl).id
+        new_page = current_wiki.get(newurl)
+        new_page_id = new_page.id
+        update_titles([current_wiki.catalog_entry(new_page)], removed_paths=[page.path])
 
         # Connect to the database
-        pageDaoManager = PageDaoManager()
+        pageDaoManager = get_search_dao()
 
         # Update the page_index tokens to point to the new page id
         pageDaoManager.update_page_index_id(new_page_id, old_page_id)
@@ -157,8 +175,9 @@ def move(url):
 def delete(url):
     page = current_wiki.get_or_404(url)
     current_wiki.delete(url)
+    update_titles(removed_paths=[page.path])
 
-    pageDaoManager = PageDaoManager()
+    pageDaoManager = get_search_dao()
     pageDaoManager.delete(page)
 
     flash('Page "%s" was deleted.' % page.title, "success")
@@ -185,16 +204,79 @@ def tag(name):
 def search():
     form = SearchForm()
     if form.validate_on_submit():
-        # Old search method
-        # results = current_wiki.search(form.term.data, form.ignore_case.data)
-
-        # Uses newly created search engine
-        results = current_wiki.search(form.term.data, form.ignore_case.data)
-
-        return render_template(
-            "search.html", form=form, results=results, search=form.term.data
-        )
-    return render_template("search.html", form=form, search=None)
+        term, ignore_case, offset = form.term.data, form.ignore_case.data, 0
+    elif request.method == "GET" and request.args.get("q"):
+        # the next pages of a search, see the link below the results
+        term = form.term.data = request.args["q"]
+        ignore_case = request.args.get("ignore_case", "true").lower() not in ("0", "false")
+        form.ignore_case.data = ignore_case
+        offset = max(request.args.get("offset", 0, type=int), 0)
+    else:
+        return render_template("search.html", form=form, search=None)
+
+    # Old search method
+    # results = current_wiki.search(form.term.data, form.ignore_case.data)
+
+    # Uses newly created search engine, one page of results at a time and one extra
+    # result that tells whether there is a next page, like /search/results/
+    limit = current_app.config.get("SEARCH_PAGE_SIZE", 20)
+    results = current_wiki.search(term, ignore_case, limit=limit + 1, offset=offset, snippets=True)
+
+    return render_template(
+        "search.html",
+        form=form,
+        results=results[:limit],
+        search=term,
+        ignore_case=ignore_case,
+        next_offset=offset + limit if len(results) > limit else None,
+    )
+
+
+@bp.route("/search/results/", methods=["GET"])
+@protect
+def search_results():
+    # One page of search results as JSON, e.g. ?q=term&offset=20&limit=20
+    term = request.args.get("q", "")
+    ignore_case = request.args.get("ignore_case", "true").lower() not in ("0", "false")
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+
+    # one extra result tells whether there is a next page; search returns every hit of the
+    # window, hits of deleted pages are dropped from the index and replaced by the next ones
+    pages = current_wiki.search(term, ignore_case, limit=limit + 1, offset=offset, snippets=True)
+    return jsonify(
+        results=[
+            {"url": page.url, "title": page.title, "snippet": None if page.snippet is None else str(page.snippet)}
+            for page in pages[:limit]
+        ],
+        offset=offset,
+        limit=limit,
+        next_offset=offset + limit if len(pages) > limit else None,
+    )
+
+
+@bp.route("/search/complete/", methods=["GET"])
+@protect
+def search_complete():
+    # Title and term completions for search-as-you-type, e.g. ?q=getting+sta
+    prefix = request.args.get("q", "")
+    limit = min(max(request.args.get("limit", DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+
+    titles = get_title_index()
+    if not titles.loaded:
+        # catalogues the pages that were added since the catalog was last updated
+        current_wiki.index()
+    titles.refresh(CatalogDaoManager())
+
+    # only the word that is still being typed is completed to a term
+    words = prefix.split()
+    terms = []
+    if words and not prefix[-1].isspace():
+        terms = get_search_dao().complete_terms(words[-1], limit)
+    return jsonify(
+        titles=[{"url": url, "title": title} for url, title in titles.complete(prefix, limit)],
+        terms=terms,
+    )
 
 
 @bp.route("/user/login/", methods=["GET", "POST"])
@@ -247,8 +329,6 @@ def user_create():
         user.set_authenticated(True)
         flash('Sign up successful.')
 
-        current_users.close_db()
-
         return redirect(request.args.get("next") or url_for("wiki.index"))
     return render_template("signup.html", form=form)
 
@@ -270,70 +350,96 @@ def user_profile():
     return render_template('profile.html', user=current_user)
 
 # Image uploading
-def allowed_file(filename): 
-        dao = ImageDAO()
-        ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
-        if dao.filename_exists(filename):
-            dao.close_db()
-            return False
-        if not ('.' in filename and \
-        filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS):
-            dao.close_db()
-            return False
-        return True
+def allowed_file(filename):
+    # Reused file names are caught by the unique constraint on images.filename
+    ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def process_upload(app, filename):
+    """
+    Runs in the image worker pool: decodes a freshly uploaded image and
+    encodes its sizes, or removes it again if it is not a valid image.
+    """
+    if verify(filename):
+        schedule(filename)
+        return
+    with app.app_context():
+        ImageDAO().delete_image(filename)
+    os.unlink(os.path.join(config.PIC_BASE, filename))
+
 
 @bp.route('/user/upload/', methods=['POST'])
 @login_required
 def upload_image():
+    # request.files streams the upload into a temporary file, anything above
+    # MAX_CONTENT_LENGTH is rejected with 413 before it is read
     if 'an_image' not in request.files:
         flash('There is no image!')
         return redirect(request.referrer)
     image = request.files['an_image']
     if image.filename != '':
-        if allowed_file(image.filename):
-            path = os.path.join(config.PIC_BASE, image.filename)
-            image.save(path)
+        # the name ends up in paths below PIC_BASE, so names that would have to be
+        # changed to be safe there, e.g. "../x.jpg", are rejected
+        filename = secure_filename(image.filename)
+        if filename == image.filename and allowed_file(filename):
             imageDAO = ImageDAO()
-            imageDAO.save_image(image.filename, email=current_user.email)
-            imageDAO.close_db()
-            flash('Image Saved!')
-            return redirect(request.referrer)
-        else:
-            flash('File name not allowed! Either unsupported type (jpg, jpeg, png are supported file types) or reused file name.')
-            return redirect(request.referrer)
-    
-    
+            try:
+                imageDAO.save_image(filename, email=current_user.email)
+            except sqlite3.IntegrityError:
+                imageDAO.connection.rollback()
+            else:
+                try:
+                    save_upload(image.stream, filename)
+                except BaseException:
+                    imageDAO.delete_image(filename)
+                    raise
+                get_executor().submit(
+                    process_upload, current_app._get_current_object(), filename
+                )
+                flash('Image Saved!')
+                return redirect(request.referrer)
+        flash('File name not allowed! Either unsupported type (jpg, jpeg, png are supported file types) or reused file name.')
+        return redirect(request.referrer)
+
+
+@bp.errorhandler(413)
+def image_too_large(error):
+    flash('The image is too large!')
+    return redirect(request.referrer or url_for('wiki.index_images'))
+
 @bp.route('/user/images/')
 @login_required
 def user_images():
     dao = ImageDAO()
     images = dao.get_user_images(current_user.email)
-    dao.close_db()
     return render_template('user_images.html', images = images)
     
 @bp.route('/img/')
 def index_images():
-    images = os.listdir(config.PIC_BASE)
-    dao = ImageDAO()
-    final = []
-    for filename in images:
-        arr = []
-        arr.append(filename)
-        arr.append(dao.get_image_owner(filename))
-        final.append(arr)
-    return render_template('index_images.html', images=final)
+    # one page of images at a time, the cursor is the last file name of the previous page
+    after = request.args.get("after")
+    names, more = list_images(after, current_app.config.get("GALLERY_PAGE_SIZE", 50))
+    owners = ImageDAO().get_image_owners(names)
+    images = [(filename, owners.get(filename)) for filename in names]
+    return render_template(
+        'index_images.html', images=images, next_cursor=names[-1] if more else None
+    )
 
 
 @bp.route("/img/<string:filename>/", methods=["GET"])
 def view_image(filename):
-    type = filename.rsplit(".", 1)[1].upper()
-    if type == "JPG":
-        type = "JPEG"
-    img = Image.open(os.path.join(config.PIC_BASE, filename))
-    img_io = BytesIO()
-    img.save(img_io, type, quality=70)
-    img_io.seek(0)
-    return send_file(img_io, mimetype="image/" + type.lower())
+    # The image is encoded once per size and then streamed from the derivative
+    # cache, send_file answers conditional requests with 304 Not Modified
+    size = request.args.get("size", "full")
+    if size not in SIZES:
+        abort(400)
+    path = get_derivative(filename, size)
+    if path is None:
+        abort(404)
+    return send_file(
+        path, mimetype="image/" + image_format(filename).lower(), conditional=True
+    )
 
 
 """
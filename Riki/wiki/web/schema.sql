@@ -1,5 +1,4 @@
-
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     first_name TEXT NOT NULL,
     last_name TEXT NOT NULL,
@@ -7,15 +6,72 @@ CREATE TABLE users (
     password TEXT NOT NULL
 );
 
-CREATE TABLE images (
+CREATE TABLE IF NOT EXISTS images (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     filename TEXT UNIQUE NOT NULL,
     email INTEGER NOT NULL
 );
 
-CREATE TABLE page_index (
+CREATE INDEX IF NOT EXISTS images_email ON images (email);
+
+CREATE TABLE IF NOT EXISTS page_index (
     word TEXT NOT NULL,
     doc_id TEXT NOT NULL,
     frequency INTEGER NOT NULL,
+    term TEXT NOT NULL DEFAULT '',
     PRIMARY KEY (word, doc_id)
-);
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS page_index_term ON page_index (term, doc_id, frequency);
+
+CREATE TABLE IF NOT EXISTS page_offsets (
+    doc_id TEXT NOT NULL,
+    term TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (doc_id, term)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS page_positions (
+    term TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    positions BLOB NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS page_positions_doc_id ON page_positions (doc_id);
+
+CREATE TABLE IF NOT EXISTS page_index_state (
+    doc_id TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS page_stats (
+    doc_id TEXT PRIMARY KEY,
+    length INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS term_stats (
+    term TEXT PRIMARY KEY,
+    doc_freq INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS term_stats_version ON term_stats (version);
+
+CREATE TABLE IF NOT EXISTS page_catalog (
+    path TEXT PRIMARY KEY,
+    id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    title TEXT,
+    tags TEXT,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS page_catalog_id ON page_catalog (id);
+
+CREATE TABLE IF NOT EXISTS table_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
@@ -0,0 +1,31 @@
+CREATE TABLE IF NOT EXISTS page_text (
+    id INTEGER PRIMARY KEY,
+    doc_id TEXT UNIQUE NOT NULL,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS page_fts USING fts5 (
+    title,
+    body,
+    content = 'page_text',
+    content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS page_text_insert AFTER INSERT ON page_text BEGIN
+    INSERT INTO page_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS page_text_delete AFTER DELETE ON page_text BEGIN
+    INSERT INTO page_fts (page_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS page_text_update AFTER UPDATE OF title, body ON page_text BEGIN
+    INSERT INTO page_fts (page_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    INSERT INTO page_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+-- rank with bm25(), matches in the title weigh twice as much as matches in the body
+INSERT INTO page_fts (page_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0)');
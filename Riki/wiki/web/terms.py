@@ -0,0 +1,319 @@
+"""
+    Term dictionary
+    ~~~~~~~~~~~~~~~
+
+An in-memory dictionary of the normalized terms in the search index,
+used to expand search terms before their postings are looked up: a
+term also matches the indexed terms it is a prefix of, so "deploy"
+finds "deployment", and a term that is not indexed at all matches the
+indexed terms one typo away from it.
+
+The terms are kept in a sorted list for prefix lookups and in a dict
+with their document frequencies. Typos are found by generating every
+string one edit (a deletion, transposition, substitution or insertion)
+away from the search term and looking them up in the dict, which takes
+well under a millisecond on a million-term vocabulary and needs no
+index besides the dict itself.
+
+Each process loads the dictionary from the ``term_stats`` table on
+first use. Index updates made by the process are applied to it right
+away. Every transaction that changes ``term_stats`` bumps its version
+in ``table_versions`` and stamps the rows it writes with it, terms that
+no page contains anymore are kept with a document frequency of 0, so
+the next search of another process (e.g. after ``flask reindex``) only
+re-reads the rows stamped since the version it last saw. Rebuilding the
+statistics bumps the ``term_stats_rebuild`` version as well, and the
+dictionary is then loaded again as a whole: outside of the lock the
+lookups take, which keep using the old terms until it is done.
+"""
+import bisect
+import heapq
+import os
+import threading
+from collections import Counter
+
+# Prefix expansion only for search terms of at least this length
+MIN_PREFIX_LENGTH = 3
+# Typo expansion only for search terms of at least this length
+MIN_TYPO_LENGTH = 4
+# Indexed terms added per search term, the most frequent ones win
+MAX_EXPANSIONS = 10
+# Prefix matches considered before the most frequent ones are picked
+MAX_PREFIX_SCAN = 1000
+# Weight of the expanded terms relative to the search term itself
+PREFIX_WEIGHT = 0.7
+TYPO_WEIGHT = 0.5
+# Characters tried for substitutions and insertions
+MAX_ALPHABET = 100
+# Terms added since the last merge into the sorted list
+MERGE_THRESHOLD = 1000
+
+_lock = threading.Lock()
+_dictionaries = {}
+
+
+class TermDictionary(object):
+    """
+    The distinct normalized terms of the search index of one database.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._doc_freqs = {}
+        self._sorted = []
+        self._added = []
+        self._alphabet = ""
+        self._version = None
+        self._rebuild = None
+
+    def __len__(self):
+        return len(self._doc_freqs)
+
+    def __contains__(self, term):
+        return term in self._doc_freqs
+
+    @property
+    def loaded(self):
+        return self._version is not None
+
+    def load(self, rows, version=0, rebuild=0):
+        """
+        Replaces the terms of the dictionary. The new terms are sorted
+        before the lock is taken, lookups use the old ones meanwhile.
+
+        :param rows: the term and document frequency of every term
+        :param int version: the version of ``term_stats`` the rows were read at
+        :param int rebuild: the ``term_stats_rebuild`` version they were read at
+        """
+        doc_freqs = {term: doc_freq for term, doc_freq in rows if doc_freq > 0}
+        terms = sorted(doc_freqs)
+        counts = Counter("".join(terms))
+        alphabet = "".join(char for char, _ in counts.most_common(MAX_ALPHABET))
+        with self._lock:
+            self._doc_freqs = doc_freqs
+            self._sorted = terms
+            self._added = []
+            self._alphabet = alphabet
+            self._version = version
+            self._rebuild = rebuild
+
+    def refresh(self, cur):
+        """
+        Loads the dictionary on first use or after the statistics were
+        rebuilt, and otherwise only the terms that changed in ``term_stats``
+        since the last refresh. While one thread loads the dictionary again,
+        the others go on with the old terms instead of waiting for it.
+
+        :param cur: a cursor of the database the dictionary belongs to
+        """
+        versions = dict(
+            cur.execute(
+                "SELECT name, version FROM table_versions WHERE name IN ('term_stats', 'term_stats_rebuild')"
+            ).fetchall()
+        )
+        version = versions.get("term_stats", 0)
+        rebuild = versions.get("term_stats_rebuild", 0)
+        if rebuild != self._rebuild:
+            # first use, or the statistics were rebuilt from scratch
+            if not self._load_lock.acquire(blocking=not self.loaded):
+                return
+            try:
+                if rebuild != self._rebuild:
+                    self.load(cur.execute("SELECT term, doc_freq FROM term_stats"), version, rebuild)
+            finally:
+                self._load_lock.release()
+        elif version != self._version:
+            rows = cur.execute(
+                "SELECT term, doc_freq FROM term_stats WHERE version > ?", (self._version,)
+            ).fetchall()
+            self._update(rows, version)
+
+    def applied(self, version):
+        """
+        Records that the changes of a transaction of this process, which
+        bumped the version of ``term_stats`` to the given one, were applied
+        with :meth:`add` and :meth:`remove` already, so the next refresh
+        does not read them again.
+
+        :param int version: the version the transaction wrote
+        """
+        with self._lock:
+            if self._version == version - 1:
+                self._version = version
+
+    def invalidate(self):
+        """
+        Loads the whole dictionary again on the next refresh.
+        """
+        with self._lock:
+            self._rebuild = None
+
+    def _update(self, rows, version):
+        with self._lock:
+            if version <= self._version:
+                return
+            for term, doc_freq in rows:
+                if doc_freq <= 0:
+                    # the sorted lists skip terms that are not in the dict
+                    self._doc_freqs.pop(term, None)
+                elif term in self._doc_freqs:
+                    self._doc_freqs[term] = doc_freq
+                else:
+                    self._doc_freqs[term] = doc_freq
+                    self._insert(term)
+            self._version = version
+
+    def _insert(self, term):
+        # New terms go to a short sorted list first, inserting into the long
+        # one would move a million pointers each time
+        bisect.insort(self._added, term)
+        for char in term:
+            if char not in self._alphabet and len(self._alphabet) < MAX_ALPHABET:
+                self._alphabet += char
+        if len(self._added) > MERGE_THRESHOLD:
+            self._sorted = sorted(
+                {term for term in self._sorted + self._added if term in self._doc_freqs}
+            )
+            self._added = []
+
+    def add(self, term):
+        """
+        Counts one more page that contains the term. Does nothing until the
+        dictionary was loaded, since loading reads the current counts anyway.
+
+        :param str term: the normalized term
+        """
+        with self._lock:
+            if not self.loaded:
+                return
+            if term not in self._doc_freqs:
+                self._doc_freqs[term] = 0
+                self._insert(term)
+            self._doc_freqs[term] += 1
+
+    def remove(self, term):
+        """
+        Counts one page less that contains the term, and forgets it once no
+        page contains it anymore.
+
+        :param str term: the normalized term
+        """
+        with self._lock:
+            doc_freq = self._doc_freqs.get(term)
+            if not self.loaded or doc_freq is None:
+                return
+            if doc_freq <= 1:
+                # the sorted lists skip terms that are not in the dict
+                del self._doc_freqs[term]
+            else:
+                self._doc_freqs[term] = doc_freq - 1
+
+    def _most_frequent(self, terms, limit):
+        return heapq.nlargest(limit, terms, key=lambda term: self._doc_freqs[term])
+
+    def prefixed(self, prefix, limit=MAX_EXPANSIONS):
+        """
+        Returns the most frequent terms that start with the given prefix.
+
+        :param str prefix: the normalized prefix
+        :param int limit: the maximum number of terms
+        :rtype: list
+        """
+        with self._lock:
+            # a term that was removed and added again can be in both lists
+            matches = set()
+            for terms in (self._sorted, self._added):
+                index = bisect.bisect_left(terms, prefix)
+                for term in terms[index:index + MAX_PREFIX_SCAN]:
+                    if not term.startswith(prefix):
+                        break
+                    if term in self._doc_freqs:
+                        matches.add(term)
+            return self._most_frequent(matches, limit)
+
+    def similar(self, term, limit=MAX_EXPANSIONS):
+        """
+        Returns the most frequent terms one edit away from the given term.
+
+        :param str term: the normalized term
+        :param int limit: the maximum number of terms
+        :rtype: list
+        """
+        with self._lock:
+            candidates = edits(term, self._alphabet)
+            candidates.discard(term)
+            return self._most_frequent(
+                [candidate for candidate in candidates if candidate in self._doc_freqs], limit
+            )
+
+    def expand(self, terms):
+        """
+        Expands normalized search terms with the indexed terms they are a
+        prefix of, and terms that are not indexed with the indexed terms one
+        typo away from them.
+
+        :param list terms: the normalized search terms
+        :returns: the weight of every term to look up, 1 for the search terms
+        :rtype: dict
+        """
+        return {term: weight for term, (weight, _) in self.expansions(terms).items()}
+
+    def expansions(self, terms):
+        """
+        Expands normalized search terms like :meth:`expand`, and also tells
+        which search term every looked up term stands for, so that it is
+        never ranked above that term.
+
+        :param list terms: the normalized search terms
+        :returns: the weight of every term to look up and the search term it expands
+        :rtype: dict
+        """
+        expansions = {term: (1, term) for term in terms}
+        for term in terms:
+            matches = []
+            if len(term) >= MIN_PREFIX_LENGTH:
+                matches += [(match, PREFIX_WEIGHT) for match in self.prefixed(term)]
+            if len(term) >= MIN_TYPO_LENGTH and term not in self:
+                matches += [(match, TYPO_WEIGHT) for match in self.similar(term)]
+            for match, weight in matches:
+                if weight > expansions.get(match, (0, None))[0]:
+                    expansions[match] = (weight, term)
+        return expansions
+
+
+def edits(term, alphabet):
+    """
+    Returns every string one deletion, transposition, substitution or
+    insertion away from the given term.
+
+    :param str term: the term
+    :param str alphabet: the characters to substitute and insert
+    :rtype: set
+    """
+    splits = [(term[:i], term[i:]) for i in range(len(term) + 1)]
+    result = {left + right[1:] for left, right in splits if right}
+    result.update(
+        left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1
+    )
+    result.update(
+        left + char + right[1:] for left, right in splits if right for char in alphabet
+    )
+    result.update(left + char + right for left, right in splits for char in alphabet)
+    return result
+
+
+def get_term_dictionary(database):
+    """
+    Returns the term dictionary of the given database, shared by all
+    threads of the process.
+
+    :param str database: the path of the database
+    :rtype: TermDictionary
+    """
+    key = (os.getpid(), database)
+    with _lock:
+        dictionary = _dictionaries.get(key)
+        if dictionary is None:
+            dictionary = _dictionaries[key] = TermDictionary()
+        return dictionary
@@ -1,4 +1,7 @@
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from werkzeug.security import generate_password_hash, check_password_hash
 from wiki.web.db import *
 from functools import wraps
@@ -34,10 +37,69 @@ class UserDao(object):
     return check_password_hash(self.password, password)
 
 
-class UserDaoManager(object):
+class UserCache(object):
+  """
+  A process wide cache of user rows with a short time to live, so that
+  authenticated requests do not query the users table each time.
+
+  Rows are keyed on the database and the email. The cache only holds
+  plain tuples, every request builds its own UserDao objects from them.
+  Changes made through UserDaoManager invalidate the cache right away,
+  changes made by other processes are picked up once the entry expires.
+  """
+
+  def __init__(self, ttl=30, max_entries=10000):
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self._rows = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, database, email):
+    with self._lock:
+      entry = self._rows.get((database, email))
+      if entry is None:
+        return None
+      row, expires = entry
+      if expires < time.monotonic():
+        del self._rows[(database, email)]
+        return None
+      return row
+
+  def put(self, database, email, row):
+    if self.ttl <= 0:
+      return
+    with self._lock:
+      self._rows[(database, email)] = (tuple(row), time.monotonic() + self.ttl)
+      self._rows.move_to_end((database, email))
+      while len(self._rows) > self.max_entries:
+        self._rows.popitem(last=False)
+
+  def invalidate(self, database, email=None):
+    """
+    Drops the cached row of one user, or of all users of the database.
+    """
+    with self._lock:
+      if email is not None:
+        self._rows.pop((database, email), None)
+        return
+      for key in list(self._rows):
+        if key[0] == database:
+          del self._rows[key]
+
+  def clear(self):
+    with self._lock:
+      self._rows.clear()
+
+
+user_cache = UserCache()
+
+
+class UserDaoManager(BaseDao):
   def __init__(self):
-      self.connection = get_db()
-      self.cur = self.connection.cursor()
+    super(UserDaoManager, self).__init__()
+    self.database = current_app.config["DATABASE"]
+    # identity map: every user is loaded at most once per app context
+    self._users = {}
 
   def create_user(self, user):
     hashedPassword = generate_password_hash(user.password, method='sha256')
@@ -46,6 +108,7 @@ class UserDaoManager(object):
       (user.first_name, user.last_name, user.email, hashedPassword)
     )
     self.connection.commit()
+    self._forget(user.email)
 
     
 
@@ -57,18 +120,28 @@ class UserDaoManager(object):
     return result
   
   def get_user(self, email):
-    self.cur.execute(
-      "SELECT * FROM users WHERE email = (?)", ((email,))
-    )
-    user = self.cur.fetchone()
+    if email in self._users:
+      return self._users[email]
+
+    user = user_cache.get(self.database, email)
     if user is None:
-      return None
+      self.cur.execute(
+        "SELECT * FROM users WHERE email = (?)", ((email,))
+      )
+      user = self.cur.fetchone()
+      if user is not None:
+        user_cache.put(self.database, email, user)
+
+    if user is None:
+      self._users[email] = None
     else:
-      return UserDao(user[1], user[2], user[3], user[4])
+      self._users[email] = UserDao(user[1], user[2], user[3], user[4])
+    return self._users[email]
   
   def delete_all_users(self):
     self.cur.execute("DELETE FROM users")
     self.connection.commit()
+    self._forget()
   
   def delete_user(self, email):
     user = self.get_user(email)
@@ -77,12 +150,18 @@ class UserDaoManager(object):
         "DELETE FROM users WHERE email = (?)", ((email,))
       )
       self.connection.commit()
+      self._forget(email)
       return True
     else:
       return False
 
-  def close_db(self):
-    self.connection.close()
+  def _forget(self, email=None):
+    # drop a changed user, or all users, from the identity map and the process cache
+    if email is None:
+      self._users.clear()
+    else:
+      self._users.pop(email, None)
+    user_cache.invalidate(self.database, email)
 
 def protect(f):
   @wraps(f)